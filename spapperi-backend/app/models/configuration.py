@@ -1,8 +1,8 @@
 """
 Pydantic models for configuration data.
 """
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict
 from uuid import UUID
 
 
@@ -16,6 +16,7 @@ class RootDimensions(BaseModel):
 
 class LayoutDetails(BaseModel):
     """Layout measurements for planting configuration"""
+    number_of_rows: Optional[int] = None  # File (single) or bine (twin)
     IF: Optional[float] = None  # Interfila
     IP: Optional[float] = None  # Interpianta
     IB: Optional[float] = None  # Interbina (only for twin rows)
@@ -71,3 +72,57 @@ class ConfigurationData(BaseModel):
     vat_number: Optional[str] = None
     
     is_complete: bool = False
+
+
+class ConfigurationSubmission(BaseModel):
+    """A complete configuration submitted in one request, bypassing the chat"""
+    
+    # Phase 1: Plant
+    crop_type: str
+    root_type: str
+    root_dimensions: RootDimensions
+    
+    # Phase 2: Layout
+    row_type: str
+    layout_details: LayoutDetails
+    
+    # Phase 3: Environment
+    environment: str
+    is_raised_bed: bool = False
+    raised_bed_details: Optional[RaisedBedDetails] = None
+    is_mulch: bool = False
+    mulch_details: Optional[MulchDetails] = None
+    soil_type: str
+    
+    # Phase 4: Tractor
+    wheel_distance: float
+    tractor_hp: int
+    
+    # Phase 5: Accessories
+    accessories_primary: List[str] = []
+    accessories_secondary: List[str] = []
+    accessories_element: List[str] = []
+    
+    # Phase 6: Closing
+    user_notes: Optional[str] = None
+    is_interested: bool = False
+    contact_email: Optional[str] = None
+    vat_number: Optional[str] = None
+    
+    # Generate recommendation, PDF report and quote email like a completed chat
+    run_completion: bool = False
+
+
+class ConfigurationBatch(BaseModel):
+    """Several submissions processed with bounded concurrency"""
+    configurations: List[ConfigurationSubmission] = Field(..., min_length=1)
+    run_completion: bool = False  # Applies to every item
+
+
+class ConfigurationResult(BaseModel):
+    """Outcome of one submission"""
+    index: Optional[int] = None  # Position in a batch
+    status: str  # "saved" | "completed" | "invalid" | "error"
+    conversation_id: Optional[str] = None
+    export_file: Optional[str] = None
+    errors: List[Dict[str, str]] = []
@@ -2,7 +2,7 @@
 Pydantic models for conversation data structures.
 """
 from pydantic import BaseModel, Field
-from typing import Optional, Literal, List
+from typing import Optional, Literal, List, Dict, Any
 from uuid import UUID
 from datetime import datetime
 
@@ -11,6 +11,12 @@ class ChatRequest(BaseModel):
     """Incoming chat message from user"""
     message: str
     conversation_id: Optional[str] = None
+    idempotency_key: Optional[str] = None  # Client-generated, one per user send
+
+
+class PhaseEditRequest(BaseModel):
+    """Go back to an answered phase to change it"""
+    phase: str
 
 
 class ChatResponse(BaseModel):
@@ -25,6 +31,20 @@ class ChatResponse(BaseModel):
     options: Optional[List[str]] = None  # Available options for checkbox
 
 
+class ResumeResponse(BaseModel):
+    """Client state to restore a conversation (see /api/conversation/{id}/resume)"""
+    conversation_id: str
+    current_phase: str
+    is_complete: bool = False
+    question: Optional[str] = None  # Pending question (None once complete)
+    image_url: Optional[str] = None
+    ui_type: Optional[str] = None
+    options: Optional[List[str]] = None
+    export_file: Optional[str] = None
+    resume_phase: Optional[str] = None  # Set while an earlier answer is being edited
+    messages: List[Dict[str, Any]] = []  # Most recent messages, oldest first
+
+
 class Message(BaseModel):
     """Single message in conversation history"""
     id: UUID
@@ -32,6 +52,7 @@ class Message(BaseModel):
     role: Literal["user", "assistant", "system"]
     content: str
     image_url: Optional[str] = None
+    phase: Optional[str] = None  # Phase the message was asked/answered in
     created_at: datetime
 
 
@@ -41,5 +62,7 @@ class Conversation(BaseModel):
     user_id: Optional[UUID] = None
     current_phase: str = "phase_1_1"
     status: Literal["active", "completed", "abandoned"] = "active"
+    phase_started_message_id: Optional[UUID] = None
+    resume_phase: Optional[str] = None  # Set while an earlier answer is being edited
     created_at: datetime
     updated_at: datetime
@@ -0,0 +1,194 @@
+"""
+Admission control for LLM-bound endpoints.
+
+Two checks run before a request does any work:
+- a per-client token bucket (steady rate + burst), so one client can't
+  monopolise the service;
+- a global cap on requests holding an LLM slot, with a short bounded queue
+  in front of it, so a traffic burst turns into fast 429s instead of an
+  unbounded number of concurrent gpt-4o calls (and OpenAI 429s for everyone).
+
+Rejections raise AdmissionRejected carrying a Retry-After hint.
+"""
+import os
+import asyncio
+import math
+import ipaddress
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Tuple, Any, Optional
+from app.utils import metrics
+
+
+class AdmissionRejected(Exception):
+    """Request refused by admission control; retry after `retry_after` seconds"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class ClientRateLimiter:
+    """Token bucket per client key: `rate` requests/second, bursts up to `burst`"""
+
+    def __init__(self, rate: float = 1.0, burst: int = 10, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # client -> (tokens, last refill time)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def _prune(self, now: float):
+        """Drop buckets that have refilled completely (they hold no state)"""
+        full_after = self.burst / self.rate
+        self._buckets = {
+            client: bucket for client, bucket in self._buckets.items()
+            if now - bucket[1] < full_after
+        }
+
+    def check(self, client: str):
+        """Take one token for `client`, or raise AdmissionRejected"""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        tokens, last = self._buckets.get(client, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[client] = (tokens, now)
+            raise AdmissionRejected("rate_limited", (1 - tokens) / self.rate)
+        if client not in self._buckets and len(self._buckets) >= self.max_clients:
+            self._prune(now)
+        self._buckets[client] = (tokens - 1, now)
+
+    @property
+    def clients(self) -> int:
+        return len(self._buckets)
+
+
+class LLMGate:
+    """
+    Global in-flight cap with a bounded wait queue. A request waits at most
+    `queue_timeout` seconds for a slot; when the queue is full it is
+    rejected immediately.
+    """
+
+    def __init__(self, max_in_flight: int = 16, max_queue: int = 32, queue_timeout: float = 2.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.queued = 0
+
+    async def acquire(self):
+        """Take one LLM slot, waiting in the bounded queue if none is free"""
+        if self._semaphore.locked():
+            if self.queued >= self.max_queue:
+                raise AdmissionRejected("queue_full", self.queue_timeout)
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise AdmissionRejected("queue_timeout", self.queue_timeout)
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+class AdmissionController:
+    """Per-client rate limit followed by the global LLM gate"""
+
+    def __init__(self, limiter: ClientRateLimiter, gate: LLMGate,
+                 trusted_proxies: str = "", enabled: bool = True):
+        self.limiter = limiter
+        self.gate = gate
+        self.enabled = enabled
+        # Peers (the frontend proxy) whose X-Forwarded-For names the real client
+        self.trusted_proxies = [
+            ipaddress.ip_network(net.strip(), strict=False)
+            for net in trusted_proxies.split(",") if net.strip()
+        ]
+
+    def _trusted(self, host: str) -> bool:
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return any(address in net for net in self.trusted_proxies)
+
+    def client_key(self, peer: Optional[str], forwarded_for: Optional[str]) -> str:
+        """
+        Client identity. Behind a trusted proxy it is the rightmost
+        X-Forwarded-For hop that is not itself a trusted proxy: hops to its
+        left were written by the client and can be anything.
+        """
+        if not (peer and forwarded_for and self._trusted(peer)):
+            return peer or "unknown"
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if not self._trusted(hop):
+                return hop
+        # Only proxies in the chain: the leftmost one is the closest to the client
+        return hops[0] if hops else peer
+
+    def check_client(self, client: str, endpoint: str):
+        """Per-client token bucket; raises AdmissionRejected when exhausted"""
+        if not self.enabled:
+            return
+        try:
+            self.limiter.check(client)
+        except AdmissionRejected as e:
+            metrics.record_admission_rejection(endpoint, e.reason)
+            raise
+
+    @asynccontextmanager
+    async def llm_slot(self, endpoint: str):
+        """Hold a global LLM slot for the body; raises AdmissionRejected when saturated"""
+        if not self.enabled:
+            yield
+            return
+        try:
+            await self.gate.acquire()
+        except AdmissionRejected as e:
+            metrics.record_admission_rejection(endpoint, e.reason)
+            raise
+        try:
+            yield
+        finally:
+            self.gate.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.gate.in_flight,
+            "queue_depth": self.gate.queued,
+            "max_in_flight": self.gate.max_in_flight,
+            "max_queue": self.gate.max_queue,
+            "tracked_clients": self.limiter.clients,
+        }
+
+
+# Global instance
+admission = AdmissionController(
+    limiter=ClientRateLimiter(
+        rate=float(os.getenv("ADMISSION_CLIENT_RATE", 1.0)),
+        burst=int(os.getenv("ADMISSION_CLIENT_BURST", 10))
+    ),
+    gate=LLMGate(
+        max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 16)),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 32)),
+        queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 2.0))
+    ),
+    trusted_proxies=os.getenv("ADMISSION_TRUSTED_PROXIES", ""),
+    enabled=os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+)
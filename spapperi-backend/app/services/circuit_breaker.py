@@ -0,0 +1,164 @@
+"""
+Circuit breaker for calls to the LLM provider.
+
+When OpenAI is failing or slow, every turn would otherwise wait for the full
+client timeout before failing. The breaker watches a rolling window of calls
+and opens when too many of them fail or are slow; while open, calls are
+refused immediately (CircuitOpen) and callers switch to their degraded path.
+After a cool-down a single probe call is let through: success closes the
+circuit, failure opens it again.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """The circuit is open: the call was not attempted"""
+
+
+class CircuitBreaker:
+    """
+    Trips when, over the last `window` calls (at least `min_calls`), the
+    error rate or the share of calls slower than `slow_call_seconds` reaches
+    its threshold. Stays open for `open_seconds`, then probes.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        slow_call_rate: float = 0.8,
+        open_seconds: float = 30.0
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        # (failed, slow) per recent call
+        self._calls: deque = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            return HALF_OPEN
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls are currently refused (open, or half-open with a probe in flight)"""
+        state = self.state
+        return state == OPEN or (state == HALF_OPEN and self._probing)
+
+    def _open(self, reason: str):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self._calls.clear()
+        self.times_opened += 1
+        logger.warning("Circuit opened: %s", reason, extra={"circuit": self.name})
+
+    def _close(self):
+        self._state = CLOSED
+        self._probing = False
+        self._calls.clear()
+        logger.info("Circuit closed", extra={"circuit": self.name})
+
+    def _admit(self) -> bool:
+        """Let a call through (returns whether it is the probe) or raise CircuitOpen"""
+        state = self.state
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and not self._probing:
+            self._state = HALF_OPEN
+            self._probing = True
+            return True
+        self.rejected += 1
+        raise CircuitOpen(f"{self.name} circuit is open")
+
+    def _record(self, failed: bool, seconds: float, probe: bool):
+        slow = seconds >= self.slow_call_seconds
+        if not probe and self._state != CLOSED:
+            # Started before the circuit opened: already accounted for
+            return
+        if probe:
+            if failed or slow:
+                self._open("probe call failed" if failed else f"probe call took {seconds:.1f}s")
+            else:
+                self._close()
+            return
+
+        self._calls.append((failed, slow))
+        if len(self._calls) < self.min_calls:
+            return
+        failures = sum(1 for f, _ in self._calls if f) / len(self._calls)
+        slow_calls = sum(1 for _, s in self._calls if s) / len(self._calls)
+        if failures >= self.failure_rate:
+            self._open(f"error rate {failures:.0%} over the last {len(self._calls)} calls")
+        elif slow_calls >= self.slow_call_rate:
+            self._open(f"{slow_calls:.0%} of the last {len(self._calls)} calls slower than {self.slow_call_seconds}s")
+
+    @asynccontextmanager
+    async def call(self):
+        """
+        Guard one provider call. Raises CircuitOpen without running the body
+        while the circuit is open; exceptions from the body count as failures.
+        """
+        probe = self._admit()
+        start = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Not the provider's fault: free the probe slot without a verdict
+            if probe:
+                self._probing = False
+            raise
+        except Exception:
+            self._record(True, time.perf_counter() - start, probe)
+            raise
+        else:
+            self._record(False, time.perf_counter() - start, probe)
+
+    def stats(self) -> Dict[str, Any]:
+        calls = len(self._calls)
+        return {
+            "state": self.state,
+            "open": 1 if self.is_open else 0,
+            "window_calls": calls,
+            "window_failure_rate": sum(1 for f, _ in self._calls if f) / calls if calls else 0.0,
+            "window_slow_rate": sum(1 for _, s in self._calls if s) / calls if calls else 0.0,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+# Global instance shared by every OpenAI call (validation, embeddings, recommendation)
+llm_breaker = CircuitBreaker(
+    "openai",
+    window=int(os.getenv("LLM_BREAKER_WINDOW", 20)),
+    min_calls=int(os.getenv("LLM_BREAKER_MIN_CALLS", 5)),
+    failure_rate=float(os.getenv("LLM_BREAKER_FAILURE_RATE", 0.5)),
+    slow_call_seconds=float(os.getenv("LLM_BREAKER_SLOW_SECONDS", 10)),
+    slow_call_rate=float(os.getenv("LLM_BREAKER_SLOW_RATE", 0.8)),
+    open_seconds=float(os.getenv("LLM_BREAKER_OPEN_SECONDS", 30))
+)
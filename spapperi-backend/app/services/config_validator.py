@@ -0,0 +1,156 @@
+"""
+Local validation of complete configurations (no LLM involved).
+
+Applies the same rules the conversation enforces phase by phase: choices must
+be one of the phase options, conditional details (IB for twin rows, raised
+bed and mulch measures, contact data when interested) must be present, and
+numbers must fall in plausible ranges.
+"""
+import re
+from typing import Dict, Any, List, Optional, Tuple
+from app.models.configuration import ConfigurationSubmission
+from app.services.phase_manager import phase_manager, NO_ACCESSORY
+
+# Plausible ranges (inclusive, cm unless stated)
+PLAUSIBILITY_RANGES = {
+    "root_dimensions": (0.5, 50),
+    "number_of_rows": (1, 12),
+    "IF": (20, 300),
+    "IP": (5, 200),
+    "IB": (5, 100),
+    "AT": (5, 100),
+    "LT": (20, 300),
+    "IT": (50, 400),
+    "ST": (10, 200),
+    "LP": (50, 400),
+    "wheel_distance": (50, 400),
+    "tractor_hp": (10, 500),  # HP
+}
+
+# Configuration field -> phase whose options it must match
+CHOICE_FIELDS = {
+    "root_type": "phase_1_2",
+    "row_type": "phase_2_1",
+    "environment": "phase_3_1",
+    "soil_type": "phase_3_4",
+}
+ACCESSORY_FIELDS = {
+    "accessories_primary": "phase_5_1",
+    "accessories_secondary": "phase_5_2",
+    "accessories_element": "phase_5_3",
+}
+
+EMAIL_PATTERN = re.compile(r"^[\w.+-]+@[\w-]+(\.[\w-]+)+$")
+VAT_PATTERN = re.compile(r"^(IT)?\d{11}$", re.IGNORECASE)
+
+
+def is_single_row(row_type: Optional[str]) -> bool:
+    """Same test the phase_2_2 question uses to pick the single-row variant"""
+    return phase_manager.GRAPH["phase_2_2"].variant({"row_type": row_type}) == "single"
+
+
+class ConfigurationValidator:
+    """Validates a ConfigurationSubmission and maps it to configuration columns"""
+
+    @classmethod
+    def _check_range(cls, errors: List[Dict[str, str]], field: str, value: Optional[float], range_key: str, required: bool = True):
+        if value is None:
+            if required:
+                errors.append({"field": field, "message": "Valore mancante"})
+            return
+        low, high = PLAUSIBILITY_RANGES[range_key]
+        if not low <= value <= high:
+            errors.append({"field": field, "message": f"Valore {value} fuori dall'intervallo plausibile {low}-{high}"})
+
+    @classmethod
+    def validate(cls, submission: ConfigurationSubmission) -> Tuple[Dict[str, Any], List[Dict[str, str]]]:
+        """
+        Returns (configuration columns, errors). Columns are only meaningful
+        when there are no errors.
+        """
+        errors: List[Dict[str, str]] = []
+        data: Dict[str, Any] = {}
+
+        # Phase 1: Plant
+        crop_type = submission.crop_type.strip()
+        if len(crop_type) < 2:
+            errors.append({"field": "crop_type", "message": "Coltura mancante"})
+        data["crop_type"] = crop_type
+
+        for field, phase in CHOICE_FIELDS.items():
+            value = getattr(submission, field)
+            option = phase_manager.GRAPH[phase].match_option(value)
+            if option is None:
+                options = ", ".join(phase_manager.GRAPH[phase].options)
+                errors.append({"field": field, "message": f"'{value}' non è tra le opzioni: {options}"})
+            data[field] = option or value
+
+        dims = submission.root_dimensions
+        for key in ("A", "B", "C", "D"):
+            cls._check_range(errors, f"root_dimensions.{key}", getattr(dims, key), "root_dimensions")
+        data["root_dimensions"] = dims.model_dump(include={"A", "B", "C", "D"})
+
+        # Phase 2: Layout (IB only for twin rows)
+        layout = submission.layout_details
+        single = is_single_row(data["row_type"])
+        cls._check_range(errors, "layout_details.number_of_rows", layout.number_of_rows, "number_of_rows")
+        cls._check_range(errors, "layout_details.IF", layout.IF, "IF")
+        cls._check_range(errors, "layout_details.IP", layout.IP, "IP")
+        cls._check_range(errors, "layout_details.IB", layout.IB, "IB", required=not single)
+        data["layout_details"] = {
+            "number_of_rows": layout.number_of_rows,
+            "IF": layout.IF,
+            "IP": layout.IP,
+            "IB": None if single else layout.IB,
+        }
+
+        # Phase 3: Environment
+        data["is_raised_bed"] = submission.is_raised_bed
+        if submission.is_raised_bed:
+            bed = submission.raised_bed_details
+            for key in ("AT", "LT", "IT", "ST"):
+                cls._check_range(errors, f"raised_bed_details.{key}", getattr(bed, key) if bed else None, key)
+            data["raised_bed_details"] = bed.model_dump() if bed else None
+
+        data["is_mulch"] = submission.is_mulch
+        if submission.is_mulch:
+            mulch = submission.mulch_details
+            cls._check_range(errors, "mulch_details.LP", mulch.LP if mulch else None, "LP")
+            data["mulch_details"] = mulch.model_dump() if mulch else None
+
+        # Phase 4: Tractor
+        cls._check_range(errors, "wheel_distance", submission.wheel_distance, "wheel_distance")
+        cls._check_range(errors, "tractor_hp", submission.tractor_hp, "tractor_hp")
+        data["wheel_distance_internal"] = submission.wheel_distance
+        data["tractor_hp"] = submission.tractor_hp
+
+        # Phase 5: Accessories ("Nessuno" means an empty selection)
+        for field, phase in ACCESSORY_FIELDS.items():
+            selected = []
+            for value in getattr(submission, field):
+                option = phase_manager.GRAPH[phase].match_option(value)
+                if option is None:
+                    errors.append({"field": field, "message": f"Accessorio non previsto: '{value}'"})
+                elif option != NO_ACCESSORY:
+                    selected.append(option)
+            data[field] = selected
+
+        # Phase 6: Closing (contact data only asked when interested)
+        data["user_notes"] = submission.user_notes
+        data["is_interested"] = submission.is_interested
+        if submission.is_interested:
+            email = (submission.contact_email or "").strip()
+            vat = re.sub(r"\s", "", submission.vat_number or "")
+            if not EMAIL_PATTERN.match(email):
+                errors.append({"field": "contact_email", "message": "Email non valida"})
+            if not VAT_PATTERN.match(vat):
+                errors.append({"field": "vat_number", "message": "Partita IVA non valida (11 cifre)"})
+            data["contact_email"] = email
+            data["vat_number"] = vat
+
+        data["is_complete"] = True
+        return data, errors
+
+
+# Global instance
+config_validator = ConfigurationValidator
@@ -2,11 +2,22 @@
 Database service with asyncpg connection pool and CRUD operations.
 """
 import asyncpg
+import asyncio
 import os
 import json
-from typing import Optional, List, Dict, Any
+import time
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Any, AsyncIterator
 from uuid import UUID
-from datetime import datetime
+from datetime import datetime, timezone
+from pgvector.asyncpg import register_vector
+from app.services.state_cache import state_cache, INSTANCE_ID, NOTIFY_CHANNEL
+from app.services.migrations import migration_runner
+from app.utils import metrics
+from app.utils.tracing import traced
+
+logger = logging.getLogger(__name__)
 
 
 class DatabaseService:
@@ -14,6 +25,111 @@ class DatabaseService:
     
     pool: Optional[asyncpg.Pool] = None
     
+    # Dedicated connection receiving state-change notifications from other workers
+    _listener: Optional[asyncpg.Connection] = None
+    
+    # Set once a connection managed to register the pgvector codec
+    vector_codec: bool = False
+    
+    # Pool wait statistics (time spent waiting in acquire)
+    _acquire_count: int = 0
+    _acquire_wait_total: float = 0.0
+    _acquire_wait_max: float = 0.0
+    
+    # Hot-path statements, prepared on every new connection (see _init_connection)
+    CONVERSATION_COLUMNS = (
+        "id, user_id, current_phase, status, phase_started_message_id, resume_phase, checkpoints, created_at, updated_at"
+    )
+    SQL_GET_CONVERSATION = f"""
+        SELECT {CONVERSATION_COLUMNS}
+        FROM conversations
+        WHERE id = $1
+    """
+    SQL_UPDATE_PHASE = f"""
+        UPDATE conversations
+        SET current_phase = $1, resume_phase = $3, updated_at = NOW()
+        WHERE id = $2
+        RETURNING {CONVERSATION_COLUMNS}
+    """
+    SQL_SAVE_MESSAGE = """
+        INSERT INTO messages (conversation_id, role, content, image_url, phase)
+        VALUES ($1, $2, $3, $4, $5)
+        RETURNING id
+    """
+    # Same insert, also moving the conversation's phase-start pointer to the new message
+    SQL_SAVE_PHASE_START_MESSAGE = """
+        WITH m AS (
+            INSERT INTO messages (conversation_id, role, content, image_url, phase)
+            VALUES ($1, $2, $3, $4, $5)
+            RETURNING id
+        )
+        UPDATE conversations
+        SET phase_started_message_id = (SELECT id FROM m)
+        WHERE id = $1
+        RETURNING phase_started_message_id AS id
+    """
+    # Phase-start insert that also stores the conversation checkpoint, stamped with the new pointer
+    SQL_SAVE_PHASE_START_CHECKPOINT = """
+        WITH m AS (
+            INSERT INTO messages (conversation_id, role, content, image_url, phase)
+            VALUES ($1, $2, $3, $4, $5)
+            RETURNING id
+        )
+        UPDATE conversations
+        SET phase_started_message_id = (SELECT id FROM m),
+            checkpoints = $6::jsonb || jsonb_build_object('phase_started_message_id', (SELECT id FROM m))
+        WHERE id = $1
+        RETURNING phase_started_message_id AS id, checkpoints
+    """
+    SQL_GET_MESSAGES = """
+        SELECT id, conversation_id, role, content, image_url, phase, created_at
+        FROM messages
+        WHERE conversation_id = $1
+        ORDER BY created_at ASC
+        LIMIT $2
+    """
+    # One page of a full-history read: keyset on (created_at, id) after the
+    # last row of the previous page, so each page is a short indexed query
+    SQL_PAGE_MESSAGES = """
+        SELECT id, conversation_id, role, content, image_url, phase, created_at
+        FROM messages
+        WHERE conversation_id = $1
+          AND (created_at, id) > ($2, $3)
+        ORDER BY created_at ASC, id ASC
+        LIMIT $4
+    """
+    # Keyset read on idx_messages_conversation_phase, bounded by the phase-start pointer
+    SQL_GET_PHASE_USER_MESSAGES = """
+        SELECT id, role, content, created_at
+        FROM messages
+        WHERE conversation_id = $1
+          AND phase = $2
+          AND role = 'user'
+          AND created_at >= COALESCE(
+              (SELECT m.created_at
+               FROM conversations c
+               JOIN messages m ON m.id = c.phase_started_message_id
+               WHERE c.id = $1),
+              '-infinity'
+          )
+        ORDER BY created_at DESC
+        LIMIT $3
+    """
+    SQL_GET_CONFIGURATION = """
+        SELECT * FROM configurations
+        WHERE conversation_id = $1
+    """
+    HOT_STATEMENTS = (
+        SQL_GET_CONVERSATION,
+        SQL_UPDATE_PHASE,
+        SQL_SAVE_MESSAGE,
+        SQL_SAVE_PHASE_START_MESSAGE,
+        SQL_SAVE_PHASE_START_CHECKPOINT,
+        SQL_GET_MESSAGES,
+        SQL_GET_PHASE_USER_MESSAGES,
+        SQL_GET_CONFIGURATION,
+    )
+    
     @classmethod
     async def initialize(cls):
         """Initialize connection pool"""
@@ -25,231 +141,726 @@ class DatabaseService:
             database_url,
             min_size=2,
             max_size=10,
-            command_timeout=60
+            command_timeout=60,
+            init=cls._init_connection,
+            # Echoed back by the state-change trigger so we can skip our own writes
+            server_settings={"application_name": INSTANCE_ID}
         )
         
-        # Initialize Schema if needed
-        await cls._init_schema()
+        # Apply pending migrations (a single query when the schema is current)
+        applied = await cls._init_schema()
+        
+        if state_cache.enabled:
+            await cls._start_listener()
+        
+        if applied:
+            # Connections opened before the migrations ran may lack the vector
+            # codec or have failed statement warmup: recycle them so codecs and
+            # prepared statements are set up against the new schema.
+            await cls.pool.expire_connections()
+    
+    @classmethod
+    async def _init_connection(cls, conn: asyncpg.Connection):
+        """
+        Per-connection setup: type codecs and hot statement warmup.
+        
+        JSON/JSONB columns are encoded/decoded by the driver, so callers pass
+        and receive plain dicts. UUIDs already use asyncpg's binary codec.
+        """
+        for typename in ("json", "jsonb"):
+            await conn.set_type_codec(
+                typename,
+                encoder=json.dumps,
+                decoder=json.loads,
+                schema="pg_catalog"
+            )
+        
+        try:
+            await register_vector(conn)
+            cls.vector_codec = True
+        except Exception:
+            # Extension not created yet (first boot): schema init runs next
+            pass
+        
+        for query in cls.HOT_STATEMENTS:
+            try:
+                # Parse and plan each hot statement once: the backend loads the
+                # catalog entries and asyncpg introspects the column types, which
+                # the first real query on this connection would otherwise pay for
+                await conn.prepare(query)
+            except Exception:
+                # Schema not there yet; the connection is recycled after init
+                break
+    
+    @classmethod
+    @asynccontextmanager
+    async def acquire(cls, stage: str = "db"):
+        """
+        Acquire a pooled connection, recording how long we waited for it.
+        Time spent holding the connection is reported as `stage`.
+        """
+        start = time.perf_counter()
+        async with cls.pool.acquire() as conn:
+            waited = time.perf_counter() - start
+            cls._acquire_count += 1
+            cls._acquire_wait_total += waited
+            cls._acquire_wait_max = max(cls._acquire_wait_max, waited)
+            metrics.observe_pool_wait(waited)
+            with metrics.stage(stage):
+                yield conn
+    
+    @classmethod
+    def pool_stats(cls) -> Dict[str, Any]:
+        """Pool size, idle connections and acquire wait times"""
+        if not cls.pool:
+            return {}
+        return {
+            "size": cls.pool.get_size(),
+            "idle": cls.pool.get_idle_size(),
+            "min_size": cls.pool.get_min_size(),
+            "max_size": cls.pool.get_max_size(),
+            "acquire_count": cls._acquire_count,
+            "acquire_wait_avg_ms": round(
+                cls._acquire_wait_total / cls._acquire_count * 1000, 3
+            ) if cls._acquire_count else 0.0,
+            "acquire_wait_max_ms": round(cls._acquire_wait_max * 1000, 3),
+        }
 
     @classmethod
-    async def _init_schema(cls):
-        """Execute schema.sql to create tables if not exist"""
-        schema_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "schema.sql")
-        if not os.path.exists(schema_path):
-             # Fallback for Docker path
-             schema_path = "/app/schema.sql"
-        
-        if os.path.exists(schema_path):
-            with open(schema_path, "r") as f:
-                schema_sql = f.read()
-                
-            async with cls.pool.acquire() as conn:
-                # Check if tables exist to avoid unnecessary work/errors
-                # But IF NOT EXISTS in SQL handles it gracefully usually.
-                # Let's just execute.
-                try:
-                    await conn.execute(schema_sql)
-                    print("✓ Database schema initialized")
-                except Exception as e:
-                    print(f"Schema initialization warning: {e}")
-        else:
-            print(f"Warning: schema.sql not found at {schema_path}")
+    async def _init_schema(cls) -> bool:
+        """Run pending schema migrations. Returns True if any were applied."""
+        if os.getenv("MIGRATE_ON_BOOT", "true").lower() not in ("1", "true", "yes"):
+            return False
+        
+        async with cls.acquire() as conn:
+            applied = await migration_runner.migrate(conn)
+        
+        if applied:
+            logger.info("Database schema migrated", extra={"migrations_applied": len(applied)})
+        return bool(applied)
+    
+    @classmethod
+    async def _start_listener(cls):
+        """LISTEN for conversation state changes made by other workers"""
+        try:
+            cls._listener = await asyncpg.connect(
+                os.getenv("DATABASE_URL"),
+                server_settings={"application_name": INSTANCE_ID}
+            )
+            await cls._listener.add_listener(NOTIFY_CHANNEL, state_cache.handle_notification)
+            cls._listener.add_termination_listener(cls._on_listener_lost)
+            state_cache.enabled = True
+        except Exception as e:
+            # Without invalidations the cache could serve stale state: run uncached
+            logger.warning("State cache disabled, LISTEN failed: %s", e)
+            state_cache.enabled = False
+            state_cache.clear()
+    
+    @classmethod
+    def _on_listener_lost(cls, connection):
+        """Notifications may have been missed: drop the cache and reconnect"""
+        if cls._listener is not connection:
+            return
+        cls._listener = None
+        state_cache.enabled = False
+        state_cache.clear()
+        if cls.pool and not cls.pool.is_closing():
+            asyncio.get_running_loop().create_task(cls._reconnect_listener())
+    
+    @classmethod
+    async def _reconnect_listener(cls, delay: float = 1.0):
+        while cls._listener is None and cls.pool and not cls.pool.is_closing():
+            await asyncio.sleep(delay)
+            await cls._start_listener()
+            delay = min(delay * 2, 30.0)
     
     @classmethod
     async def close(cls):
         """Close connection pool"""
+        if cls._listener:
+            listener, cls._listener = cls._listener, None
+            await listener.close()
         if cls.pool:
             await cls.pool.close()
     
     # === CONVERSATIONS ===
     
     @classmethod
+    @traced("db.create_conversation")
     async def create_conversation(cls, user_id: Optional[UUID] = None) -> UUID:
         """Create new conversation and return its ID"""
-        async with cls.pool.acquire() as conn:
+        async with cls.acquire() as conn:
             row = await conn.fetchrow(
-                """
+                f"""
                 INSERT INTO conversations (user_id, current_phase, status)
                 VALUES ($1, 'phase_1_1', 'active')
-                RETURNING id
+                RETURNING {cls.CONVERSATION_COLUMNS}
                 """,
                 user_id
             )
-            return row['id']
+        
+        # A new conversation has no configuration row yet
+        state_cache.put_conversation(row['id'], dict(row))
+        state_cache.put_configuration(row['id'], None)
+        return row['id']
     
     @classmethod
+    @traced("db.get_conversation")
     async def get_conversation(cls, conversation_id: UUID) -> Optional[Dict[str, Any]]:
-        """Get conversation by ID"""
-        async with cls.pool.acquire() as conn:
-            row = await conn.fetchrow(
-                """
-                SELECT id, user_id, current_phase, status, created_at, updated_at
-                FROM conversations
-                WHERE id = $1
-                """,
-                conversation_id
-            )
-            return dict(row) if row else None
+        """Get conversation by ID (served from the state cache when possible)"""
+        hit, cached = state_cache.get_conversation(conversation_id)
+        if hit:
+            return cached
+        
+        version = state_cache.version(conversation_id)
+        async with cls.acquire() as conn:
+            row = await conn.fetchrow(cls.SQL_GET_CONVERSATION, conversation_id)
+        
+        result = dict(row) if row else None
+        if result:
+            state_cache.put_conversation(conversation_id, result, version)
+        return result
     
     @classmethod
-    async def update_conversation_phase(cls, conversation_id: UUID, phase: str):
-        """Update current phase of conversation"""
-        async with cls.pool.acquire() as conn:
-            await conn.execute(
-                """
+    @traced("db.update_conversation_phase")
+    async def update_conversation_phase(
+        cls,
+        conversation_id: UUID,
+        phase: str,
+        resume_phase: Optional[str] = None
+    ):
+        """Update current phase of conversation (resume_phase is set while editing an earlier answer)"""
+        async with cls.acquire() as conn:
+            row = await conn.fetchrow(cls.SQL_UPDATE_PHASE, phase, conversation_id, resume_phase)
+        if row:
+            state_cache.put_conversation(conversation_id, dict(row))
+    
+    @classmethod
+    @traced("db.reopen_conversation_phase")
+    async def reopen_conversation_phase(cls, conversation_id: UUID, phase: str, resume_phase: str):
+        """Go back to an answered phase, remembering where to resume (reactivates completed conversations)"""
+        async with cls.acquire() as conn:
+            row = await conn.fetchrow(
+                f"""
                 UPDATE conversations
-                SET current_phase = $1, updated_at = NOW()
-                WHERE id = $2
+                SET current_phase = $2, resume_phase = $3, status = 'active', updated_at = NOW()
+                WHERE id = $1
+                RETURNING {cls.CONVERSATION_COLUMNS}
                 """,
-                phase,
-                conversation_id
+                conversation_id, phase, resume_phase
             )
+        if row:
+            state_cache.put_conversation(conversation_id, dict(row))
     
     @classmethod
+    @traced("db.mark_conversation_complete")
     async def mark_conversation_complete(cls, conversation_id: UUID):
         """Mark conversation as completed"""
-        async with cls.pool.acquire() as conn:
-            await conn.execute(
-                """
+        async with cls.acquire() as conn:
+            row = await conn.fetchrow(
+                f"""
                 UPDATE conversations
                 SET status = 'completed', updated_at = NOW()
                 WHERE id = $1
+                RETURNING {cls.CONVERSATION_COLUMNS}
                 """,
                 conversation_id
             )
+        if row:
+            state_cache.put_conversation(conversation_id, dict(row))
     
     # === MESSAGES ===
     
     @classmethod
+    @traced("db.save_message")
     async def save_message(
         cls,
         conversation_id: UUID,
         role: str,
         content: str,
-        image_url: Optional[str] = None
+        image_url: Optional[str] = None,
+        phase: Optional[str] = None,
+        starts_phase: bool = False,
+        checkpoint: Optional[Dict[str, Any]] = None
     ) -> UUID:
-        """Save message to database"""
-        async with cls.pool.acquire() as conn:
+        """
+        Save message to database, tagged with the phase it belongs to.
+        `starts_phase` marks the assistant question that opens `phase`; its
+        `checkpoint` (conversation snapshot) is stored in the same statement.
+        """
+        if starts_phase and checkpoint is not None:
+            async with cls.acquire() as conn:
+                row = await conn.fetchrow(
+                    cls.SQL_SAVE_PHASE_START_CHECKPOINT,
+                    conversation_id, role, content, image_url, phase, checkpoint
+                )
+            state_cache.update_conversation(
+                conversation_id,
+                phase_started_message_id=row['id'],
+                checkpoints=row['checkpoints']
+            )
+            return row['id']
+        
+        async with cls.acquire() as conn:
             row = await conn.fetchrow(
-                """
-                INSERT INTO messages (conversation_id, role, content, image_url)
-                VALUES ($1, $2, $3, $4)
-                RETURNING id
-                """,
+                cls.SQL_SAVE_PHASE_START_MESSAGE if starts_phase else cls.SQL_SAVE_MESSAGE,
                 conversation_id,
                 role,
                 content,
-                image_url
+                image_url,
+                phase
             )
-            return row['id']
+        
+        if starts_phase:
+            state_cache.update_conversation(conversation_id, phase_started_message_id=row['id'])
+        return row['id']
     
     @classmethod
+    @traced("db.get_conversation_messages")
     async def get_conversation_messages(
         cls,
         conversation_id: UUID,
         limit: int = 100
     ) -> List[Dict[str, Any]]:
         """Get all messages for a conversation"""
-        async with cls.pool.acquire() as conn:
-            rows = await conn.fetch(
-                """
-                SELECT id, conversation_id, role, content, image_url, created_at
-                FROM messages
-                WHERE conversation_id = $1
-                ORDER BY created_at ASC
-                LIMIT $2
-                """,
-                conversation_id,
-                limit
-            )
+        async with cls.acquire() as conn:
+            rows = await conn.fetch(cls.SQL_GET_MESSAGES, conversation_id, limit)
             return [dict(row) for row in rows]
     
+    @classmethod
+    @traced("db.get_phase_user_messages")
+    async def get_phase_user_messages(
+        cls,
+        conversation_id: UUID,
+        phase: str,
+        limit: int = 3
+    ) -> List[Dict[str, Any]]:
+        """
+        Get the last `limit` user messages of the current run of `phase`,
+        oldest first. Messages before the phase-start pointer are ignored.
+        """
+        async with cls.acquire() as conn:
+            rows = await conn.fetch(cls.SQL_GET_PHASE_USER_MESSAGES, conversation_id, phase, limit)
+            return [dict(row) for row in reversed(rows)]
+    
+    @classmethod
+    @traced("db.iter_conversation_messages")
+    async def iter_conversation_messages(
+        cls,
+        conversation_id: UUID,
+        page_size: int = 200
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream all messages for a conversation in pages of `page_size` rows.
+        A pool connection is held only while a page is fetched, never while
+        the consumer (e.g. a slow download) works through it.
+        """
+        after_created_at, after_id = datetime.min.replace(tzinfo=timezone.utc), UUID(int=0)
+        while True:
+            async with cls.acquire() as conn:
+                rows = await conn.fetch(
+                    cls.SQL_PAGE_MESSAGES, conversation_id, after_created_at, after_id, page_size
+                )
+            for row in rows:
+                yield dict(row)
+            if len(rows) < page_size:
+                return
+            after_created_at, after_id = rows[-1]['created_at'], rows[-1]['id']
+    
     # === CONFIGURATIONS ===
     
+    # Columns that may be written through save_configuration_data. Keeping the
+    # dynamic SQL restricted to these names makes it injection-safe and bounds
+    # the number of distinct statements asyncpg has to prepare and cache.
+    CONFIGURATION_COLUMNS = frozenset({
+        "crop_type", "root_type", "root_dimensions",
+        "row_type", "layout_details",
+        "environment", "is_raised_bed", "raised_bed_details",
+        "is_mulch", "mulch_details", "soil_type",
+        "wheel_distance_internal", "wheel_distance_external", "tractor_hp",
+        "lift_category", "has_auto_drive", "gps_model",
+        "accessories_primary", "accessories_secondary", "accessories_element",
+        "user_notes", "is_interested", "contact_email", "vat_number",
+        "is_complete", "recommendation", "recommendation_inputs",
+    })
+    # Derived from the answers rather than given by the user
+    ARTIFACT_COLUMNS = frozenset({"recommendation", "recommendation_inputs"})
+    
     @classmethod
+    def _build_configuration_upsert(cls, columns: List[str]) -> str:
+        """Build the single-statement upsert for a (sorted) set of columns"""
+        if not columns:
+            return """
+                INSERT INTO configurations (conversation_id)
+                VALUES ($1)
+                ON CONFLICT (conversation_id) DO NOTHING
+                RETURNING *
+            """
+        
+        placeholders = ", ".join(f"${i}" for i in range(2, len(columns) + 2))
+        updates = ", ".join(f"{col} = EXCLUDED.{col}" for col in columns)
+        return f"""
+            INSERT INTO configurations (conversation_id, {', '.join(columns)})
+            VALUES ($1, {placeholders})
+            ON CONFLICT (conversation_id) DO UPDATE SET {updates}
+            RETURNING *
+        """
+    
+    @classmethod
+    @traced("db.save_configuration_data")
     async def save_configuration_data(
         cls,
         conversation_id: UUID,
         data: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """Upsert configuration data in a single statement. Returns the merged row."""
+        # Sorted so the same set of fields always yields the same SQL text
+        columns = sorted(key for key in data if key != 'conversation_id')
+        unknown = [col for col in columns if col not in cls.CONFIGURATION_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown configuration fields: {', '.join(unknown)}")
+        
+        # JSONB dicts are encoded by the pool codec
+        params = [conversation_id] + [data[col] for col in columns]
+        
+        async with cls.acquire() as conn:
+            row = await conn.fetchrow(cls._build_configuration_upsert(columns), *params)
+        
+        # The upsert returns the merged row, so the cache is refreshed write-through
+        if not row:
+            return None
+        result = dict(row)
+        state_cache.put_configuration(conversation_id, result)
+        return result
+    
+    @classmethod
+    @traced("db.get_configuration_data")
+    async def get_configuration_data(
+        cls,
+        conversation_id: UUID
+    ) -> Optional[Dict[str, Any]]:
+        """Get configuration data for conversation (served from the state cache when possible)"""
+        hit, cached = state_cache.get_configuration(conversation_id)
+        if hit:
+            return cached
+        
+        version = state_cache.version(conversation_id)
+        async with cls.acquire() as conn:
+            row = await conn.fetchrow(cls.SQL_GET_CONFIGURATION, conversation_id)
+        
+        # JSONB fields come back as dicts thanks to the pool codecs
+        result = dict(row) if row else None
+        state_cache.put_configuration(conversation_id, result, version)
+        return result
+
+    @classmethod
+    @traced("db.create_completed_configuration")
+    async def create_completed_configuration(
+        cls,
+        data: Dict[str, Any],
+        user_id: Optional[UUID] = None
+    ) -> Dict[str, Any]:
+        """
+        Store a configuration submitted in one go: a completed conversation and
+        its configuration row, in a single transaction. Returns the configuration.
+        """
+        columns = sorted(data)
+        unknown = [col for col in columns if col not in cls.CONFIGURATION_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown configuration fields: {', '.join(unknown)}")
+
+        async with cls.acquire() as conn:
+            async with conn.transaction():
+                conversation = await conn.fetchrow(
+                    f"""
+                    INSERT INTO conversations (user_id, current_phase, status)
+                    VALUES ($1, 'complete', 'completed')
+                    RETURNING {cls.CONVERSATION_COLUMNS}
+                    """,
+                    user_id
+                )
+                config = await conn.fetchrow(
+                    cls._build_configuration_upsert(columns),
+                    conversation['id'],
+                    *[data[col] for col in columns]
+                )
+
+        state_cache.put_conversation(conversation['id'], dict(conversation))
+        state_cache.put_configuration(conversation['id'], dict(config))
+        return dict(config)
+
+    
+    # === IDEMPOTENCY ===
+    
+    @classmethod
+    def _idempotency_ttl_hours(cls) -> int:
+        return int(os.getenv("IDEMPOTENCY_TTL_HOURS", 24))
+    
+    @classmethod
+    @traced("db.get_idempotent_response")
+    async def get_idempotent_response(
+        cls,
+        idempotency_key: str,
+        scope: Optional[str]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Get the stored chat response for an idempotency key.
+        scope is the conversation_id the request was sent to (None for a new
+        conversation); expired rows are ignored even before they are purged.
+        """
+        async with cls.acquire() as conn:
+            return await conn.fetchval(
+                """
+                SELECT response FROM chat_idempotency
+                WHERE scope = $1 AND idempotency_key = $2
+                  AND created_at > NOW() - make_interval(hours => $3)
+                """,
+                scope or "",
+                idempotency_key,
+                cls._idempotency_ttl_hours()
+            )
+    
+    @classmethod
+    @traced("db.save_idempotent_response")
+    async def save_idempotent_response(
+        cls,
+        idempotency_key: str,
+        scope: Optional[str],
+        conversation_id: UUID,
+        response: Dict[str, Any]
     ):
-        """Upsert configuration data"""
-        async with cls.pool.acquire() as conn:
-            # Check if exists
-            exists = await conn.fetchval(
-                "SELECT EXISTS(SELECT 1 FROM configurations WHERE conversation_id = $1)",
-                conversation_id
+        """Store the chat response produced for an idempotency key and purge expired ones"""
+        async with cls.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO chat_idempotency (scope, idempotency_key, conversation_id, response)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (scope, idempotency_key) DO NOTHING
+                """,
+                scope or "",
+                idempotency_key,
+                conversation_id,
+                response
+            )
+            await conn.execute(
+                "DELETE FROM chat_idempotency WHERE created_at < NOW() - make_interval(hours => $1)",
+                cls._idempotency_ttl_hours()
+            )
+    
+    # === OUTBOX ===
+    
+    @classmethod
+    @traced("db.enqueue_email")
+    async def enqueue_email(
+        cls,
+        to_email: str,
+        subject: str,
+        body: str,
+        attachment_paths: List[str],
+        conversation_id: Optional[UUID] = None
+    ) -> UUID:
+        """Store an email in the outbox for the background sender"""
+        async with cls.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                INSERT INTO outbox (conversation_id, to_email, subject, body, attachment_paths)
+                VALUES ($1, $2, $3, $4, $5)
+                RETURNING id
+                """,
+                conversation_id,
+                to_email,
+                subject,
+                body,
+                attachment_paths
+            )
+            return row['id']
+    
+    @classmethod
+    @traced("db.claim_outbox_batch")
+    async def claim_outbox_batch(
+        cls,
+        limit: int,
+        lease_seconds: float
+    ) -> List[Dict[str, Any]]:
+        """
+        Claim up to `limit` due emails for sending.
+        Claimed rows are leased: if the worker dies mid-send they become due again.
+        """
+        async with cls.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                UPDATE outbox
+                SET status = 'sending',
+                    attempts = attempts + 1,
+                    next_attempt_at = NOW() + make_interval(secs => $2)
+                WHERE id IN (
+                    SELECT id FROM outbox
+                    WHERE status IN ('pending', 'sending')
+                      AND next_attempt_at <= NOW()
+                    ORDER BY next_attempt_at
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, conversation_id, to_email, subject, body, attachment_paths, attempts
+                """,
+                limit,
+                float(lease_seconds)
+            )
+            return [dict(row) for row in rows]
+    
+    @classmethod
+    @traced("db.mark_outbox_sent")
+    async def mark_outbox_sent(cls, outbox_id: UUID):
+        """Mark an outbox email as delivered"""
+        async with cls.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE outbox
+                SET status = 'sent', sent_at = NOW(), last_error = NULL
+                WHERE id = $1
+                """,
+                outbox_id
             )
-            
-            if exists:
-                # Build dynamic UPDATE based on provided fields
-                set_clauses = []
-                params = [conversation_id]
-                param_idx = 2
-                
-                for key, value in data.items():
-                    if key == 'conversation_id':
-                        continue
-                    set_clauses.append(f"{key} = ${param_idx}")
-                    
-                    # Handle JSONB fields
-                    if isinstance(value, dict):
-                        params.append(json.dumps(value))
-                    elif isinstance(value, list):
-                        params.append(value)
-                    else:
-                        params.append(value)
-                    param_idx += 1
-                
-                if set_clauses:
-                    query = f"""
-                        UPDATE configurations
-                        SET {', '.join(set_clauses)}
-                        WHERE conversation_id = $1
+    
+    @classmethod
+    @traced("db.mark_outbox_failed")
+    async def mark_outbox_failed(
+        cls,
+        outbox_id: UUID,
+        error: str,
+        retry_in_seconds: Optional[float]
+    ):
+        """Schedule a retry, or dead-letter the email when retry_in_seconds is None"""
+        async with cls.acquire() as conn:
+            if retry_in_seconds is None:
+                await conn.execute(
                     """
-                    await conn.execute(query, *params)
+                    UPDATE outbox
+                    SET status = 'dead', last_error = $2
+                    WHERE id = $1
+                    """,
+                    outbox_id,
+                    error
+                )
             else:
-                # INSERT new record
                 await conn.execute(
                     """
-                    INSERT INTO configurations (conversation_id)
-                    VALUES ($1)
+                    UPDATE outbox
+                    SET status = 'pending', last_error = $2,
+                        next_attempt_at = NOW() + make_interval(secs => $3)
+                    WHERE id = $1
                     """,
-                    conversation_id
+                    outbox_id,
+                    error,
+                    float(retry_in_seconds)
                 )
-                # Then update with data
-                if data:
-                    await cls.save_configuration_data(conversation_id, data)
+
+    
+    # === LLM USAGE LEDGER ===
+    
+    LLM_USAGE_COLUMNS = [
+        "conversation_id", "phase", "purpose", "model", "prompt_tokens", "cached_prompt_tokens",
+        "completion_tokens", "latency_ms", "outcome", "trace_id", "created_at",
+    ]
     
     @classmethod
-    async def get_configuration_data(
+    @traced("db.insert_llm_usage")
+    async def insert_llm_usage(cls, records: List[tuple]):
+        """Bulk-insert usage ledger rows (tuples in LLM_USAGE_COLUMNS order) with COPY"""
+        async with cls.acquire() as conn:
+            await conn.copy_records_to_table("llm_usage", records=records, columns=cls.LLM_USAGE_COLUMNS)
+    
+    # === DEFERRED ENRICHMENT ===
+    
+    @classmethod
+    @traced("db.enqueue_enrichment")
+    async def enqueue_enrichment(
         cls,
-        conversation_id: UUID
-    ) -> Optional[Dict[str, Any]]:
-        """Get configuration data for conversation"""
-        async with cls.pool.acquire() as conn:
+        conversation_id: UUID,
+        phase: str,
+        user_message: str,
+        provisional: Dict[str, Any]
+    ) -> UUID:
+        """Queue a free-text answer accepted without the LLM for later extraction"""
+        async with cls.acquire() as conn:
             row = await conn.fetchrow(
                 """
-                SELECT * FROM configurations
-                WHERE conversation_id = $1
+                INSERT INTO enrichment_queue (conversation_id, phase, user_message, provisional)
+                VALUES ($1, $2, $3, $4)
+                RETURNING id
                 """,
-                conversation_id
+                conversation_id,
+                phase,
+                user_message,
+                provisional
+            )
+            return row['id']
+    
+    @classmethod
+    @traced("db.claim_enrichment_batch")
+    async def claim_enrichment_batch(
+        cls,
+        limit: int,
+        lease_seconds: float
+    ) -> List[Dict[str, Any]]:
+        """Claim up to `limit` due enrichment jobs (leased, like the outbox)"""
+        async with cls.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                UPDATE enrichment_queue
+                SET status = 'running',
+                    attempts = attempts + 1,
+                    next_attempt_at = NOW() + make_interval(secs => $2)
+                WHERE id IN (
+                    SELECT id FROM enrichment_queue
+                    WHERE status IN ('pending', 'running')
+                      AND next_attempt_at <= NOW()
+                    ORDER BY next_attempt_at
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, conversation_id, phase, user_message, provisional, attempts
+                """,
+                limit,
+                float(lease_seconds)
+            )
+            return [dict(row) for row in rows]
+    
+    @classmethod
+    @traced("db.mark_enrichment_done")
+    async def mark_enrichment_done(cls, job_id: UUID):
+        async with cls.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE enrichment_queue
+                SET status = 'done', done_at = NOW(), last_error = NULL
+                WHERE id = $1
+                """,
+                job_id
+            )
+    
+    @classmethod
+    @traced("db.mark_enrichment_failed")
+    async def mark_enrichment_failed(
+        cls,
+        job_id: UUID,
+        error: str,
+        retry_in_seconds: Optional[float]
+    ):
+        """Schedule a retry, or give up on the job when retry_in_seconds is None"""
+        async with cls.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE enrichment_queue
+                SET status = CASE WHEN $3::float8 IS NULL THEN 'dead' ELSE 'pending' END,
+                    last_error = $2,
+                    next_attempt_at = NOW() + make_interval(secs => COALESCE($3::float8, 0))
+                WHERE id = $1
+                """,
+                job_id,
+                error,
+                None if retry_in_seconds is None else float(retry_in_seconds)
             )
-            if not row:
-                return None
-            
-            result = dict(row)
-            # Manually deserialize JSONB fields that asyncpg returns as strings
-            json_fields = ["root_dimensions", "layout_details", "raised_bed_details", "mulch_details"]
-            for field in json_fields:
-                val = result.get(field)
-                if val and isinstance(val, str):
-                    try:
-                        result[field] = json.loads(val)
-                    except json.JSONDecodeError:
-                        pass # Keep as string if parsing fails
-            
-            return result
-
 
 # Global instance
 db = DatabaseService
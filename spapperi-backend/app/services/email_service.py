@@ -1,8 +1,101 @@
-
 import os
+import time
+import asyncio
+import logging
 import aiosmtplib
+from contextlib import asynccontextmanager
 from email.message import EmailMessage
-from typing import List, Optional
+from typing import List, Optional, Tuple
+from app.utils import metrics
+from app.utils.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPConnectionPool:
+    """
+    Keeps authenticated SMTP sessions alive and hands them out for reuse,
+    so each message does not pay for a new TLS handshake and login.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        size: int = 2,
+        keepalive_interval: float = 30.0,
+        max_idle: float = 240.0
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.keepalive_interval = keepalive_interval
+        self.max_idle = max_idle
+        self._idle: List[Tuple[aiosmtplib.SMTP, float]] = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        """Open and authenticate a new SMTP session"""
+        client = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            use_tls=True if self.port == 465 else False,
+            start_tls=True if self.port == 587 else False
+        )
+        await client.connect()
+        # Local stand-ins (aiosmtpd) run without authentication
+        if self.username and self.password:
+            await client.login(self.username, self.password)
+        return client
+
+    async def _discard(self, client: aiosmtplib.SMTP):
+        """Close a session without raising"""
+        try:
+            if client.is_connected:
+                await client.quit()
+        except Exception:
+            client.close()
+
+    async def _checkout(self) -> aiosmtplib.SMTP:
+        """Reuse an idle session if it is still alive, otherwise open a new one"""
+        while self._idle:
+            client, last_used = self._idle.pop()
+            idle_for = time.monotonic() - last_used
+            if not client.is_connected or idle_for > self.max_idle:
+                # Most servers drop idle sessions; don't bother probing old ones
+                await self._discard(client)
+                continue
+            if idle_for > self.keepalive_interval:
+                try:
+                    await client.noop()
+                except aiosmtplib.SMTPException:
+                    await self._discard(client)
+                    continue
+            return client
+        return await self._connect()
+
+    @asynccontextmanager
+    async def session(self):
+        """Borrow a connected session; broken sessions are not returned to the pool"""
+        async with self._slots:
+            client = await self._checkout()
+            try:
+                yield client
+            except Exception:
+                await self._discard(client)
+                raise
+            self._idle.append((client, time.monotonic()))
+
+    async def close(self):
+        """Quit all idle sessions"""
+        while self._idle:
+            client, _ = self._idle.pop()
+            await self._discard(client)
+
 
 class EmailService:
     def __init__(self):
@@ -11,76 +104,115 @@ class EmailService:
         self.username = os.getenv("EMAIL_USER")
         self.sender_email = os.getenv("EMAIL_FROM", self.username)
         self.password = os.getenv("EMAIL_PASSWORD")
+        self.logo_path = "/app/source/logo_spapperi.png"
+        self._logo_data: Optional[bytes] = None
+        self.pool = SMTPConnectionPool(
+            hostname=self.smtp_server,
+            port=self.smtp_port,
+            username=self.username,
+            password=self.password,
+            size=int(os.getenv("EMAIL_POOL_SIZE", 2))
+        )
 
-    async def send_email_with_attachments(
+    def is_configured(self) -> bool:
+        """
+        Whether an SMTP server has been configured at all.
+
+        Credentials are deliberately optional: EMAIL_USER/EMAIL_PASSWORD are
+        only needed by servers that require a login (the pool skips it when
+        they are unset), so an unauthenticated relay or the local stub in
+        scripts/smtp_stub.py counts as configured. Production servers that
+        need a login still reject the send, and the outbox retries it.
+        """
+        return bool(self.smtp_server and self.sender_email)
+
+    def _get_logo(self) -> Optional[bytes]:
+        """Load the inline logo once and keep it for every later message"""
+        if self._logo_data is None and os.path.exists(self.logo_path):
+            with open(self.logo_path, "rb") as img:
+                self._logo_data = img.read()
+        return self._logo_data
+
+    def build_message(
         self,
         to_email: str,
         subject: str,
         body: str,
         attachment_paths: List[str]
-    ) -> bool:
+    ) -> EmailMessage:
         """
-        Send an email with PDF attachments via Zoho SMTP.
+        Build the MIME message, reading PDF attachments from disk.
+        Called by the outbox worker, so attachments are never held in request memory.
         """
-        if not self.password or not self.username:
-            print("Error: EMAIL_PASSWORD or EMAIL_USER not set.")
-            return False
-
         message = EmailMessage()
         message["From"] = self.sender_email
         message["To"] = to_email
         message["Subject"] = subject
-        
+
         # Set HTML content
         message.set_content(body, subtype="html")
 
         # Add Logo as CID inline image
-        logo_path = "/app/source/logo_spapperi.png"
-        print(f"DEBUG EMAIL: Checking logo at {logo_path}, exists: {os.path.exists(logo_path)}")
-        if os.path.exists(logo_path):
-             with open(logo_path, "rb") as img:
-                 logo_data = img.read()
-                 print(f"DEBUG EMAIL: Logo data size: {len(logo_data)} bytes")
-                 # Use add_related for inline images with CID
-                 message.add_related(
-                     logo_data,
-                     maintype="image",
-                     subtype="png",
-                     filename="logo_spapperi.png",
-                     cid="logo"
-                 )
-                 print("DEBUG EMAIL: Logo attached successfully")
+        logo_data = self._get_logo()
+        if logo_data:
+            message.add_related(
+                logo_data,
+                maintype="image",
+                subtype="png",
+                filename="logo_spapperi.png",
+                cid="logo"
+            )
 
         # Add PDF attachments
-        print(f"DEBUG EMAIL: Processing {len(attachment_paths)} attachments: {attachment_paths}")
-        for i, path in enumerate(attachment_paths):
-            print(f"DEBUG EMAIL: Attachment {i}: {path}, exists: {os.path.exists(path)}")
-            if os.path.exists(path):
+        for path in attachment_paths or []:
+            if path and os.path.exists(path):
                 filename = os.path.basename(path)
                 with open(path, "rb") as f:
-                    file_data = f.read()
-                    print(f"DEBUG EMAIL: Attachment {i} ({filename}) size: {len(file_data)} bytes")
                     message.add_attachment(
-                        file_data,
+                        f.read(),
                         maintype="application",
                         subtype="pdf",
                         filename=filename
                     )
-                    print(f"DEBUG EMAIL: Attachment {i} ({filename}) attached successfully")
+            else:
+                logger.warning("Email attachment missing, skipped", extra={"path": path})
+
+        return message
 
+    @traced("smtp.send_message")
+    async def send_message(self, message: EmailMessage):
+        """Send a prepared message over a pooled session. Raises on failure."""
+        with metrics.stage("smtp"):
+            async with self.pool.session() as client:
+                await client.send_message(message)
+
+    async def send_email_with_attachments(
+        self,
+        to_email: str,
+        subject: str,
+        body: str,
+        attachment_paths: List[str]
+    ) -> bool:
+        """
+        Send an email with PDF attachments via Zoho SMTP, immediately.
+        Prefer `outbox_worker.enqueue` from request handlers.
+        """
+        if not self.is_configured():
+            logger.error("EMAIL_HOST or EMAIL_FROM not set")
+            return False
+
+        message = await asyncio.to_thread(
+            self.build_message, to_email, subject, body, attachment_paths
+        )
         try:
-            await aiosmtplib.send(
-                message,
-                hostname=self.smtp_server,
-                port=self.smtp_port,
-                username=self.username,
-                password=self.password,
-                use_tls=True if self.smtp_port == 465 else False,
-                start_tls=True if self.smtp_port == 587 else False
-            )
+            await self.send_message(message)
             return True
         except Exception as e:
-            print(f"Failed to send email: {e}")
+            logger.error("Failed to send email: %s", e)
             return False
 
+    async def close(self):
+        """Close pooled SMTP sessions"""
+        await self.pool.close()
+
 email_service = EmailService()
@@ -0,0 +1,89 @@
+"""
+Background worker for deferred enrichment.
+
+Free-text answers accepted while the LLM was unavailable are queued in
+`enrichment_queue`; once the circuit breaker lets calls through again this
+worker runs the LLM extraction for them (see PhaseManager.enrich_deferred).
+"""
+import os
+import asyncio
+import logging
+from typing import Dict, Any, Optional
+from app.services.db import db
+from app.services.phase_manager import phase_manager
+from app.services.circuit_breaker import llm_breaker
+from app.utils.context import set_turn_context
+
+logger = logging.getLogger(__name__)
+
+
+class EnrichmentWorker:
+    """Drains `enrichment_queue` in small batches while the LLM circuit is closed"""
+
+    def __init__(self):
+        self.batch_size = int(os.getenv("ENRICHMENT_BATCH_SIZE", 5))
+        self.poll_interval = float(os.getenv("ENRICHMENT_POLL_INTERVAL", 15))
+        self.max_attempts = int(os.getenv("ENRICHMENT_MAX_ATTEMPTS", 10))
+        self.backoff_base = float(os.getenv("ENRICHMENT_BACKOFF_BASE", 30))
+        self.backoff_max = float(os.getenv("ENRICHMENT_BACKOFF_MAX", 1800))
+        self.lease_seconds = 120.0
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+
+    def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.backoff_base * (2 ** (attempts - 1)), self.backoff_max)
+
+    async def drain_once(self) -> int:
+        """Claim and enrich one batch. Returns the number of jobs processed."""
+        if llm_breaker.is_open:
+            # Nothing can succeed yet; the jobs stay queued
+            return 0
+        batch = await db.claim_enrichment_batch(self.batch_size, self.lease_seconds)
+        for job in batch:
+            await self._enrich(job)
+        return len(batch)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                if await self.drain_once():
+                    continue
+            except Exception as e:
+                logger.exception("Enrichment worker error: %s", e)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _enrich(self, job: Dict[str, Any]):
+        set_turn_context(job["conversation_id"], job["phase"])
+        try:
+            if await phase_manager.enrich_deferred(job):
+                await db.mark_enrichment_done(job["id"])
+                return
+            error = "LLM unavailable"
+        except Exception as e:
+            logger.exception("Deferred enrichment failed: %s", e, extra={"job_id": str(job["id"])})
+            error = repr(e)
+
+        attempts = job["attempts"]
+        retry_in = self.backoff(attempts) if attempts < self.max_attempts else None
+        await db.mark_enrichment_failed(job["id"], error, retry_in)
+
+
+# Global instance
+enrichment_worker = EnrichmentWorker()
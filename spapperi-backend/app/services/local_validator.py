@@ -0,0 +1,163 @@
+"""
+Deterministic answer parsing used while the LLM is unavailable.
+
+Radio and checkbox phases are matched against their options, phases with a
+"local" spec have their numbers, yes/no flags, email and VAT number read
+with patterns. Completeness is the same check used to skip satisfied phases
+(Phase.is_satisfied), so a partial answer is asked to be completed. Free-text
+phases are not handled here: they are accepted as written and enriched by the
+LLM later.
+"""
+import re
+import json
+import unicodedata
+from typing import Dict, Any, List, Optional, Tuple
+from app.services.phase_graph import Phase, YES_WORDS
+
+NUMBER = r"(\d+(?:[.,]\d+)?)"
+NUMBER_PATTERN = re.compile(rf"(?<![\w.,]){NUMBER}(?![\w])")
+NO_WORDS = ("no", "non", "nessuna", "nessuno")
+EMAIL_SEARCH = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+VAT_SEARCH = re.compile(r"\b(?:IT)?\s?(\d{11})\b", re.IGNORECASE)
+
+def _fold(text: str) -> str:
+    """Lowercase, accents removed, whitespace collapsed ("Sì " -> "si")"""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.lower().split())
+
+
+def _number(text: str) -> float:
+    value = float(text.replace(",", "."))
+    return int(value) if value.is_integer() else value
+
+
+def _label_pattern(key: str) -> re.Pattern:
+    # "A=3", "a: 3", "IF 120" (a bare label only when written in capitals, so
+    # Italian words like "a" or "it" are not read as labels)
+    return re.compile(
+        rf"(?:\b(?i:{re.escape(key)})\s*[:=]\s*|\b{re.escape(key)}\s+){NUMBER}"
+    )
+
+
+class LocalValidator:
+    """Validation without the LLM, returning the validator's result shape"""
+
+    @classmethod
+    def _choice(cls, phase: Phase, answer: str) -> Optional[str]:
+        """Option named by `answer`: exact match, else the only option it contains or is part of"""
+        option = phase.match_option(answer)
+        if option:
+            return option
+        folded = _fold(answer)
+        if not folded:
+            return None
+        candidates = [
+            option for option in phase.options
+            if re.search(rf"\b{re.escape(_fold(option))}\b", folded) or re.search(rf"\b{re.escape(folded)}\b", _fold(option))
+        ]
+        return candidates[0] if len(candidates) == 1 else None
+
+    @classmethod
+    def _choices(cls, phase: Phase, answer: str, empty_option: Optional[str]) -> Tuple[List[str], List[str]]:
+        """(selected options, unrecognised items) of a checkbox answer (JSON list or comma separated)"""
+        try:
+            items = json.loads(answer)
+        except ValueError:
+            items = None
+        if not isinstance(items, list):
+            items = [item for item in re.split(r"[,;\n]| e ", answer) if item.strip()]
+        selected, unknown = [], []
+        for item in items:
+            option = cls._choice(phase, str(item))
+            if option is None:
+                unknown.append(str(item).strip())
+            elif option != empty_option and option not in selected:
+                selected.append(option)
+        return selected, unknown
+
+    @classmethod
+    def _yes_no(cls, answer: str) -> Optional[bool]:
+        words = set(re.findall(r"\w+", _fold(answer)))
+        if words & set(NO_WORDS):
+            return False
+        if words & {_fold(word) for word in YES_WORDS} or NUMBER_PATTERN.search(answer):
+            # Measures given without a "sì" still mean yes
+            return True
+        return None
+
+    @classmethod
+    def _fields(cls, phase: Phase, answer: str) -> Dict[str, Any]:
+        """Values of the phase's local fields found in `answer`"""
+        extracted: Dict[str, Any] = {}
+        numeric = [key for key, value_type in phase.local_fields.items() if value_type == "number"]
+        for key, value_type in phase.local_fields.items():
+            if value_type == "yes_no":
+                flag = cls._yes_no(answer)
+                if flag is False:
+                    # "No": the measures that follow the flag are not asked
+                    extracted[key] = flag
+                    return extracted
+                if flag is not None:
+                    extracted[key] = flag
+            elif value_type == "email":
+                match = EMAIL_SEARCH.search(answer)
+                if match:
+                    extracted[key] = match.group(0)
+            elif value_type == "vat":
+                match = VAT_SEARCH.search(answer)
+                if match:
+                    extracted[key] = match.group(1)
+
+        # Labelled numbers first ("IF 120"), then the unlabelled ones in the asked order
+        rest = answer
+        for key in numeric:
+            match = _label_pattern(key).search(rest)
+            if match:
+                extracted[key] = _number(match.group(1))
+                rest = rest[:match.start()] + " " + rest[match.end():]
+        unlabelled = [_number(n) for n in NUMBER_PATTERN.findall(rest)]
+        for key, value in zip([key for key in numeric if key not in extracted], unlabelled):
+            extracted[key] = value
+        return extracted
+
+    @classmethod
+    def validate(
+        cls,
+        phase: Phase,
+        user_message: str,
+        config: Dict[str, Any],
+        empty_option: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Validation result for `user_message`, or None for free-text phases.
+        `empty_option` is the checkbox option meaning "none selected".
+        """
+        if phase.is_free_text:
+            return None
+
+        if phase.ui_type == "checkbox":
+            selected, unknown = cls._choices(phase, user_message, empty_option)
+            if unknown:
+                return cls._incomplete(f"Opzioni non riconosciute: {', '.join(unknown)}. Scegli tra: {', '.join(phase.options)}.")
+            extracted = {rule.keys[0]: selected for rule in phase.columns}
+        elif phase.options:
+            option = cls._choice(phase, user_message)
+            if option is None:
+                return cls._incomplete(f"Scegli una delle opzioni: {', '.join(phase.options)}.")
+            extracted = {rule.keys[0]: option for rule in phase.columns}
+        else:
+            extracted = cls._fields(phase, user_message)
+
+        columns = phase.map_columns(extracted, config)
+        if not phase.is_satisfied({**config, **columns}):
+            return cls._incomplete(f"Non riesco a leggere tutti i valori. {phase.question(config)}")
+        return {"is_complete": True, "extracted_data": extracted, "clarification_needed": None}
+
+    @classmethod
+    def _incomplete(cls, clarification: str) -> Dict[str, Any]:
+        return {"is_complete": False, "extracted_data": None, "clarification_needed": clarification}
+
+
+# Global instance
+local_validator = LocalValidator
@@ -0,0 +1,149 @@
+"""
+Versioned schema migrations.
+
+Migrations are numbered SQL files in `migrations/` (e.g. `0002_email_outbox.sql`),
+each applied once in its own transaction and recorded in `schema_migrations`
+with a checksum. An advisory lock makes sure only one worker migrates; when
+the schema is already current, boot costs a single query.
+"""
+import os
+import re
+import logging
+import hashlib
+from dataclasses import dataclass
+from typing import List, Dict
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary constant identifying the migration advisory lock
+MIGRATION_LOCK_ID = 7_160_524_001
+
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d+)_([a-z0-9_]+)\.sql$")
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    sql: str
+    checksum: str
+
+
+class MigrationRunner:
+    """Applies pending migrations from the migrations directory"""
+
+    MIGRATIONS_DIR = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        "migrations"
+    )
+
+    @classmethod
+    def discover(cls) -> List[Migration]:
+        """Load migrations from disk, ordered by version"""
+        migrations_dir = cls.MIGRATIONS_DIR
+        if not os.path.isdir(migrations_dir):
+            # Fallback for Docker path
+            migrations_dir = "/app/migrations"
+
+        migrations = []
+        for filename in sorted(os.listdir(migrations_dir)):
+            match = MIGRATION_FILE_PATTERN.match(filename)
+            if not match:
+                continue
+            with open(os.path.join(migrations_dir, filename), "r", encoding="utf-8") as f:
+                sql = f.read()
+            migrations.append(Migration(
+                version=int(match.group(1)),
+                name=match.group(2),
+                sql=sql,
+                checksum=hashlib.sha256(sql.encode("utf-8")).hexdigest()
+            ))
+
+        versions = [m.version for m in migrations]
+        if len(versions) != len(set(versions)):
+            raise RuntimeError(f"Duplicate migration versions in {migrations_dir}")
+        return sorted(migrations, key=lambda m: m.version)
+
+    @classmethod
+    async def _applied(cls, conn: asyncpg.Connection) -> Dict[int, str]:
+        """Applied versions and their checksums (empty if the table doesn't exist yet)"""
+        try:
+            rows = await conn.fetch("SELECT version, checksum FROM schema_migrations")
+        except asyncpg.UndefinedTableError:
+            return {}
+        return {row["version"]: row["checksum"] for row in rows}
+
+    @classmethod
+    def _check_checksums(cls, migrations: List[Migration], applied: Dict[int, str]):
+        for m in migrations:
+            if m.version in applied and applied[m.version] != m.checksum:
+                # The database already has this migration; editing the file doesn't re-run it
+                logger.warning("Migration %04d_%s changed after it was applied", m.version, m.name)
+
+    @classmethod
+    async def status(cls, conn: asyncpg.Connection) -> List[Dict[str, object]]:
+        """Per-migration status: applied, pending or modified"""
+        applied = await cls._applied(conn)
+        result = []
+        for m in cls.discover():
+            if m.version not in applied:
+                state = "pending"
+            elif applied[m.version] != m.checksum:
+                state = "modified"
+            else:
+                state = "applied"
+            result.append({"version": m.version, "name": m.name, "status": state})
+        return result
+
+    @classmethod
+    async def migrate(cls, conn: asyncpg.Connection) -> List[Migration]:
+        """
+        Apply pending migrations. Returns the migrations that were applied.
+        A failing migration is rolled back and raised.
+        """
+        migrations = cls.discover()
+
+        # Fast path: no lock, one query
+        applied = await cls._applied(conn)
+        if all(m.version in applied for m in migrations):
+            cls._check_checksums(migrations, applied)
+            return []
+
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+        try:
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    checksum TEXT NOT NULL,
+                    applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+                )
+                """
+            )
+            # Another worker may have migrated while we waited for the lock
+            applied = await cls._applied(conn)
+            cls._check_checksums(migrations, applied)
+
+            done = []
+            for m in migrations:
+                if m.version in applied:
+                    continue
+                async with conn.transaction():
+                    await conn.execute(m.sql)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+                        m.version,
+                        m.name,
+                        m.checksum
+                    )
+                logger.info("Applied migration %04d_%s", m.version, m.name)
+                done.append(m)
+            return done
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+
+# Global instance
+migration_runner = MigrationRunner
@@ -4,8 +4,21 @@ Uses GPT-4 to validate if user input is complete/valid for current phase.
 """
 import os
 import json
+import time
+import logging
 from typing import Dict, Any, Optional
 from openai import AsyncOpenAI
+from app.services.prompt_builder import prompt_builder, VALIDATOR_MODEL
+from app.services.circuit_breaker import llm_breaker, CircuitOpen
+from app.services.usage_ledger import usage_ledger
+from app.utils import metrics
+from app.utils.tracing import traced, annotate_current_span
+
+logger = logging.getLogger(__name__)
+
+# Per-call timeout: a hung provider should fail the call (and count against
+# the circuit breaker) long before the client's default of minutes
+VALIDATOR_TIMEOUT = float(os.getenv("VALIDATOR_TIMEOUT", 20))
 
 
 class OpenAIValidator:
@@ -19,16 +32,19 @@ class OpenAIValidator:
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable not set")
-        cls.client = AsyncOpenAI(api_key=api_key)
+        # OPENAI_BASE_URL points at a compatible server (e.g. scripts/openai_stub.py)
+        cls.client = AsyncOpenAI(api_key=api_key, base_url=os.getenv("OPENAI_BASE_URL") or None)
     
     @classmethod
+    @traced("openai.validate_response")
     async def validate_response(
         cls,
         phase: str,
         user_message: str,
         expected_format: str,
         context: str = "",
-        conversation_history: list = None
+        conversation_history: list = None,
+        lookahead: Optional[Dict[str, str]] = None
     ) -> Dict[str, Any]:
         """
         Validate if user response is complete and extract data.
@@ -39,105 +55,97 @@ class OpenAIValidator:
             expected_format: Description of expected format
             context: Additional context about the question
             conversation_history: List of previous messages in current phase
+            lookahead: Later phases (phase -> expected format) whose data may
+                also be extracted from this answer (multi-slot extraction)
         
         Returns:
             {
                 "is_complete": bool,
                 "extracted_data": dict | None,
-                "clarification_needed": str | None
+                "clarification_needed": str | None,
+                "additional_data": {phase: dict} (only with lookahead),
+                "unavailable": True (only when the LLM could not be used)
             }
         """
-        system_prompt = """Sei un assistente esperto nella configurazione di trapiantatrici agricole.
-Il tuo compito è validare RIGOROSAMENTE le risposte degli utenti durante un processo di configurazione guidato.
-
-REGOLE DI VALIDAZIONE:
-1. La risposta deve contenere TUTTE le informazioni richieste
-2. I valori numerici devono essere plausibili per il contesto agricolo
-3. Le scelte multiple devono corrispondere alle opzioni fornite
-4. Se manca QUALSIASI informazione, segnala "is_complete": false
-
-ESEMPI DI VALIDAZIONE:
-
-Domanda: "Qual è la caratteristica della radice? Opzioni: 1. Radice Nuda 2. Zolla Cubica 3. Zolla Conica 4. Zolla Piramidale"
-Risposta: "cubica" → ✅ is_complete: true, extracted_data: {"root_type": "Zolla Cubica"}
-Risposta: "non lo so" → ❌ is_complete: false, clarification_needed: "Devi scegliere tra le 4 opzioni"
-
-Domanda: "Dimensioni radice: A, B, C, D in cm"
-Risposta: "A=3, B=3, C=4, D=5" → ✅ is_complete: true
-Risposta: "A=3, B=3" → ❌ is_complete: false, clarification_needed: "Mancano i valori C e D"
-Risposta: "circa 3 cm" → ❌ is_complete: false, clarification_needed: "Servono 4 valori distinti: A, B, C, D"
-
-Domanda: "Numero bine, IF (cm), IP (cm), IB (cm)"
-Risposta: "4 bine, IF 120, IP 30, IB 25" → ✅ is_complete: true
-Risposta: "120 cm" → ❌ is_complete: false, clarification_needed: "Servono anche numero bine, IP e IB"
-
-Rispondi SEMPRE in formato JSON:
-{
-    "is_complete": true/false,
-    "extracted_data": {...} o null,
-    "clarification_needed": "..." o null
-}
-
-IMPORTANTE: Se hai QUALSIASI dubbio sulla completezza, rispondi is_complete: false."""
-
-        # Build conversation history context
-        history_context = ""
-        if conversation_history and len(conversation_history) > 0:
-            history_context = "\n**MESSAGGI PRECEDENTI DELL'UTENTE IN QUESTA FASE**:\n"
-            for i, msg in enumerate(conversation_history[-3:], 1):  # Last 3 messages
-                if msg.get('role') == 'user':
-                    history_context += f"{i}. \"{msg.get('content')}\"\n"
-            history_context += "\nIMPORTANTE: Considera TUTTE le informazioni fornite nei messaggi precedenti. Se l'utente ha già dato alcuni valori, NON chiederli di nuovo.\n"
-
-        user_prompt = f"""**FASE**: {phase}
-**DOMANDA POSTA ALL'UTENTE**: 
-{context}
-
-**FORMATO RICHIESTO**: 
-{expected_format}
-{history_context}
-**RISPOSTA CORRENTE DELL'UTENTE**: 
-"{user_message}"
-
-ANALIZZA con attenzione:
-1. La risposta CORRENTE + i messaggi PRECEDENTI contengono TUTTE le informazioni?
-2. I valori sono plausibili e sensati?
-3. Se è una scelta multipla, corrisponde a un'opzione valida?
-
-Valida RIGOROSAMENTE e restituisci JSON."""
-
+        # Static system prefix (cacheable by the provider) + budgeted per-turn data
+        prompt = prompt_builder.build(
+            phase=phase,
+            user_message=user_message,
+            expected_format=expected_format,
+            context=context,
+            conversation_history=conversation_history,
+            lookahead=lookahead
+        )
+        if prompt.history_reduced or prompt.history_omitted or prompt.answer_truncated:
+            metrics.record_prompt_trimming(phase, prompt.history_reduced, prompt.history_omitted, prompt.answer_truncated)
+
+        start = time.perf_counter()
+        response = None
         try:
-            response = await cls.client.chat.completions.create(
-                model="gpt-4o",  # Use gpt-4o which supports JSON mode
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.0  # Zero temperature for consistent validation
+            async with llm_breaker.call():
+                with metrics.stage("validator"):
+                    response = await cls.client.chat.completions.create(
+                        model=VALIDATOR_MODEL,  # gpt-4o supports JSON mode
+                        messages=prompt.messages,
+                        response_format={"type": "json_object"},
+                        temperature=0.0,  # Zero temperature for consistent validation
+                        timeout=VALIDATOR_TIMEOUT
+                    )
+            latency = time.perf_counter() - start
+            metrics.record_openai_usage("validation", VALIDATOR_MODEL, response.usage)
+            annotate_current_span(
+                prompt_tokens_estimate=prompt.prompt_tokens,
+                **metrics.usage_attributes(response.usage)
             )
             
-            result = json.loads(response.choices[0].message.content)
+            content = response.choices[0].message.content
+            try:
+                result = json.loads(content)
+            except (json.JSONDecodeError, TypeError):
+                result = None
+            usage_ledger.record(
+                "validation", VALIDATOR_MODEL, response.usage, latency,
+                outcome="complete" if isinstance(result, dict) and result.get("is_complete") else "incomplete"
+            )
             
-            # Additional validation: check if result has required fields
-            if "is_complete" not in result:
-                print(f"Warning: OpenAI response missing is_complete field: {result}")
-                return {
-                    "is_complete": False,
-                    "extracted_data": None,
-                    "clarification_needed": "Risposta non chiara. Puoi riformulare?"
-                }
+            # A reply did arrive: if it isn't a usable result, ask the user to
+            # rephrase (the LLM is up, so this is not a reason to degrade)
+            if not isinstance(result, dict) or "is_complete" not in result:
+                logger.warning("OpenAI response is not a validation result", extra={"content": content})
+                return cls.unclear()
             
             return result
             
+        except CircuitOpen:
+            metrics.record_openai_usage("validation", VALIDATOR_MODEL, None, outcome="circuit_open")
+            return cls.unavailable()
         except Exception as e:
-            print(f"OpenAI validation error: {e}")
-            # Fallback: reject response to be safe
-            return {
-                "is_complete": False,
-                "extracted_data": None,
-                "clarification_needed": "C'è stato un problema tecnico. Puoi ripetere la tua risposta?"
-            }
+            metrics.record_openai_usage("validation", VALIDATOR_MODEL, None, outcome="error")
+            usage_ledger.record(
+                "validation", VALIDATOR_MODEL, response.usage if response else None,
+                time.perf_counter() - start, outcome="error"
+            )
+            logger.error("OpenAI validation error: %s", e)
+            return cls.unavailable()
+    
+    @classmethod
+    def unclear(cls) -> Dict[str, Any]:
+        """Result for a reply that is not valid validation JSON"""
+        return {
+            "is_complete": False,
+            "extracted_data": None,
+            "clarification_needed": "Risposta non chiara. Puoi riformulare?"
+        }
+
+    @classmethod
+    def unavailable(cls) -> Dict[str, Any]:
+        """Result when the LLM could not validate: reject to be safe (callers may degrade)"""
+        return {
+            "is_complete": False,
+            "extracted_data": None,
+            "clarification_needed": "C'è stato un problema tecnico. Puoi ripetere la tua risposta?",
+            "unavailable": True
+        }
 
 
 # Global instance
@@ -0,0 +1,129 @@
+"""
+Background sender draining the email outbox.
+Requests only enqueue; delivery, retries and dead-lettering happen here.
+"""
+import os
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional
+from uuid import UUID
+from app.services.db import db
+from app.services.email_service import email_service
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxWorker:
+    """Drains the `outbox` table in batches over pooled SMTP sessions"""
+
+    def __init__(self):
+        self.batch_size = int(os.getenv("EMAIL_BATCH_SIZE", 10))
+        self.poll_interval = float(os.getenv("EMAIL_POLL_INTERVAL", 5))
+        self.max_attempts = int(os.getenv("EMAIL_MAX_ATTEMPTS", 6))
+        self.backoff_base = float(os.getenv("EMAIL_BACKOFF_BASE", 30))
+        self.backoff_max = float(os.getenv("EMAIL_BACKOFF_MAX", 3600))
+        self.lease_seconds = 300.0
+        self.stop_timeout = float(os.getenv("EMAIL_STOP_TIMEOUT", 10))
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def start(self):
+        """Start the sender loop (no-op when SMTP is not configured)"""
+        if not email_service.is_configured():
+            logger.info("Email not configured, outbox worker not started")
+            return
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the sender loop and close pooled SMTP sessions"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            try:
+                await asyncio.wait_for(self._task, timeout=self.stop_timeout)
+            except asyncio.TimeoutError:
+                # A send stuck on an unresponsive server must not hang shutdown:
+                # the claimed rows stay leased and are retried once the lease expires
+                logger.warning("Outbox worker did not stop within %ss, cancelled", self.stop_timeout)
+            self._task = None
+        await email_service.close()
+
+    async def enqueue(
+        self,
+        to_email: str,
+        subject: str,
+        body: str,
+        attachment_paths: List[str],
+        conversation_id: Optional[UUID] = None
+    ) -> UUID:
+        """Persist an email in the outbox and wake the sender"""
+        outbox_id = await db.enqueue_email(
+            to_email=to_email,
+            subject=subject,
+            body=body,
+            attachment_paths=[p for p in attachment_paths if p],
+            conversation_id=conversation_id
+        )
+        self._wakeup.set()
+        return outbox_id
+
+    def backoff(self, attempts: int) -> float:
+        """Exponential backoff delay after the given number of failed attempts"""
+        return min(self.backoff_base * (2 ** (attempts - 1)), self.backoff_max)
+
+    async def drain_once(self) -> int:
+        """Claim and send one batch. Returns the number of emails processed."""
+        batch = await db.claim_outbox_batch(self.batch_size, self.lease_seconds)
+        if batch:
+            # Concurrency is bounded by the SMTP pool size
+            await asyncio.gather(*(self._deliver(item) for item in batch))
+        return len(batch)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                if await self.drain_once():
+                    continue
+            except Exception as e:
+                logger.exception("Outbox worker error: %s", e)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _deliver(self, item: Dict[str, Any]):
+        try:
+            message = await asyncio.to_thread(
+                email_service.build_message,
+                item["to_email"],
+                item["subject"],
+                item["body"],
+                item["attachment_paths"] or []
+            )
+            await email_service.send_message(message)
+        except Exception as e:
+            attempts = item["attempts"]
+            if attempts >= self.max_attempts:
+                logger.error(
+                    "Email dead-lettered: %s", e,
+                    extra={"outbox_id": str(item["id"]), "attempts": attempts}
+                )
+                await db.mark_outbox_failed(item["id"], repr(e), None)
+            else:
+                delay = self.backoff(attempts)
+                logger.warning(
+                    "Email send failed, retrying: %s", e,
+                    extra={"outbox_id": str(item["id"]), "attempts": attempts, "retry_in_s": delay}
+                )
+                await db.mark_outbox_failed(item["id"], repr(e), delay)
+            return
+
+        await db.mark_outbox_sent(item["id"])
+
+
+# Global instance
+outbox_worker = OutboxWorker()
@@ -1,8 +1,13 @@
 import os
+import logging
 from jinja2 import Environment, FileSystemLoader
 from weasyprint import HTML, CSS
 from datetime import datetime
 from typing import Dict, Any
+from app.utils.metrics import timed
+from app.utils.tracing import traced
+
+logger = logging.getLogger(__name__)
 
 # Define paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -16,6 +21,8 @@ os.makedirs(EXPORT_DIR, exist_ok=True)
 # Initialize Jinja2 environment
 env = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
 
+@timed("pdf_report")
+@traced("pdf.generate_report")
 def generate_report(config_data: Dict[str, Any], filename_prefix: str = "spapperi_config", recommendation: str = None) -> str:
     """
     Generate a PDF report from the configuration data.
@@ -64,15 +71,17 @@ def generate_report(config_data: Dict[str, Any], filename_prefix: str = "spapper
         return output_path
         
     except Exception as e:
-        print(f"Error generating PDF: {e}")
+        logger.error("Error generating PDF: %s", e)
         # Return None or raise? Let's return None and handle in caller
         return output_path
         
     except Exception as e:
-        print(f"Error generating PDF: {e}")
+        logger.error("Error generating PDF: %s", e)
         # Return None or raise? Let's return None and handle in caller
         return None
 
+@timed("pdf_commercial")
+@traced("pdf.generate_commercial_proposal")
 def generate_commercial_proposal(config_data: Dict[str, Any], filename_prefix: str = "spapperi_preventivo") -> str:
     """
     Generate a Commercial Proposal PDF.
@@ -130,5 +139,5 @@ def generate_commercial_proposal(config_data: Dict[str, Any], filename_prefix: s
         return output_path
 
     except Exception as e:
-        print(f"Error generating Commercial Proposal: {e}")
+        logger.error("Error generating Commercial Proposal: %s", e)
         return None
@@ -0,0 +1,469 @@
+"""
+Phase graph: compiles the declarative phase definitions into an immutable
+graph, validated once at startup.
+
+A definition is plain data:
+
+    "phase_x_y": {
+        "question": "..." | {variant: "..."},
+        "expected_format": "..." | {variant: "..."},
+        "variant": {"column": ..., "cases": {variant: [values]}, "default": variant},
+        "field": "...",                      # name the validator extracts for
+        "ui_type": "radio" | "checkbox",     # with "options": [...]
+        "image": "...",
+        "columns": {column: rule},           # extracted data -> configuration columns
+        "transitions": [{"if": {column: value}, "then": phase}],
+        "next_phase": phase | "complete",
+        "prefill": bool,                     # may be answered ahead (default True)
+        "depends_on": [columns],             # earlier answers it must be re-asked after
+        "local": {key: value_type},          # parsable without the LLM (degraded mode)
+    }
+
+A phase also depends on its variant column. When an earlier answer is
+edited, dependents_of(changed columns) gives the phases to ask again.
+
+Column rules:
+    {"from": [keys]}                          first truthy extracted key
+    {"flag": key}                             boolean, False when missing
+    {"yes_no": [keys]}                        True if the answer says yes
+    {"list": key}                             list, empty when missing
+    {"object": {sub: [keys]}, "merge": bool,  dict of sub-values, optionally
+     "when": flag_column,                     keeping existing ones; only when
+     "optional": {variant: [subs]}}           the flag is set; subs not needed
+                                              in a variant
+
+"local" names the extracted keys a deterministic parser can read from the
+answer ("number", "yes_no", "email" or "vat"); radio/checkbox phases are
+parsed locally from their options. Phases with neither are free text.
+
+Compilation precomputes every question/format variant and an option index,
+so a turn is a dictionary lookup, and checks that every phase is reachable
+from the start and can reach "complete".
+"""
+import logging
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, Any, Optional, Tuple, Mapping, Iterator, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+COMPLETE = "complete"
+
+# Variant used by phases whose question does not depend on earlier answers
+DEFAULT_VARIANT = ""
+
+YES_WORDS = ("sì", "si", "yes")
+
+DEFINITION_KEYS = frozenset({
+    "question", "expected_format", "variant", "field", "ui_type", "options",
+    "image", "columns", "transitions", "next_phase", "prefill", "depends_on", "local",
+})
+CHOICE_UI_TYPES = ("radio", "checkbox")
+LOCAL_VALUE_TYPES = ("number", "yes_no", "email", "vat")
+
+
+class PhaseGraphError(ValueError):
+    """Raised when the phase definitions do not compile into a valid graph"""
+
+
+@dataclass(frozen=True)
+class VariantRule:
+    """Picks a question variant from a configuration column"""
+    column: str
+    cases: Mapping[str, str]  # lowercased column value -> variant
+    default: str
+
+    def select(self, config: Dict[str, Any]) -> str:
+        return self.cases.get(str(config.get(self.column) or "").lower(), self.default)
+
+    @property
+    def variants(self) -> Tuple[str, ...]:
+        return tuple(dict.fromkeys([*self.cases.values(), self.default]))
+
+
+@dataclass(frozen=True)
+class ColumnRule:
+    """Maps extracted data to one configuration column"""
+    column: str
+    kind: str  # "from", "flag", "yes_no", "list" or "object"
+    keys: Tuple[str, ...] = ()
+    fields: Tuple[Tuple[str, Tuple[str, ...]], ...] = ()
+    merge: bool = False
+    when: Optional[str] = None
+    optional: Mapping[str, Tuple[str, ...]] = field(default_factory=lambda: MappingProxyType({}))
+
+    def value(self, extracted: Dict[str, Any], existing: Dict[str, Any]) -> Any:
+        if self.kind == "from" or self.kind == "yes_no":
+            value = None
+            for key in self.keys:
+                value = value or extracted.get(key)
+            if self.kind == "from":
+                return value
+            text = str(value or "").lower()
+            return any(word in text for word in YES_WORDS)
+        if self.kind == "flag":
+            return extracted.get(self.keys[0], False)
+        if self.kind == "list":
+            return extracted.get(self.keys[0], [])
+
+        current = existing.get(self.column) if self.merge else None
+        if not isinstance(current, dict):
+            current = {}
+        result = {}
+        for name, keys in self.fields:
+            value = None
+            for key in keys:
+                value = value or extracted.get(key)
+            result[name] = value or current.get(name)
+        return result
+
+    def is_filled(self, config: Dict[str, Any], variant: str) -> bool:
+        value = config.get(self.column)
+        if self.kind != "object":
+            return value not in (None, "")
+        if not isinstance(value, dict):
+            return False
+        skipped = self.optional.get(variant, ())
+        return all(value.get(name) is not None for name, _ in self.fields if name not in skipped)
+
+
+@dataclass(frozen=True)
+class Transition:
+    """Conditional edge: taken when every column holds the given value"""
+    conditions: Tuple[Tuple[str, Any], ...]
+    target: str
+
+    def matches(self, config: Dict[str, Any]) -> bool:
+        return all(config.get(column) == value for column, value in self.conditions)
+
+
+@dataclass(frozen=True)
+class Phase:
+    """A compiled phase. Immutable; all variants are precomputed."""
+    id: str
+    field: str
+    questions: Mapping[str, str]
+    expected_formats: Mapping[str, str]
+    lookahead_formats: Mapping[str, str]
+    variant_rule: Optional[VariantRule]
+    ui_type: Optional[str]
+    options: Tuple[str, ...]
+    option_index: Mapping[str, str]
+    image: Optional[str]
+    columns: Tuple[ColumnRule, ...]
+    transitions: Tuple[Transition, ...]
+    next_phase: str
+    prefill: bool
+    depends_on: frozenset
+    local_fields: Mapping[str, str]  # extracted key -> value type, parsed without the LLM
+
+    @property
+    def produces(self) -> frozenset:
+        """Configuration columns this phase writes"""
+        return frozenset(rule.column for rule in self.columns)
+
+    def variant(self, config: Dict[str, Any]) -> str:
+        return self.variant_rule.select(config) if self.variant_rule else DEFAULT_VARIANT
+
+    def question(self, config: Dict[str, Any]) -> str:
+        return self.questions[self.variant(config)]
+
+    def expected_format(self, config: Dict[str, Any]) -> str:
+        return self.expected_formats[self.variant(config)]
+
+    def lookahead_format(self, config: Dict[str, Any]) -> str:
+        """Expected format as shown when the phase may be answered ahead"""
+        return self.lookahead_formats[self.variant(config)]
+
+    def match_option(self, value: Any) -> Optional[str]:
+        """Canonical option for `value` (case/whitespace-insensitive), or None"""
+        return self.option_index.get(" ".join(str(value or "").split()).lower())
+
+    def map_columns(self, extracted: Optional[Dict[str, Any]], existing: Dict[str, Any]) -> Dict[str, Any]:
+        """Configuration columns for the data extracted from an answer"""
+        extracted = extracted or {}
+        data: Dict[str, Any] = {}
+        for rule in self.columns:
+            if rule.when and not data.get(rule.when):
+                continue
+            data[rule.column] = rule.value(extracted, existing)
+        return data
+
+    def is_satisfied(self, config: Dict[str, Any]) -> bool:
+        """Whether the configuration already holds everything the phase asks for"""
+        variant = self.variant(config)
+        for rule in self.columns:
+            if rule.when and not config.get(rule.when):
+                continue
+            if not rule.is_filled(config, variant):
+                return False
+        return True
+
+    def next_for(self, config: Dict[str, Any]) -> str:
+        """Following phase given the configuration after this phase was answered"""
+        for transition in self.transitions:
+            if transition.matches(config):
+                return transition.target
+        return self.next_phase
+
+    @property
+    def is_free_text(self) -> bool:
+        """Whether only the LLM can interpret the answer (no options, no local fields)"""
+        return not self.options and not self.local_fields
+
+    @property
+    def targets(self) -> Tuple[str, ...]:
+        return tuple(dict.fromkeys([t.target for t in self.transitions] + [self.next_phase]))
+
+
+class PhaseGraph:
+    """Immutable, validated phase graph with O(1) dispatch by phase id"""
+
+    def __init__(self, phases: Dict[str, Phase], start: str):
+        self._phases = MappingProxyType(dict(phases))
+        self.start = start
+
+        # Position along the default path, for "asked before" comparisons
+        order = []
+        phase = phases.get(start)
+        while phase and phase.id not in order:
+            order.append(phase.id)
+            phase = phases.get(phase.next_phase)
+        order += [phase_id for phase_id in phases if phase_id not in order]
+        self._position = MappingProxyType({phase_id: index for index, phase_id in enumerate(order)})
+
+        readers: Dict[str, List[str]] = {}
+        for phase in phases.values():
+            for column in phase.depends_on:
+                readers.setdefault(column, []).append(phase.id)
+        self._readers = MappingProxyType({column: tuple(ids) for column, ids in readers.items()})
+
+    def __getitem__(self, phase_id: str) -> Phase:
+        return self._phases[phase_id]
+
+    def __contains__(self, phase_id: object) -> bool:
+        return phase_id in self._phases
+
+    def __iter__(self) -> Iterator[Phase]:
+        return iter(self._phases.values())
+
+    def __len__(self) -> int:
+        return len(self._phases)
+
+    def get(self, phase_id: Optional[str]) -> Optional[Phase]:
+        return self._phases.get(phase_id)
+
+    def position(self, phase_id: str) -> int:
+        """Index along the default path; "complete" comes after every phase"""
+        return self._position.get(phase_id, len(self._position))
+
+    def dependents_of(self, columns: Iterable[str]) -> Tuple[Phase, ...]:
+        """Phases to re-ask when `columns` change, following dependencies transitively"""
+        pending = list(columns)
+        seen_columns = set(pending)
+        found: Dict[str, Phase] = {}
+        while pending:
+            for phase_id in self._readers.get(pending.pop(), ()):
+                if phase_id in found:
+                    continue
+                found[phase_id] = self._phases[phase_id]
+                for column in found[phase_id].produces - seen_columns:
+                    seen_columns.add(column)
+                    pending.append(column)
+        return tuple(sorted(found.values(), key=lambda phase: self.position(phase.id)))
+
+    def following(self, phase_id: str) -> Iterator[Phase]:
+        """Phases after `phase_id` along the default path"""
+        phase = self._phases.get(phase_id)
+        while phase and phase.next_phase in self._phases:
+            phase = self._phases[phase.next_phase]
+            yield phase
+
+
+# === COMPILER ===
+
+def _variants(value: Any, phase_id: str, key: str, variants: Tuple[str, ...]) -> Mapping[str, str]:
+    if isinstance(value, str):
+        return MappingProxyType({variant: value for variant in variants})
+    if not isinstance(value, dict) or set(value) != set(variants) or not all(isinstance(v, str) for v in value.values()):
+        raise PhaseGraphError(f"{phase_id}: '{key}' needs a text for each variant {sorted(variants)}")
+    return MappingProxyType(dict(value))
+
+
+def _keys(value: Any, phase_id: str, column: str) -> Tuple[str, ...]:
+    keys = (value,) if isinstance(value, str) else tuple(value or ())
+    if not keys or not all(isinstance(k, str) for k in keys):
+        raise PhaseGraphError(f"{phase_id}: column '{column}' needs extracted key names")
+    return keys
+
+
+def _compile_column(phase_id: str, column: str, spec: Dict[str, Any], variants: Tuple[str, ...]) -> ColumnRule:
+    kinds = [kind for kind in ("from", "flag", "yes_no", "list", "object") if kind in spec]
+    if len(kinds) != 1:
+        raise PhaseGraphError(f"{phase_id}: column '{column}' needs exactly one of from/flag/yes_no/list/object")
+    kind = kinds[0]
+    if kind != "object":
+        return ColumnRule(column=column, kind=kind, keys=_keys(spec[kind], phase_id, column), when=spec.get("when"))
+
+    fields = tuple((name, _keys(keys, phase_id, column)) for name, keys in spec["object"].items())
+    names = {name for name, _ in fields}
+    optional = {}
+    for variant, skipped in (spec.get("optional") or {}).items():
+        if variant not in variants or not set(skipped) <= names:
+            raise PhaseGraphError(f"{phase_id}: column '{column}' has an invalid optional entry for '{variant}'")
+        optional[variant] = tuple(skipped)
+    return ColumnRule(
+        column=column,
+        kind=kind,
+        fields=fields,
+        merge=bool(spec.get("merge")),
+        when=spec.get("when"),
+        optional=MappingProxyType(optional),
+    )
+
+
+def _compile_phase(phase_id: str, spec: Dict[str, Any], allowed_columns: Optional[Iterable[str]]) -> Phase:
+    unknown = set(spec) - DEFINITION_KEYS
+    if unknown:
+        raise PhaseGraphError(f"{phase_id}: unknown keys {sorted(unknown)}")
+    for key in ("question", "expected_format", "field", "columns", "next_phase"):
+        if key not in spec:
+            raise PhaseGraphError(f"{phase_id}: missing '{key}'")
+
+    variant_rule = None
+    variants: Tuple[str, ...] = (DEFAULT_VARIANT,)
+    if "variant" in spec:
+        rule = spec["variant"]
+        cases = {str(value).lower(): variant for variant, values in rule["cases"].items() for value in values}
+        variant_rule = VariantRule(column=rule["column"], cases=MappingProxyType(cases), default=rule["default"])
+        variants = variant_rule.variants
+
+    ui_type = spec.get("ui_type")
+    options = tuple(spec.get("options") or ())
+    if ui_type not in (None, *CHOICE_UI_TYPES):
+        raise PhaseGraphError(f"{phase_id}: unknown ui_type '{ui_type}'")
+    if bool(ui_type) != bool(options):
+        raise PhaseGraphError(f"{phase_id}: options and a radio/checkbox ui_type go together")
+
+    columns = tuple(
+        _compile_column(phase_id, column, column_spec, variants)
+        for column, column_spec in spec["columns"].items()
+    )
+    if not columns:
+        raise PhaseGraphError(f"{phase_id}: no columns")
+    produced = [rule.column for rule in columns]
+    if allowed_columns is not None:
+        unknown_columns = set(produced) - set(allowed_columns)
+        if unknown_columns:
+            raise PhaseGraphError(f"{phase_id}: unknown configuration columns {sorted(unknown_columns)}")
+    for rule in columns:
+        if rule.when and rule.when not in produced[:produced.index(rule.column)]:
+            raise PhaseGraphError(f"{phase_id}: column '{rule.column}' depends on '{rule.when}', not set before it")
+
+    transitions = []
+    for transition in spec.get("transitions") or ():
+        conditions = tuple(transition["if"].items())
+        if not conditions or any(column not in produced for column, _ in conditions):
+            raise PhaseGraphError(f"{phase_id}: transitions may only test columns the phase sets")
+        transitions.append(Transition(conditions=conditions, target=transition["then"]))
+
+    local_fields = dict(spec.get("local") or {})
+    if local_fields and options:
+        raise PhaseGraphError(f"{phase_id}: choice phases are parsed from their options, not 'local'")
+    read_keys = {key for rule in columns for key in rule.keys}
+    read_keys |= {key for rule in columns for _, keys in rule.fields for key in keys}
+    for key, value_type in local_fields.items():
+        if value_type not in LOCAL_VALUE_TYPES:
+            raise PhaseGraphError(f"{phase_id}: local '{key}' has unknown type '{value_type}'")
+        if key not in read_keys:
+            raise PhaseGraphError(f"{phase_id}: local '{key}' is not read by any column")
+
+    depends_on = frozenset(spec.get("depends_on") or ())
+    if variant_rule:
+        depends_on |= {variant_rule.column}
+
+    questions = _variants(spec["question"], phase_id, "question", variants)
+    expected_formats = _variants(spec["expected_format"], phase_id, "expected_format", variants)
+    suffix = f" Opzioni: {', '.join(options)}." if options else ""
+    lookahead_formats = MappingProxyType({
+        variant: f"{text}{suffix} (campo '{spec['field']}')"
+        for variant, text in expected_formats.items()
+    })
+
+    return Phase(
+        id=phase_id,
+        field=spec["field"],
+        questions=questions,
+        expected_formats=expected_formats,
+        lookahead_formats=lookahead_formats,
+        variant_rule=variant_rule,
+        ui_type=ui_type,
+        options=options,
+        option_index=MappingProxyType({option.lower(): option for option in options}),
+        image=spec.get("image"),
+        columns=columns,
+        transitions=tuple(transitions),
+        next_phase=spec["next_phase"],
+        prefill=spec.get("prefill", True),
+        depends_on=depends_on,
+        local_fields=MappingProxyType(local_fields),
+    )
+
+
+def _check_reachability(phases: Dict[str, Phase], start: str):
+    """Every phase must be reachable from `start` and able to reach "complete" """
+    for phase in phases.values():
+        missing = [target for target in phase.targets if target != COMPLETE and target not in phases]
+        if missing:
+            raise PhaseGraphError(f"{phase.id}: transitions to unknown phases {missing}")
+
+    reached = {start}
+    frontier = [start]
+    while frontier:
+        for target in phases[frontier.pop()].targets:
+            if target in phases and target not in reached:
+                reached.add(target)
+                frontier.append(target)
+    unreachable = sorted(set(phases) - reached)
+    if unreachable:
+        raise PhaseGraphError(f"Phases not reachable from {start}: {unreachable}")
+
+    predecessors: Dict[str, List[str]] = {}
+    for phase in phases.values():
+        for target in phase.targets:
+            predecessors.setdefault(target, []).append(phase.id)
+    finishing = set()
+    frontier = [COMPLETE]
+    while frontier:
+        for source in predecessors.get(frontier.pop(), ()):
+            if source not in finishing:
+                finishing.add(source)
+                frontier.append(source)
+    stuck = sorted(set(phases) - finishing)
+    if stuck:
+        raise PhaseGraphError(f"Phases that never reach {COMPLETE}: {stuck}")
+
+
+def compile_phase_graph(
+    definitions: Dict[str, Dict[str, Any]],
+    start: str,
+    allowed_columns: Optional[Iterable[str]] = None
+) -> PhaseGraph:
+    """
+    Compile and validate phase definitions. Raises PhaseGraphError on any
+    malformed definition, dangling transition or unreachable/dead-end phase.
+    """
+    if start not in definitions:
+        raise PhaseGraphError(f"Start phase '{start}' is not defined")
+    phases = {
+        phase_id: _compile_phase(phase_id, spec, allowed_columns)
+        for phase_id, spec in definitions.items()
+    }
+    produced = set().union(*(phase.produces for phase in phases.values()))
+    for phase in phases.values():
+        unknown = phase.depends_on - produced
+        if unknown:
+            raise PhaseGraphError(f"{phase.id}: depends on columns no phase sets {sorted(unknown)}")
+    _check_reachability(phases, start)
+    logger.debug("Phase graph compiled", extra={"phases": len(phases), "start": start})
+    return PhaseGraph(phases, start)
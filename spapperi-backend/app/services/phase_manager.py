@@ -1,11 +1,33 @@
 """
 Phase Manager: Finite State Machine for managing conversation flow.
 Handles 6 main phases with 15+ sub-phases and conditional logic.
+
+The flow is declared as data in PhaseManager.PHASES and compiled once at
+import into an immutable, validated graph (see phase_graph.py).
 """
-from typing import Dict, Any, Optional, Tuple
+import os
+import logging
+from decimal import Decimal
+from typing import Dict, Any, Optional, Tuple, List
 from uuid import UUID
 from app.services.openai_validator import ai_validator
+from app.services.local_validator import local_validator
 from app.services.db import db
+from app.services.phase_graph import compile_phase_graph
+from app.services.rag_service import RECOMMENDATION_INPUTS
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# One validator call may also fill later phases the user answered ahead
+MULTI_SLOT_ENABLED = os.getenv("MULTI_SLOT_EXTRACTION", "true").lower() in ("1", "true", "yes")
+
+# Accessory option meaning "none selected"
+NO_ACCESSORY = "Nessuno"
+
+# Messages kept in the conversation checkpoint for a fast resume
+CHECKPOINT_MESSAGES = int(os.getenv("CHECKPOINT_MESSAGES", "6"))
+CHECKPOINT_VERSION = 1
 
 
 class PhaseManager:
@@ -13,12 +35,15 @@ class PhaseManager:
     Manages conversation phase transitions and question flow.
     """
     
-    # Phase definitions with question templates and validation
+    START_PHASE = "phase_1_1"
+    
+    # Phase definitions: questions, extraction-to-column mapping and transitions
     PHASES = {
         "phase_1_1": {
             "question": "Per iniziare, potresti indicarmi cosa devi trapiantare?",
             "expected_format": "Testo libero: nome della coltura (es: pomodori, insalata, fragole). RESTITUISCI JSON con key 'crop_type'.",
             "field": "crop_type",
+            "columns": {"crop_type": {"from": ["crop_type", "raw"]}},
             "next_phase": "phase_1_2"
         },
         "phase_1_2": {
@@ -32,6 +57,7 @@ class PhaseManager:
                 "Zolla Conica",
                 "Zolla Piramidale"
             ],
+            "columns": {"root_type": {"from": ["root_type", "raw"]}},
             "next_phase": "phase_1_3"
         },
         "phase_1_3": {
@@ -39,6 +65,10 @@ class PhaseManager:
             "expected_format": "4 valori numerici per A, B, C, D in centimetri",
             "field": "root_dimensions",
             "image": "/api/images/configurator/size.png",
+            "columns": {
+                "root_dimensions": {"object": {"A": ["A"], "B": ["B"], "C": ["C"], "D": ["D"]}, "merge": True}
+            },
+            "local": {"A": "number", "B": "number", "C": "number", "D": "number"},
             "next_phase": "phase_2_1"
         },
         "phase_2_1": {
@@ -47,21 +77,32 @@ class PhaseManager:
             "field": "row_type",
             "ui_type": "radio",
             "options": ["File singole", "File binate"],
+            # GPT-4o might use different names
+            "columns": {"row_type": {"from": ["row_type", "sesto_impianto", "type", "raw"]}},
             "next_phase": "phase_2_2"
         },
         "phase_2_2": {
-            "question": lambda data: (
-                print(f"DEBUG phase_2_2: row_type = {data.get('row_type')}") or
-                "Inserisci il numero di file, l'interfila (IF) in cm e l'interpianta (IP) in cm."
-                if (data.get("row_type") or "").lower() in ["singole", "singolo", "single", "file singole"]
-                else "Inserisci il numero di bine, l'interfila (IF) in cm, l'interpianta (IP) in cm e l'interbina (IB) in cm."
-            ),
-            "expected_format": lambda data: (
-                "3 valori: numero file, IF (cm), IP (cm)"
-                if (data.get("row_type") or "").lower() in ["singole", "singolo", "single", "file singole"]
-                else "4 valori: numero bine, IF (cm), IP (cm), IB (cm)"
-            ),
+            "variant": {
+                "column": "row_type",
+                "cases": {"single": ["singole", "singolo", "single", "file singole"]},
+                "default": "twin"
+            },
+            "question": {
+                "single": "Inserisci il numero di file, l'interfila (IF) in cm e l'interpianta (IP) in cm.",
+                "twin": "Inserisci il numero di bine, l'interfila (IF) in cm, l'interpianta (IP) in cm e l'interbina (IB) in cm."
+            },
+            "expected_format": {
+                "single": "3 valori: numero file, IF (cm), IP (cm)",
+                "twin": "4 valori: numero bine, IF (cm), IP (cm), IB (cm)"
+            },
             "field": "layout_details",
+            "columns": {
+                "layout_details": {
+                    "object": {"number_of_rows": ["number_of_rows", "rows"], "IF": ["IF"], "IP": ["IP"], "IB": ["IB"]},
+                    "optional": {"single": ["IB"]}
+                }
+            },
+            "local": {"number_of_rows": "number", "IF": "number", "IP": "number", "IB": "number"},
             "next_phase": "phase_3_1"
         },
         "phase_3_1": {
@@ -70,18 +111,33 @@ class PhaseManager:
             "field": "environment",
             "ui_type": "radio",
             "options": ["Campo aperto", "Serra"],
+            "columns": {"environment": {"from": ["environment", "raw"]}},
             "next_phase": "phase_3_2"
         },
         "phase_3_2": {
             "question": "Il trapianto viene effettuato su baula? Se sì, inserisci: Altezza baula (AT), Larghezza (LT), Inter baula (IT) e Spazio tra baule (ST) in cm.",
             "expected_format": "RESTITUISCI JSON con keys: 'is_raised_bed' (boolean), 'AT', 'LT', 'IT', 'ST' (numeri in cm). Se No, is_raised_bed=false.",
             "field": "is_raised_bed",
+            "columns": {
+                "is_raised_bed": {"flag": "is_raised_bed"},
+                "raised_bed_details": {
+                    "object": {"AT": ["AT"], "LT": ["LT"], "IT": ["IT"], "ST": ["ST"]},
+                    "merge": True,
+                    "when": "is_raised_bed"
+                }
+            },
+            "local": {"is_raised_bed": "yes_no", "AT": "number", "LT": "number", "IT": "number", "ST": "number"},
             "next_phase": "phase_3_3"
         },
         "phase_3_3": {
             "question": "Il trapianto viene effettuato sopra pacciamatura? Se sì, inserisci la Larghezza telo (LP) in cm.",
             "expected_format": "RESTITUISCI JSON con keys: 'is_mulch' (boolean), 'LP' (numero in cm). Se No, is_mulch=false.",
             "field": "is_mulch",
+            "columns": {
+                "is_mulch": {"flag": "is_mulch"},
+                "mulch_details": {"object": {"LP": ["LP"]}, "merge": True, "when": "is_mulch"}
+            },
+            "local": {"is_mulch": "yes_no", "LP": "number"},
             "next_phase": "phase_3_4"
         },
         "phase_3_4": {
@@ -93,18 +149,23 @@ class PhaseManager:
                 "Argilloso",
                 "Sabbioso"
             ],
+            "columns": {"soil_type": {"from": ["soil_type", "raw"]}},
             "next_phase": "phase_4_1"
         },
         "phase_4_1": {
             "question": "Dammi qualche info sul trattore. Qual è la misura interna delle ruote in cm?",
             "expected_format": "RESTITUISCI JSON con key: 'wheel_distance' (numero in cm)",
             "field": "wheel_distance",
+            "columns": {"wheel_distance_internal": {"from": ["wheel_distance", "raw"]}},
+            "local": {"wheel_distance": "number"},
             "next_phase": "phase_4_2"
         },
         "phase_4_2": {
             "question": "Quanti cavalli (HP) ha il trattore?",
             "expected_format": "RESTITUISCI JSON con key: 'tractor_hp' (numero)",
             "field": "tractor_hp",
+            "columns": {"tractor_hp": {"from": ["tractor_hp", "raw"]}},
+            "local": {"tractor_hp": "number"},
             "next_phase": "phase_5_1"
         },
         "phase_5_1": {
@@ -121,6 +182,7 @@ class PhaseManager:
                 "Ripiani Porta Alveoli",
                 "Ripiani supplementari"
             ],
+            "columns": {"accessories_primary": {"list": "accessories"}},
             "next_phase": "phase_5_2"
         },
         "phase_5_2": {
@@ -134,6 +196,7 @@ class PhaseManager:
                 "Tracciatori fila manuali",
                 "Tracciatori fila idraulici"
             ],
+            "columns": {"accessories_secondary": {"list": "accessories"}},
             "next_phase": "phase_5_3"
         },
         "phase_5_3": {
@@ -148,12 +211,16 @@ class PhaseManager:
                 "Coltello appisolo",
                 "Rullo in gomma"
             ],
+            "columns": {"accessories_element": {"list": "accessories"}},
             "next_phase": "phase_6_1"
         },
+        # Closing questions (notes, interest, contacts) are always asked explicitly
         "phase_6_1": {
             "question": "Hai delle note o richieste particolari da aggiungere?",
             "expected_format": "RESTITUISCI JSON con key: 'notes' (stringa) o null se No.",
             "field": "user_notes",
+            "columns": {"user_notes": {"from": ["notes", "raw"]}},
+            "prefill": False,
             "next_phase": "phase_6_2"
         },
         "phase_6_2": {
@@ -162,16 +229,35 @@ class PhaseManager:
             "field": "is_interested",
             "ui_type": "radio",
             "options": ["Sì", "No"],
+            # OpenAI extracts as 'interested_in_commercial_info_or_quote'
+            "columns": {"is_interested": {"yes_no": ["interested_in_commercial_info_or_quote", "raw"]}},
+            "prefill": False,
+            # Skip contact info collection if not interested
+            "transitions": [{"if": {"is_interested": False}, "then": "complete"}],
             "next_phase": "phase_6_3"
         },
         "phase_6_3": {
             "question": "Perfetto. Lasciami la tua Partita IVA e la tua Email per ricontattarti con il report pronto.",
             "expected_format": "RESTITUISCI JSON con keys: 'email', 'vat_number'.",
             "field": "contact_info",
+            "columns": {
+                "contact_email": {"from": ["email"]},
+                "vat_number": {"from": ["vat_number"]}
+            },
+            "local": {"email": "email", "vat_number": "vat"},
+            "prefill": False,
             "next_phase": "complete"
         }
     }
     
+    # Compiled once at startup; raises PhaseGraphError if the flow is broken
+    GRAPH = compile_phase_graph(PHASES, start=START_PHASE, allowed_columns=db.CONFIGURATION_COLUMNS)
+    
+    # Derived artifacts stored with the configuration -> columns they are computed from
+    DERIVED_ARTIFACTS = {
+        "recommendation": RECOMMENDATION_INPUTS,
+    }
+    
     @classmethod
     async def get_next_question(
         cls,
@@ -184,260 +270,415 @@ class PhaseManager:
         Returns:
             (question_text, image_url, ui_type, options)
         """
-        phase_data = cls.PHASES.get(current_phase)
-        if not phase_data:
+        if current_phase not in cls.GRAPH:
             return ("Errore: fase non riconosciuta", None, None, None)
         
         # Get configuration data for conditional questions
         config = await db.get_configuration_data(conversation_id)
-        data = config or {}
-        
-        print(f"DEBUG get_next_question: phase={current_phase}, config data={data}")
-        
-        # Generate question (might be callable for conditional logic)
-        question = phase_data["question"]
-        if callable(question):
-            question = question(data)
         
-        # Get image URL if present
-        image_url = phase_data.get("image")
-        
-        # Get UI metadata (for checkbox rendering)
-        ui_type = phase_data.get("ui_type")
-        options = phase_data.get("options")
-        
-        return (question, image_url, ui_type, options)
+        logger.debug("Building next question", extra={"next_phase": current_phase})
+        return cls.render_question(current_phase, config or {})
+    
+    @classmethod
+    def render_question(
+        cls,
+        phase_id: str,
+        data: Dict[str, Any]
+    ) -> Tuple[str, Optional[str], Optional[str], Optional[list]]:
+        """(question_text, image_url, ui_type, options) of a phase for the given configuration"""
+        phase = cls.GRAPH[phase_id]
+        # UI metadata (for checkbox rendering)
+        options = list(phase.options) if phase.options else None
+        return (phase.question(data), phase.image, phase.ui_type, options)
     
     @classmethod
     async def process_user_response(
         cls,
         conversation_id: UUID,
         current_phase: str,
-        user_message: str
+        user_message: str,
+        resume_phase: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Process user response: validate, extract data, determine next phase.
+        `resume_phase` is set when the answer edits an earlier phase.
         
         Returns:
             {
                 "is_valid": bool,
                 "next_phase": str,
                 "extracted_data": dict,
-                "clarification_needed": str | None
+                "clarification_needed": str | None,
+                "resume_phase": str | None  # still editing: where to return to
             }
         """
-        phase_data = cls.PHASES.get(current_phase)
-        if not phase_data:
+        phase = cls.GRAPH.get(current_phase)
+        if not phase:
             return {
                 "is_valid": False,
                 "next_phase": current_phase,
                 "extracted_data": {},
-                "clarification_needed": "Fase non valida"
+                "clarification_needed": "Fase non valida",
+                "resume_phase": resume_phase
             }
         
         # Get configuration data for conditional validation
         config = await db.get_configuration_data(conversation_id)
         data = config or {}
         
-        # Get expected format (might be callable)
-        expected_format = phase_data["expected_format"]
-        if callable(expected_format):
-            expected_format = expected_format(data)
-        
-        # Get question for context
-        question = phase_data["question"]
-        if callable(question):
-            question = question(data)
+        # Get the latest user messages of this phase (for context-aware validation)
+        phase_messages = await db.get_phase_user_messages(conversation_id, current_phase)
         
-        # Get conversation history for this phase (for context-aware validation)
-        all_messages = await db.get_conversation_messages(conversation_id)
-        
-        # Find when current phase started and get messages since then
-        phase_messages = []
-        phase_started = False
-        for msg in all_messages:
-            # Detect phase start (assistant asks the question for this phase)
-            if msg['role'] == 'assistant' and not phase_started:
-                # Check if this message contains the current phase question
-                if question[:50] in msg['content']:  # Match first 50 chars
-                    phase_started = True
-            elif phase_started:
-                phase_messages.append(msg)
+        # Later phases still to be asked, in case the user answers ahead
+        lookahead = cls._lookahead_formats(current_phase, data) if MULTI_SLOT_ENABLED else None
         
         # Validate with OpenAI, including conversation history
         validation = await ai_validator.validate_response(
             phase=current_phase,
             user_message=user_message,
-            expected_format=expected_format,
-            context=question,
-            conversation_history=phase_messages
+            expected_format=phase.expected_format(data),
+            context=phase.question(data),
+            conversation_history=phase_messages,
+            lookahead=lookahead
         )
         
+        deferred = False
+        if validation.get("unavailable"):
+            # LLM down or circuit open: parse locally, or accept free text as written
+            validation, deferred = cls._validate_degraded(phase, user_message, data)
+        
         is_complete = validation.get("is_complete", False)
         extracted = validation.get("extracted_data", {})
         clarification = validation.get("clarification_needed")
+        prefill = cls._prefill_data(validation.get("additional_data"), lookahead, data)
         
         if not is_complete:
+            # Keep whatever later phases the answer already covered
+            if prefill:
+                await db.save_configuration_data(conversation_id, prefill)
             return {
                 "is_valid": False,
                 "next_phase": current_phase,  # Stay in same phase
                 "extracted_data": {},
-                "clarification_needed": clarification
+                "clarification_needed": clarification,
+                "resume_phase": resume_phase
             }
         
-        # Save extracted data to configuration
-        field = phase_data["field"]
-        await cls._save_field_data(conversation_id, field, extracted, data)
+        # Save extracted data (current phase and any prefilled ones) in one upsert
+        save_data = {**prefill, **phase.map_columns(extracted, data)}
+        if resume_phase:
+            # Edited answer: clear what depended on the values that changed
+            save_data.update(cls._invalidated_columns(current_phase, data, save_data))
+        config = await db.save_configuration_data(conversation_id, save_data)
+        if deferred:
+            await db.enqueue_enrichment(
+                conversation_id, current_phase, user_message,
+                {column: save_data[column] for column in phase.produces if column in save_data}
+            )
         
         # Determine next phase with conditional logic
-        next_phase = await cls._determine_next_phase(current_phase, extracted, data)
+        next_phase, resume_phase = await cls._determine_next_phase(
+            current_phase, config or {**data, **save_data}, resume_phase
+        )
         
         return {
             "is_valid": True,
             "next_phase": next_phase,
             "extracted_data": extracted,
-            "clarification_needed": None
+            "clarification_needed": None,
+            "resume_phase": resume_phase
         }
     
+    # === DEGRADED MODE ===
+    
     @classmethod
-    async def _save_field_data(
-        cls,
-        conversation_id: UUID,
-        field: str,
-        extracted_data: Dict[str, Any],
-        existing_data: Dict[str, Any]
-    ):
-        """Save extracted field data to configuration"""
-        if not extracted_data:
-            extracted_data = {}
-            
-        save_data = {"conversation_id": conversation_id}
-        
-        # Mapping logic based on field typea to database fields
-        if field == "crop_type":
-            save_data["crop_type"] = extracted_data.get("crop_type") or extracted_data.get("raw")
-        
-        elif field == "root_type":
-            save_data["root_type"] = extracted_data.get("root_type") or extracted_data.get("raw")
-        
-        elif field == "root_dimensions":
-            current_dims = existing_data.get("root_dimensions") or {}
-            if not isinstance(current_dims, dict):
-                current_dims = {}
-                
-            save_data["root_dimensions"] = {
-                "A": extracted_data.get("A") or current_dims.get("A"),
-                "B": extracted_data.get("B") or current_dims.get("B"),
-                "C": extracted_data.get("C") or current_dims.get("C"),
-                "D": extracted_data.get("D") or current_dims.get("D")
-            }
-        
-        elif field == "row_type":
-            print(f"DEBUG save row_type: extracted_data = {extracted_data}")
-            # Try multiple keys as GPT-4o might use different names
-            save_data["row_type"] = (
-                extracted_data.get("row_type") or 
-                extracted_data.get("sesto_impianto") or
-                extracted_data.get("type") or
-                extracted_data.get("raw")
+    def _validate_degraded(cls, phase, user_message: str, data: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """
+        Validation without the LLM: (result, deferred). Choice and numeric
+        phases are parsed deterministically; a free-text answer is accepted
+        as written (deferred=True) and queued for LLM extraction.
+        """
+        validation = local_validator.validate(phase, user_message, data, empty_option=NO_ACCESSORY)
+        if validation is not None:
+            metrics.record_degraded_validation(
+                phase.id, "local_complete" if validation["is_complete"] else "local_incomplete"
             )
-            print(f"DEBUG save row_type: saving value = {save_data['row_type']}")
-        
-        
-        elif field == "layout_details":
-            save_data["layout_details"] = {
-                "number_of_rows": extracted_data.get("number_of_rows") or extracted_data.get("rows"),
-                "IF": extracted_data.get("IF"),
-                "IP": extracted_data.get("IP"),
-                "IB": extracted_data.get("IB")  # None for single rows
-            }
-        
-        elif field == "environment":
-            save_data["environment"] = extracted_data.get("environment") or extracted_data.get("raw")
-        
-        elif field == "is_raised_bed":
-            is_raised = extracted_data.get("is_raised_bed", False)
-            save_data["is_raised_bed"] = is_raised
-            if is_raised:
-                current_rb = existing_data.get("raised_bed_details") or {}
-                if not isinstance(current_rb, dict):
-                    current_rb = {}
-                save_data["raised_bed_details"] = {
-                    "AT": extracted_data.get("AT") or current_rb.get("AT"),
-                    "LT": extracted_data.get("LT") or current_rb.get("LT"),
-                    "IT": extracted_data.get("IT") or current_rb.get("IT"),
-                    "ST": extracted_data.get("ST") or current_rb.get("ST")
-                }
-        
-        elif field == "is_mulch":
-            is_mulch = extracted_data.get("is_mulch", False)
-            save_data["is_mulch"] = is_mulch
-            if is_mulch:
-                current_mulch = existing_data.get("mulch_details") or {}
-                if not isinstance(current_mulch, dict):
-                    current_mulch = {}
-                save_data["mulch_details"] = {
-                    "LP": extracted_data.get("LP") or current_mulch.get("LP")
-                }
-        
-        elif field == "soil_type":
-            save_data["soil_type"] = extracted_data.get("soil_type") or extracted_data.get("raw")
-        
-        elif field == "wheel_distance":
-            save_data["wheel_distance_internal"] = extracted_data.get("wheel_distance") or extracted_data.get("raw")
-        
-        elif field == "tractor_hp":
-            save_data["tractor_hp"] = extracted_data.get("tractor_hp") or extracted_data.get("raw")
-        
-        elif field == "accessories_primary":
-            save_data["accessories_primary"] = extracted_data.get("accessories", [])
-        
-        elif field == "accessories_secondary":
-            save_data["accessories_secondary"] = extracted_data.get("accessories", [])
-        
-        elif field == "accessories_element":
-            save_data["accessories_element"] = extracted_data.get("accessories", [])
-        
-        elif field == "user_notes":
-            save_data["user_notes"] = extracted_data.get("notes") or extracted_data.get("raw")
+            return validation, False
+        if not user_message.strip():
+            return ai_validator.unavailable(), False
+        metrics.record_degraded_validation(phase.id, "deferred")
+        return {"is_complete": True, "extracted_data": {"raw": user_message.strip()}, "clarification_needed": None}, True
+    
+    @classmethod
+    async def enrich_deferred(cls, job: Dict[str, Any]) -> bool:
+        """
+        Run the LLM extraction for a free-text answer accepted in degraded
+        mode and replace the provisional columns with its result. Columns
+        changed since (e.g. the user edited the answer) are left alone.
         
-        elif field == "is_interested":
-            # Handle checkbox response ["Sì"] or ["No"]
-            print(f"DEBUG is_interested: extracted_data = {extracted_data}")
-            # OpenAI extracts as 'interested_in_commercial_info_or_quote'
-            value = extracted_data.get("interested_in_commercial_info_or_quote") or extracted_data.get("raw", "")
-            is_yes = "sì" in str(value).lower() or "si" in str(value).lower() or "yes" in str(value).lower()
-            print(f"DEBUG is_interested: value='{value}', is_yes={is_yes}")
-            save_data["is_interested"] = is_yes
+        Returns False when the LLM is still unavailable (retry later).
+        """
+        conversation_id = job["conversation_id"]
+        phase = cls.GRAPH.get(job["phase"])
+        if phase is None:
+            return True
+        data = await db.get_configuration_data(conversation_id) or {}
+        validation = await ai_validator.validate_response(
+            phase=phase.id,
+            user_message=job["user_message"],
+            expected_format=phase.expected_format(data),
+            context=phase.question(data)
+        )
+        if validation.get("unavailable"):
+            return False
+        if not validation.get("is_complete"):
+            # The raw answer stays: it is what the user wrote
+            return True
+        
+        provisional = job["provisional"] or {}
+        enriched = {
+            column: value
+            for column, value in phase.map_columns(validation.get("extracted_data"), data).items()
+            if column in provisional and data.get(column) == provisional[column] and value != provisional[column]
+        }
+        if enriched:
+            # Derived artifacts built from the raw values are stale now
+            enriched.update({
+                artifact: None for artifact, inputs in cls.DERIVED_ARTIFACTS.items()
+                if inputs & set(enriched)
+            })
+            await db.save_configuration_data(conversation_id, enriched)
+            logger.info("Deferred answer enriched", extra={"phase": phase.id, "columns": sorted(enriched)})
+        return True
+    
+    @classmethod
+    def inputs_ready(cls, inputs: frozenset, config: Dict[str, Any]) -> bool:
+        """Whether every phase producing one of `inputs` is answered in `config`"""
+        return all(phase.is_satisfied(config) for phase in cls.GRAPH if phase.produces & inputs)
+    
+    # === BACK-NAVIGATION ===
+    
+    @classmethod
+    def is_answered(cls, phase_id: str, conversation: Dict[str, Any]) -> bool:
+        """Whether `phase_id` was already asked (before the point the conversation resumes from)"""
+        if phase_id not in cls.GRAPH:
+            return False
+        position = conversation.get("resume_phase") or conversation["current_phase"]
+        return cls.GRAPH.position(phase_id) < cls.GRAPH.position(position)
+    
+    @classmethod
+    async def reopen_phase(
+        cls,
+        conversation_id: UUID,
+        conversation: Dict[str, Any],
+        phase_id: str
+    ) -> Tuple[str, Optional[str], Optional[str], Optional[list]]:
+        """
+        Go back to an answered phase. The next answer replaces the old one;
+        the conversation then resumes where it was (see _determine_next_phase).
         
-        elif field == "contact_info":
-            save_data["contact_email"] = extracted_data.get("email")
-            save_data["vat_number"] = extracted_data.get("vat_number")
+        Returns the question to ask, like get_next_question.
+        """
+        # Editing again while already editing keeps the original resume point
+        resume_phase = conversation.get("resume_phase") or conversation["current_phase"]
+        await db.reopen_conversation_phase(conversation_id, phase_id, resume_phase)
+        logger.info("Reopened phase", extra={"reopened_phase": phase_id, "resume_phase": resume_phase})
+        return await cls.get_next_question(conversation_id, phase_id)
+    
+    @classmethod
+    def _invalidated_columns(
+        cls,
+        current_phase: str,
+        existing_data: Dict[str, Any],
+        save_data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Columns to clear after an edit: those of the phases depending on a
+        changed value (re-asked on the way back) and derived artifacts built
+        from one. Unchanged answers invalidate nothing.
+        """
+        changed = {column for column, value in save_data.items() if existing_data.get(column) != value}
+        if not changed:
+            return {}
+        
+        cleared = {}
+        for phase in cls.GRAPH.dependents_of(changed):
+            if phase.id != current_phase:
+                cleared.update({column: None for column in phase.produces if column not in save_data})
+        for artifact, inputs in cls.DERIVED_ARTIFACTS.items():
+            if existing_data.get(artifact) is not None and changed & inputs:
+                cleared[artifact] = None
+        
+        if cleared:
+            logger.info("Edit invalidated answers", extra={"changed": sorted(changed), "cleared": sorted(cleared)})
+        return cleared
+    
+    # === CHECKPOINTS ===
+    
+    @classmethod
+    def build_checkpoint(
+        cls,
+        conversation: Dict[str, Any],
+        phase: str,
+        configuration: Optional[Dict[str, Any]],
+        new_messages: List[Dict[str, Any]],
+        resume_phase: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Compact conversation snapshot, stored with the message that opens
+        `phase` (which adds the phase-start pointer). Holds what a returning
+        client needs: phase, answers so far and the last few messages.
+        """
+        previous = (conversation.get("checkpoints") or {}).get("messages") or []
+        messages = [
+            {key: message.get(key) for key in ("role", "content", "image_url", "phase")}
+            for message in previous + new_messages
+        ][-CHECKPOINT_MESSAGES:]
         
-        await db.save_configuration_data(conversation_id, save_data)
+        configuration = configuration or {}
+        return {
+            "version": CHECKPOINT_VERSION,
+            "phase": phase,
+            "resume_phase": resume_phase,
+            "configuration": {
+                # NUMERIC columns come back as Decimal, which JSON can't encode
+                column: float(configuration[column]) if isinstance(configuration[column], Decimal) else configuration[column]
+                for column in sorted(db.CONFIGURATION_COLUMNS - db.ARTIFACT_COLUMNS)
+                if configuration.get(column) is not None
+            },
+            "messages": messages,
+        }
+    
+    @classmethod
+    def resume_view(cls, conversation: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Client state rebuilt from the conversation row's checkpoint alone, or
+        None when there is no checkpoint matching the conversation's phase.
+        """
+        checkpoint = conversation.get("checkpoints")
+        phase = conversation["current_phase"]
+        if not isinstance(checkpoint, dict) or checkpoint.get("version") != CHECKPOINT_VERSION or checkpoint.get("phase") != phase:
+            return None
+        
+        view = {
+            "current_phase": phase,
+            "resume_phase": conversation.get("resume_phase"),
+            "messages": checkpoint.get("messages") or [],
+            "is_complete": phase == "complete",
+        }
+        if phase in cls.GRAPH:
+            question, image_url, ui_type, options = cls.render_question(phase, checkpoint.get("configuration") or {})
+            view.update(question=question, image_url=image_url, ui_type=ui_type, options=options)
+        return view
+    
+    # === MULTI-SLOT EXTRACTION ===
+    
+    @classmethod
+    def _is_satisfied(cls, phase_id: str, config: Dict[str, Any]) -> bool:
+        """Whether the configuration already holds everything `phase_id` asks for"""
+        phase = cls.GRAPH.get(phase_id)
+        return bool(phase and phase.prefill and phase.is_satisfied(config))
+    
+    @classmethod
+    def _lookahead_formats(cls, current_phase: str, data: Dict[str, Any]) -> Dict[str, str]:
+        """Expected formats of the later phases that are not yet satisfied"""
+        formats = {}
+        for phase in cls.GRAPH.following(current_phase):
+            if not phase.prefill:
+                break
+            if not phase.is_satisfied(data):
+                formats[phase.id] = phase.lookahead_format(data)
+        return formats
+    
+    @classmethod
+    def _prefill_data(
+        cls,
+        additional_data: Any,
+        lookahead: Optional[Dict[str, str]],
+        existing_data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Configuration columns for later phases found in the answer. Values
+        that are missing or don't match a phase option are dropped, so a
+        prefill can never overwrite known data with nothing.
+        """
+        if not lookahead or not isinstance(additional_data, dict):
+            return {}
+        
+        prefill: Dict[str, Any] = {}
+        for phase_id, extracted in additional_data.items():
+            if phase_id not in lookahead or not isinstance(extracted, dict) or not extracted:
+                continue
+            phase = cls.GRAPH[phase_id]
+            columns = phase.map_columns(extracted, {**existing_data, **prefill})
+            
+            accepted = {}
+            for column, value in columns.items():
+                if value is None or (isinstance(value, dict) and not any(v is not None for v in value.values())):
+                    continue
+                if phase.ui_type == "radio" and isinstance(value, str):
+                    value = phase.match_option(value)
+                    if value is None:
+                        continue
+                elif phase.ui_type == "checkbox":
+                    options = [phase.match_option(v) for v in value or []]
+                    if None in options:
+                        continue
+                    value = [o for o in options if o != NO_ACCESSORY]
+                accepted[column] = value
+            
+            if accepted:
+                logger.debug("Prefilled later phase", extra={"prefilled_phase": phase_id, "columns": sorted(accepted)})
+                prefill.update(accepted)
+        return prefill
     
     @classmethod
     async def _determine_next_phase(
         cls,
         current_phase: str,
-        extracted_data: Dict[str, Any],
-        configuration_data: Dict[str, Any]
-    ) -> str:
-        """Determine next phase with conditional logic"""
-        
-        # Special case: Skip phase 6.3 if user is not interested
-        if current_phase == "phase_6_2":
-            # OpenAI extracts as 'interested_in_commercial_info_or_quote'
-            value = extracted_data.get("interested_in_commercial_info_or_quote", "")
-            is_interested = "sì" in str(value).lower() or "si" in str(value).lower() or "yes" in str(value).lower()
-            print(f"DEBUG next_phase: value='{value}', is_interested={is_interested}")
-            if not is_interested:
-                return "complete"  # Skip contact info collection
+        configuration_data: Dict[str, Any],
+        resume_phase: Optional[str] = None
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Follow the phase's transitions given the updated configuration.
         
-        # Default: use next_phase from phase definition
-        phase_data = cls.PHASES.get(current_phase, {})
-        return phase_data.get("next_phase", "complete")
-
+        Returns (next_phase, resume_phase): the resume point is dropped once
+        the flow reaches it, or when it is no longer ahead on the path the
+        configuration now takes (the edit changed a branch).
+        """
+        phase = cls.GRAPH.get(current_phase)
+        next_phase = phase.next_for(configuration_data) if phase else "complete"
+        
+        # After an edit, skip the answers still valid until the resume point
+        if resume_phase:
+            while next_phase != resume_phase and next_phase in cls.GRAPH and cls.GRAPH[next_phase].is_satisfied(configuration_data):
+                next_phase = cls.GRAPH[next_phase].next_for(configuration_data)
+        
+        # Skip phases already answered ahead (multi-slot extraction)
+        if MULTI_SLOT_ENABLED:
+            while next_phase != resume_phase and cls._is_satisfied(next_phase, configuration_data):
+                next_phase = cls.GRAPH[next_phase].next_for(configuration_data)
+        
+        if resume_phase and not cls._is_ahead(resume_phase, next_phase, configuration_data):
+            # The edit is over: carry on from here as in a normal turn
+            resume_phase = None
+            if MULTI_SLOT_ENABLED:
+                while cls._is_satisfied(next_phase, configuration_data):
+                    next_phase = cls.GRAPH[next_phase].next_for(configuration_data)
+        return next_phase, resume_phase
+    
+    @classmethod
+    def _is_ahead(cls, target: str, phase_id: str, configuration_data: Dict[str, Any]) -> bool:
+        """Whether `target` comes after `phase_id` on the path the configuration takes"""
+        phase = cls.GRAPH.get(phase_id)
+        seen = set()
+        while phase and phase.id not in seen:
+            seen.add(phase.id)
+            following = phase.next_for(configuration_data)
+            if following == target:
+                return True
+            phase = cls.GRAPH.get(following)
+        return False
 
 # Global instance
 phase_manager = PhaseManager
@@ -0,0 +1,310 @@
+"""
+Validator prompt construction under a token budget.
+
+Everything static (role, rules, worked examples for every phase, output
+format and the rules for history and later phases) lives in one system
+message that never changes, so every validation call starts with the same
+bytes and the provider's automatic prompt caching (longest shared prefix,
+from 1024 tokens up) can reuse it. The examples also keep that prefix above
+the 1024-token minimum (see test_prompt_builder.py). The user message
+carries only the per-turn data, ordered from most to least stable: phase,
+question, format, later phases, previous answers and the current answer last.
+
+Previous answers of the phase are fitted to a per-phase token budget
+(counted with tiktoken): newest first, with messages that don't fit reduced
+to the values they mention, cut down, or omitted.
+
+The tiktoken encoding is loaded once at startup by load_encoding(), off the
+event loop: the first load reads (or downloads) the BPE file. Until then,
+and if it fails, tokens are estimated from the text length. The image bakes
+the file in (TIKTOKEN_CACHE_DIR).
+"""
+import os
+import re
+import logging
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+VALIDATOR_MODEL = "gpt-4o"
+
+# Token budget for the previous answers of a phase
+HISTORY_TOKEN_BUDGET = int(os.getenv("VALIDATOR_HISTORY_TOKENS", "250"))
+# Phases whose answer is often spread over several messages get more room
+PHASE_HISTORY_BUDGETS = {
+    "phase_1_3": 400,
+    "phase_2_2": 400,
+    "phase_3_2": 400,
+    "phase_6_1": 400,
+    "phase_6_3": 300,
+}
+# Cap on the current answer itself (a pasted essay is cut in the middle)
+ANSWER_TOKEN_BUDGET = int(os.getenv("VALIDATOR_ANSWER_TOKENS", "600"))
+MAX_HISTORY_MESSAGES = 3
+# Below this many tokens a cut-down message is not worth including
+MIN_SNIPPET_TOKENS = 24
+# Shortest prefix the provider caches automatically; SYSTEM_PROMPT must stay above it
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+SYSTEM_PROMPT = """Sei un assistente esperto nella configurazione di trapiantatrici agricole.
+Il tuo compito è validare RIGOROSAMENTE le risposte degli utenti durante un processo di configurazione guidato.
+
+REGOLE DI VALIDAZIONE:
+1. La risposta deve contenere TUTTE le informazioni richieste
+2. I valori numerici devono essere plausibili per il contesto agricolo
+3. Le scelte multiple devono corrispondere alle opzioni fornite
+4. Se manca QUALSIASI informazione, segnala "is_complete": false
+
+ESEMPI DI VALIDAZIONE:
+
+Domanda: "Qual è la caratteristica della radice? Opzioni: 1. Radice Nuda 2. Zolla Cubica 3. Zolla Conica 4. Zolla Piramidale"
+Risposta: "cubica" → ✅ is_complete: true, extracted_data: {"root_type": "Zolla Cubica"}
+Risposta: "non lo so" → ❌ is_complete: false, clarification_needed: "Devi scegliere tra le 4 opzioni"
+
+Domanda: "Dimensioni radice: A, B, C, D in cm"
+Risposta: "A=3, B=3, C=4, D=5" → ✅ is_complete: true
+Risposta: "A=3, B=3" → ❌ is_complete: false, clarification_needed: "Mancano i valori C e D"
+Risposta: "circa 3 cm" → ❌ is_complete: false, clarification_needed: "Servono 4 valori distinti: A, B, C, D"
+
+Domanda: "Numero bine, IF (cm), IP (cm), IB (cm)"
+Risposta: "4 bine, IF 120, IP 30, IB 25" → ✅ is_complete: true
+Risposta: "120 cm" → ❌ is_complete: false, clarification_needed: "Servono anche numero bine, IP e IB"
+
+Domanda: "Cosa devi trapiantare?"
+Risposta: "dei pomodori da industria" → ✅ is_complete: true, extracted_data: {"crop_type": "pomodori da industria"}
+Risposta: "boh" → ❌ is_complete: false, clarification_needed: "Indica il nome della coltura da trapiantare"
+
+Domanda: "Si tratta di file singole o file binate?"
+Risposta: "binate" → ✅ is_complete: true, extracted_data: {"row_type": "File binate"}
+Risposta: "dipende" → ❌ is_complete: false, clarification_needed: "Scegli tra File singole e File binate"
+
+Domanda: "Numero file, IF (cm), IP (cm)"
+Risposta: "3 file, interfila 75 e 30 tra le piante" → ✅ is_complete: true, extracted_data: {"number_of_rows": 3, "IF": 75, "IP": 30}
+Risposta: "3 file" → ❌ is_complete: false, clarification_needed: "Servono anche IF e IP in cm"
+
+Domanda: "Campo aperto o Serra"
+Risposta: "in serra" → ✅ is_complete: true, extracted_data: {"environment": "Serra"}
+
+Domanda: "Il trapianto viene effettuato su baula? Se sì: AT, LT, IT, ST in cm"
+Risposta: "No" → ✅ is_complete: true, extracted_data: {"is_raised_bed": false}
+Risposta: "Sì, AT 20, LT 80, IT 120, ST 40" → ✅ is_complete: true, extracted_data: {"is_raised_bed": true, "AT": 20, "LT": 80, "IT": 120, "ST": 40}
+Risposta: "sì" → ❌ is_complete: false, clarification_needed: "Indica AT, LT, IT e ST in cm"
+
+Domanda: "Il trapianto viene effettuato sopra pacciamatura? Se sì: LP in cm"
+Risposta: "sì, telo da 120" → ✅ is_complete: true, extracted_data: {"is_mulch": true, "LP": 120}
+Risposta: "niente pacciamatura" → ✅ is_complete: true, extracted_data: {"is_mulch": false}
+
+Domanda: "Qual è la tipologia del terreno? (Argilloso o Sabbioso)"
+Risposta: "abbastanza sabbioso" → ✅ is_complete: true, extracted_data: {"soil_type": "Sabbioso"}
+Risposta: "normale" → ❌ is_complete: false, clarification_needed: "Scegli tra Argilloso e Sabbioso"
+
+Domanda: "Misura interna delle ruote del trattore in cm"
+Risposta: "1 metro e 50" → ✅ is_complete: true, extracted_data: {"wheel_distance": 150}
+Risposta: "larghe" → ❌ is_complete: false, clarification_needed: "Serve la misura interna delle ruote in cm"
+
+Domanda: "Quanti cavalli (HP) ha il trattore?"
+Risposta: "circa 80 cavalli" → ✅ is_complete: true, extracted_data: {"tractor_hp": 80}
+Risposta: "abbastanza potente" → ❌ is_complete: false, clarification_needed: "Indica la potenza in HP"
+
+Domanda: "Seleziona gli accessori (scelta multipla tra le opzioni elencate)"
+Risposta: "spandiconcime e ripiani supplementari" → ✅ is_complete: true, extracted_data: {"accessories": ["Spandiconcime", "Ripiani supplementari"]}
+Risposta: "nessuno" → ✅ is_complete: true, extracted_data: {"accessories": []}
+Risposta: "un aratro" → ❌ is_complete: false, clarification_needed: "L'aratro non è tra le opzioni: scegli tra quelle elencate o Nessuno"
+
+Domanda: "Hai delle note o richieste particolari?"
+Risposta: "vorrei la consegna entro marzo" → ✅ is_complete: true, extracted_data: {"notes": "vorrei la consegna entro marzo"}
+Risposta: "no" → ✅ is_complete: true, extracted_data: {"notes": null}
+
+Domanda: "Sei interessato a ricevere informazioni commerciali o un preventivo?"
+Risposta: "sì, mandatemi un preventivo" → ✅ is_complete: true, extracted_data: {"interested_in_commercial_info_or_quote": "Sì"}
+Risposta: "forse" → ❌ is_complete: false, clarification_needed: "Rispondi Sì o No"
+
+Domanda: "Partita IVA ed Email"
+Risposta: "IT01234567890, mario.rossi@example.com" → ✅ is_complete: true, extracted_data: {"vat_number": "01234567890", "email": "mario.rossi@example.com"}
+Risposta: "mario.rossi@example.com" → ❌ is_complete: false, clarification_needed: "Manca la Partita IVA"
+
+Esempio con MESSAGGI PRECEDENTI:
+Domanda: "Dimensioni radice: A, B, C, D in cm"
+Messaggi precedenti: 1. "A=3, B=3"
+Risposta: "C 4 e D 5" → ✅ is_complete: true, extracted_data: {"A": 3, "B": 3, "C": 4, "D": 5}
+
+Esempio con ALTRE FASI:
+Domanda: "Cosa devi trapiantare?" (altre fasi: phase_1_2 tipo di radice)
+Risposta: "pomodori in zolla cubica" → ✅ is_complete: true, extracted_data: {"crop_type": "pomodori"}, additional_data: {"phase_1_2": {"root_type": "Zolla Cubica"}}
+
+MESSAGGI PRECEDENTI: se presenti, considera TUTTE le informazioni fornite nei messaggi precedenti della fase. Se l'utente ha già dato alcuni valori, NON chiederli di nuovo. I messaggi lunghi possono essere riassunti ("[riassunto]") o tagliati ("[...]").
+
+ALTRE FASI (facoltativo): l'utente potrebbe aver già fornito dati per fasi successive. Per ciascuna fase elencata, SOLO se la risposta contiene ESPLICITAMENTE i dati richiesti, estraili in "additional_data" usando la fase come chiave (es. {"phase_1_2": {...}}). Non dedurre e non inventare valori; ometti le fasi non menzionate. is_complete riguarda SOLO la fase corrente.
+
+ANALIZZA con attenzione:
+1. La risposta CORRENTE + i messaggi PRECEDENTI contengono TUTTE le informazioni?
+2. I valori sono plausibili e sensati?
+3. Se è una scelta multipla, corrisponde a un'opzione valida?
+
+Rispondi SEMPRE in formato JSON:
+{
+    "is_complete": true/false,
+    "extracted_data": {...} o null,
+    "clarification_needed": "..." o null
+}
+
+IMPORTANTE: Se hai QUALSIASI dubbio sulla completezza, rispondi is_complete: false. Valida RIGOROSAMENTE e restituisci JSON."""
+
+# Values worth keeping from a message too long for the budget ("A=3", "IF 120", "25 cm")
+VALUE_PATTERN = re.compile(r"\b(?:[A-Za-z]{1,3}\s*[:=]?\s*)?\d+(?:[.,]\d+)?(?:\s*(?:cm|mm|hp|cv)\b)?", re.IGNORECASE)
+
+
+# Set by load_encoding(); None means "estimate from length"
+_ENCODING: Optional[tiktoken.Encoding] = None
+
+
+def load_encoding() -> Optional[tiktoken.Encoding]:
+    """
+    Load the validator model's tiktoken encoding. Blocking (file or network
+    I/O): call it at startup, in a thread. Returns None when unavailable.
+    """
+    global _ENCODING, SYSTEM_PROMPT_TOKENS
+    if _ENCODING is None:
+        try:
+            _ENCODING = tiktoken.encoding_for_model(VALIDATOR_MODEL)
+        except Exception as e:
+            logger.warning("tiktoken encoding unavailable, estimating tokens from length: %s", e)
+            return None
+        SYSTEM_PROMPT_TOKENS = count_tokens(SYSTEM_PROMPT)
+    return _ENCODING
+
+
+def _encoding() -> Optional[tiktoken.Encoding]:
+    """Encoding loaded at startup; never loads it here, on the request path"""
+    return _ENCODING
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        # Italian averages a little over 3 characters per token
+        return (len(text) + 2) // 3
+    return len(encoding.encode(text))
+
+
+def truncate_middle(text: str, max_tokens: int) -> str:
+    """Keep the head and tail of `text` within `max_tokens`"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    keep = max(max_tokens - 2, 2)
+    encoding = _encoding()
+    if encoding is None:
+        chars = keep * 3
+        return f"{text[:chars // 2]} [...] {text[-(chars // 2):]}"
+    tokens = encoding.encode(text)
+    return f"{encoding.decode(tokens[:keep // 2])} [...] {encoding.decode(tokens[-(keep // 2):])}"
+
+
+# The system prefix never changes: count it once (again once the encoding is loaded)
+SYSTEM_PROMPT_TOKENS = count_tokens(SYSTEM_PROMPT)
+
+
+def summarise_values(text: str) -> str:
+    """Extractive summary: the measurements and numbers a message mentions"""
+    values = list(dict.fromkeys(" ".join(v.split()) for v in VALUE_PATTERN.findall(text)))
+    return f"[riassunto] valori citati: {', '.join(values)}" if values else ""
+
+
+@dataclass
+class ValidatorPrompt:
+    messages: List[Dict[str, str]]
+    prompt_tokens: int  # Local estimate, compared with the provider's usage
+    history_included: int
+    history_reduced: int  # Summarised or cut down
+    history_omitted: int
+    answer_truncated: bool
+
+
+class ValidatorPromptBuilder:
+    """Builds validator messages: a byte-identical system prefix plus a budgeted user message"""
+
+    @classmethod
+    def history_budget(cls, phase: str) -> int:
+        return PHASE_HISTORY_BUDGETS.get(phase, HISTORY_TOKEN_BUDGET)
+
+    @classmethod
+    def _fit_history(cls, history: List[str], budget: int):
+        """(lines oldest first, reduced count, omitted count) for the newest messages within `budget`"""
+        lines: List[str] = []
+        reduced = omitted = 0
+        remaining = budget
+        for text in reversed(history):
+            tokens = count_tokens(text)
+            if tokens > remaining:
+                summary = summarise_values(text)
+                if summary and count_tokens(summary) <= remaining:
+                    text, tokens = summary, count_tokens(summary)
+                elif remaining >= MIN_SNIPPET_TOKENS:
+                    text = truncate_middle(text, remaining)
+                    tokens = count_tokens(text)
+                else:
+                    omitted += 1
+                    continue
+                reduced += 1
+            lines.append(text)
+            remaining -= tokens
+        return list(reversed(lines)), reduced, omitted
+
+    @classmethod
+    def build(
+        cls,
+        phase: str,
+        user_message: str,
+        expected_format: str,
+        context: str = "",
+        conversation_history: Optional[List[Dict[str, Any]]] = None,
+        lookahead: Optional[Dict[str, str]] = None
+    ) -> ValidatorPrompt:
+        """Messages for one validation call (history oldest first, as stored)"""
+        history = [
+            " ".join(str(msg.get("content") or "").split())
+            for msg in (conversation_history or [])
+            if msg.get("role", "user") == "user"
+        ]
+        # The current answer is usually stored before validation: don't send it twice
+        if history and history[-1] == " ".join(user_message.split()):
+            history.pop()
+        history = history[-MAX_HISTORY_MESSAGES:]
+
+        lines, reduced, omitted = cls._fit_history(history, cls.history_budget(phase))
+
+        parts = [
+            f"**FASE**: {phase}",
+            f"**DOMANDA POSTA ALL'UTENTE**:\n{context}",
+            f"**FORMATO RICHIESTO**:\n{expected_format}",
+        ]
+        if lookahead:
+            parts.append("**ALTRE FASI (facoltativo)**:\n" + "\n".join(
+                f"- {later_phase}: {later_format}" for later_phase, later_format in lookahead.items()
+            ))
+        if lines or omitted:
+            history_text = "\n".join(f'{i}. "{line}"' for i, line in enumerate(lines, 1))
+            if omitted:
+                history_text += f"\n({omitted} messaggi precedenti omessi)"
+            parts.append(f"**MESSAGGI PRECEDENTI DELL'UTENTE IN QUESTA FASE**:\n{history_text.strip()}")
+        answer = truncate_middle(user_message, ANSWER_TOKEN_BUDGET)
+        parts.append(f"**RISPOSTA CORRENTE DELL'UTENTE**:\n\"{answer}\"")
+
+        user_prompt = "\n\n".join(parts)
+        return ValidatorPrompt(
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt},
+            ],
+            prompt_tokens=SYSTEM_PROMPT_TOKENS + count_tokens(user_prompt),
+            history_included=len(lines),
+            history_reduced=reduced,
+            history_omitted=omitted,
+            answer_truncated=answer != user_message,
+        )
+
+
+# Global instance
+prompt_builder = ValidatorPromptBuilder
@@ -1,35 +1,75 @@
 
 import os
 import json
+import time
+import logging
 from uuid import UUID
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import asyncpg
 from app.services.db import db
 from openai import AsyncOpenAI
+from app.services.circuit_breaker import llm_breaker, CircuitOpen
+from app.services.usage_ledger import usage_ledger
+from app.services.recommendation_cache import recommendation_cache, CacheLookup, REUSE, ADAPT, MISS
+from app.utils import metrics
+from app.utils.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+# Small model used to adapt a cached recommendation to a near-identical configuration
+ADAPT_MODEL = os.getenv("RECOMMENDATION_ADAPT_MODEL", "gpt-4o-mini")
 
 # Initialize OpenAI client
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL") or None)
+
+# Configuration columns the recommendation is built from (see generate_recommendation);
+# editing any other answer keeps a stored recommendation valid
+RECOMMENDATION_INPUTS = frozenset({
+    "crop_type", "root_type", "root_dimensions", "row_type",
+    "is_raised_bed", "is_mulch",
+    "accessories_primary", "accessories_secondary", "accessories_element",
+})
 
 class RagService:
     def __init__(self):
         self.db_url = os.getenv("DATABASE_URL")
         self.embedding_model = "text-embedding-3-small"
 
+    @traced("rag.get_embedding")
     async def get_embedding(self, text: str) -> List[float]:
         """Generate embedding for query text."""
-        response = await client.embeddings.create(
-            input=text,
-            model=self.embedding_model
-        )
+        start = time.perf_counter()
+        try:
+            async with llm_breaker.call():
+                with metrics.stage("rag_embedding"):
+                    response = await client.embeddings.create(
+                        input=text,
+                        model=self.embedding_model
+                    )
+        except CircuitOpen:
+            raise
+        except Exception:
+            usage_ledger.record("embedding", self.embedding_model, None, time.perf_counter() - start, outcome="error")
+            raise
+        metrics.record_openai_usage("embedding", self.embedding_model, response.usage)
+        usage_ledger.record("embedding", self.embedding_model, response.usage, time.perf_counter() - start)
         return response.data[0].embedding
 
-    async def search_similar_products(self, query: str, limit: int = 3) -> List[Dict[str, Any]]:
+    @traced("rag.search_similar_products")
+    async def search_similar_products(
+        self,
+        query: str,
+        limit: int = 3,
+        embedding: Optional[List[float]] = None
+    ) -> List[Dict[str, Any]]:
         """Search strictly for products using vector similarity."""
-        embedding = await self.get_embedding(query)
-        embedding_str = str(embedding)  # Format for pgvector input
+        if embedding is None:
+            embedding = await self.get_embedding(query)
+        # The pool's pgvector codec sends the vector in binary; fall back to
+        # the text literal if the codec could not be registered
+        embedding_param = embedding if db.vector_codec else str(embedding)
 
-        conn = await asyncpg.connect(self.db_url)
-        try:
+        async with db.acquire() as conn:
             # Using cosine distance (<=>) for similarity
             # Order by distance ASC (closest first)
             sql = """
@@ -40,7 +80,8 @@ class RagService:
                 LIMIT $2
             """
             
-            rows = await conn.fetch(sql, embedding_str, limit)
+            with metrics.stage("rag_search"):
+                rows = await conn.fetch(sql, embedding_param, limit)
             
             results = []
             for row in rows:
@@ -50,18 +91,12 @@ class RagService:
                     "description": row["description"],
                     "category": row["category"],
                     "distance": row["distance"],
-                    "metadata": json.loads(row["metadata"]) if row["metadata"] else {}
+                    "metadata": row["metadata"] or {}
                 })
             return results
-        finally:
-            await conn.close()
 
-    async def generate_recommendation(self, config_data: Dict[str, Any]) -> str:
-        """
-        Generate a product recommendation based on full configuration.
-        Returns a markdown string with the recommendation.
-        """
-        # 1. Construct a rich query from config
+    def build_query(self, config_data: Dict[str, Any]) -> Tuple[str, List[str]]:
+        """(RAG query text, selected accessories) for a configuration"""
         query_parts = []
         if config_data.get("crop_type"):
             query_parts.append(f"Coltura: {config_data['crop_type']}")
@@ -96,21 +131,51 @@ class RagService:
         if config_data.get("accessories_element"):
              accessories.extend(config_data["accessories_element"])
         
-        if accessories:
-            acc_str = ", ".join([a for a in accessories if a != "Nessuno"])
-            if acc_str:
-                query_parts.append(f"Accessori: {acc_str}")
+        acc_str = ", ".join([a for a in accessories if a != "Nessuno"])
+        if acc_str:
+            query_parts.append(f"Accessori: {acc_str}")
 
-        query_str = " ".join(query_parts)
-        print(f"DEBUG RAG Query: {query_str}")
+        return " ".join(query_parts), accessories
 
-        # 2. Retrieve relevant context
-        products = await self.search_similar_products(query_str, limit=3)
+    @traced("rag.generate_recommendation")
+    async def generate_recommendation(self, config_data: Dict[str, Any]) -> str:
+        """
+        Generate a product recommendation based on full configuration.
+        Returns a markdown string with the recommendation.
+        A near-identical earlier configuration (semantic cache) is reused or
+        adapted instead of running retrieval and gpt-4o again.
+        """
+        # 1. Construct a rich query from config
+        query_str, accessories = self.build_query(config_data)
+        logger.debug("RAG query built", extra={"rag_query": query_str})
+        acc_str = ", ".join([a for a in accessories if a != "Nessuno"])
+        conversation_id = config_data.get("conversation_id")
+
+        # 2. Semantic cache (the query embedding also serves the product search)
+        embedding = await self.get_embedding(query_str)
+        cache_key = recommendation_cache.config_key(config_data, accessories)
+        try:
+            cached = await recommendation_cache.lookup(query_str, cache_key, embedding, conversation_id)
+        except Exception as e:
+            logger.warning("Recommendation cache lookup failed: %s", e)
+            cached = CacheLookup(decision=MISS)
+        if cached.decision == REUSE:
+            return cached.recommendation
+        if cached.decision == ADAPT:
+            try:
+                return await self.adapt_recommendation(cached.recommendation, cached.cached_query, query_str)
+            except CircuitOpen:
+                raise
+            except Exception as e:
+                logger.warning("Adapting cached recommendation failed, generating: %s", e)
+
+        # 3. Retrieve relevant context
+        products = await self.search_similar_products(query_str, limit=3, embedding=embedding)
         
         if not products:
             return "Nessun prodotto specifico trovato nel catalogo per questa configurazione."
 
-        # 3. Generate refined answer with GPT-4
+        # 4. Generate refined answer with GPT-4
         context_text = "\n\n".join([
             f"Prodotto: {p['name']}\nDescrizione: {p['description']}\nMetadata: {p['metadata']}"
             for p in products
@@ -147,14 +212,73 @@ class RagService:
         Genera la descrizione tecnica della configurazione.
         """
 
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.3
-        )
+        start = time.perf_counter()
+        try:
+            async with llm_breaker.call():
+                with metrics.stage("rag_generation"):
+                    response = await client.chat.completions.create(
+                        model="gpt-4o",
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": user_prompt}
+                        ],
+                        temperature=0.3
+                    )
+        except CircuitOpen:
+            raise
+        except Exception:
+            usage_ledger.record("recommendation", "gpt-4o", None, time.perf_counter() - start, outcome="error")
+            raise
+        metrics.record_openai_usage("recommendation", "gpt-4o", response.usage)
+        usage_ledger.record("recommendation", "gpt-4o", response.usage, time.perf_counter() - start)
+
+        recommendation = response.choices[0].message.content
+        try:
+            await recommendation_cache.store(query_str, cache_key, embedding, recommendation, conversation_id)
+        except Exception as e:
+            logger.warning("Could not cache recommendation: %s", e)
+        return recommendation
+
+    @traced("rag.adapt_recommendation")
+    async def adapt_recommendation(self, cached: str, cached_query: str, query_str: str) -> str:
+        """Lightly adapt a recommendation written for a near-identical configuration"""
+        system_prompt = """
+        Sei un tecnico commerciale Spapperi. Ti viene dato il "Consiglio dell'Esperto" scritto per una
+        configurazione quasi identica a quella attuale. Adattalo alla configurazione attuale cambiando
+        SOLO i dati che differiscono (coltura, dimensioni, sesto, baula, pacciamatura).
+        Mantieni struttura, titoli, tono e lunghezza. Non aggiungere né togliere componenti.
+        Restituisci solo il testo adattato.
+        """
+        user_prompt = f"""
+        CONFIGURAZIONE ORIGINALE:
+        {cached_query}
+
+        CONFIGURAZIONE ATTUALE:
+        {query_str}
+
+        CONSIGLIO DA ADATTARE:
+        {cached}
+        """
+
+        start = time.perf_counter()
+        try:
+            async with llm_breaker.call():
+                with metrics.stage("rag_adaptation"):
+                    response = await client.chat.completions.create(
+                        model=ADAPT_MODEL,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": user_prompt}
+                        ],
+                        temperature=0.0
+                    )
+        except CircuitOpen:
+            raise
+        except Exception:
+            usage_ledger.record("recommendation_adapt", ADAPT_MODEL, None, time.perf_counter() - start, outcome="error")
+            raise
+        metrics.record_openai_usage("recommendation_adapt", ADAPT_MODEL, response.usage)
+        usage_ledger.record("recommendation_adapt", ADAPT_MODEL, response.usage, time.perf_counter() - start)
 
         return response.choices[0].message.content
 
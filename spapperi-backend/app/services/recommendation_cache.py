@@ -0,0 +1,199 @@
+"""
+Semantic cache of generated recommendations.
+
+Entries hold the RAG query of a past configuration, its embedding and the
+recommendation generated for it. A lookup takes the nearest entry (cosine
+similarity, exact scan) among those with exactly the same categorical answers
+(root type, row type, raised bed, mulch) and accessory set:
+- similarity >= RECOMMENDATION_CACHE_REUSE: the cached text is reused as is;
+- similarity >= RECOMMENDATION_CACHE_ADAPT: it is lightly adapted to the new
+  configuration by a small model (see RagService.adapt_recommendation);
+- otherwise it is a miss and the full pipeline runs (and fills the cache).
+
+Every lookup is written to recommendation_cache_lookups with the similarity
+and thresholds in force, so hit rates and thresholds can be audited.
+
+Each store prunes entries unused for RECOMMENDATION_CACHE_MAX_AGE_DAYS and
+the least recently used beyond RECOMMENDATION_CACHE_MAX_ENTRIES, which also
+bounds the exact scan.
+"""
+import os
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+from app.services.db import db
+from app.utils import metrics
+from app.utils.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+REUSE = "reuse"
+ADAPT = "adapt"
+MISS = "miss"
+
+# Answers a reused recommendation must match exactly: the text names them.
+# The embedding only measures how close the rest of the configuration is.
+KEY_COLUMNS = ("root_type", "row_type", "is_raised_bed", "is_mulch")
+
+
+@dataclass
+class CacheLookup:
+    decision: str  # reuse | adapt | miss
+    entry_id: Optional[UUID] = None
+    similarity: Optional[float] = None
+    recommendation: Optional[str] = None
+    cached_query: Optional[str] = None
+
+
+class RecommendationCache:
+    """Nearest-neighbour lookup and storage of recommendations in pgvector"""
+
+    def __init__(self):
+        self.enabled = os.getenv("RECOMMENDATION_CACHE", "true").lower() in ("1", "true", "yes")
+        self.reuse_threshold = float(os.getenv("RECOMMENDATION_CACHE_REUSE", 0.98))
+        self.adapt_threshold = float(os.getenv("RECOMMENDATION_CACHE_ADAPT", 0.93))
+        self.max_entries = int(os.getenv("RECOMMENDATION_CACHE_MAX_ENTRIES", 5000))
+        self.max_age_days = int(os.getenv("RECOMMENDATION_CACHE_MAX_AGE_DAYS", 90))
+
+    @staticmethod
+    def accessory_key(accessories: List[str]) -> str:
+        """Canonical accessory set: sorted, de-duplicated, "Nessuno" left out"""
+        return "|".join(sorted({a.strip() for a in accessories if a and a.strip() != "Nessuno"}))
+
+    @classmethod
+    def config_key(cls, config_data: Dict[str, Any], accessories: List[str]) -> str:
+        """Canonical categorical answers and accessory set a cached entry must share"""
+        parts = []
+        for column in KEY_COLUMNS:
+            value = config_data.get(column)
+            if isinstance(value, bool):
+                value = "yes" if value else "no"
+            parts.append(f"{column}={' '.join(str(value or '').split()).lower()}")
+        parts.append(f"accessories={cls.accessory_key(accessories)}")
+        return ";".join(parts)
+
+    def _decide(self, similarity: Optional[float]) -> str:
+        if similarity is None:
+            return MISS
+        if similarity >= self.reuse_threshold:
+            return REUSE
+        if similarity >= self.adapt_threshold:
+            return ADAPT
+        return MISS
+
+    @traced("recommendation_cache.lookup")
+    async def lookup(
+        self,
+        query: str,
+        config_key: str,
+        embedding: List[float],
+        conversation_id: Optional[UUID] = None
+    ) -> CacheLookup:
+        """Nearest cached recommendation for the query, with the decision to take"""
+        if not self.enabled:
+            return CacheLookup(decision=MISS)
+        embedding_param = embedding if db.vector_codec else str(embedding)
+
+        async with db.acquire() as conn:
+            with metrics.stage("recommendation_cache_lookup"):
+                # Exact search within the key. A vector-index scan filtered on
+                # config_key would only see the nearest entries of any key and
+                # could miss a matching one, so there is no such index.
+                row = await conn.fetchrow(
+                    """
+                    SELECT id, query, recommendation, 1 - (embedding <=> $1) AS similarity
+                    FROM recommendation_cache
+                    WHERE config_key = $2
+                    ORDER BY embedding <=> $1
+                    LIMIT 1
+                    """,
+                    embedding_param,
+                    config_key
+                )
+            similarity = float(row["similarity"]) if row else None
+            decision = self._decide(similarity)
+
+            await conn.execute(
+                """
+                INSERT INTO recommendation_cache_lookups
+                    (conversation_id, cache_id, similarity, decision, reuse_threshold, adapt_threshold)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                """,
+                conversation_id,
+                row["id"] if row else None,
+                similarity,
+                decision,
+                self.reuse_threshold,
+                self.adapt_threshold
+            )
+            if decision != MISS:
+                await conn.execute(
+                    "UPDATE recommendation_cache SET hits = hits + 1, last_hit_at = NOW() WHERE id = $1",
+                    row["id"]
+                )
+
+        metrics.record_recommendation_cache_lookup(decision, similarity)
+        logger.info(
+            "Recommendation cache %s", decision,
+            extra={"similarity": similarity, "cache_id": str(row["id"]) if row else None}
+        )
+        if decision == MISS:
+            return CacheLookup(decision=MISS, entry_id=row["id"] if row else None, similarity=similarity)
+        return CacheLookup(
+            decision=decision,
+            entry_id=row["id"],
+            similarity=similarity,
+            recommendation=row["recommendation"],
+            cached_query=row["query"],
+        )
+
+    @traced("recommendation_cache.store")
+    async def store(
+        self,
+        query: str,
+        config_key: str,
+        embedding: List[float],
+        recommendation: str,
+        conversation_id: Optional[UUID] = None
+    ):
+        """
+        Cache a freshly generated recommendation (adapted ones are not cached,
+        to avoid drift) and prune stale and least recently used entries.
+        """
+        if not self.enabled:
+            return
+        embedding_param = embedding if db.vector_codec else str(embedding)
+        async with db.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO recommendation_cache
+                    (query, config_key, embedding, recommendation, source_conversation_id)
+                VALUES ($1, $2, $3, $4, $5)
+                """,
+                query,
+                config_key,
+                embedding_param,
+                recommendation,
+                conversation_id
+            )
+            # Misses are rare (each one costs a gpt-4o call), so pruning here is cheap
+            pruned = await conn.execute(
+                """
+                DELETE FROM recommendation_cache
+                WHERE COALESCE(last_hit_at, created_at) < NOW() - make_interval(days => $1)
+                   OR id IN (
+                       SELECT id FROM recommendation_cache
+                       ORDER BY COALESCE(last_hit_at, created_at) DESC
+                       OFFSET $2
+                   )
+                """,
+                self.max_age_days,
+                self.max_entries
+            )
+        if pruned != "DELETE 0":
+            logger.info("Recommendation cache pruned", extra={"result": pruned})
+
+
+# Global instance
+recommendation_cache = RecommendationCache()
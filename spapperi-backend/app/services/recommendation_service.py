@@ -0,0 +1,127 @@
+"""
+Recommendation lifecycle: stored, prefetched, or generated on demand.
+
+The recommendation only depends on RECOMMENDATION_INPUTS, all of which are
+answered before the closing questions (notes, interest, contacts). As soon
+as they are, a background task generates the recommendation and stores it
+with a fingerprint of those inputs, so the completion turn finds it ready.
+A stored recommendation is used only if its fingerprint still matches the
+answers; completion arriving while the prefetch runs waits for it instead of
+generating a second one.
+"""
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Any, Optional, Tuple
+from uuid import UUID
+from app.services.db import db
+from app.services.rag_service import rag_service, RECOMMENDATION_INPUTS
+from app.services.phase_manager import phase_manager
+from app.services.circuit_breaker import llm_breaker
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.getenv("RECOMMENDATION_PREFETCH", "true").lower() in ("1", "true", "yes")
+# Speculative generations running at once (each is an embedding + a gpt-4o call)
+PREFETCH_CONCURRENCY = int(os.getenv("RECOMMENDATION_PREFETCH_CONCURRENCY", 4))
+
+
+def inputs_fingerprint(config: Dict[str, Any]) -> str:
+    """Stable hash of the answers the recommendation is built from"""
+    inputs = {column: config.get(column) for column in sorted(RECOMMENDATION_INPUTS)}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class RecommendationService:
+    """Serves recommendations, prefetching them in the background when possible"""
+
+    # conversation -> (fingerprint, running generation)
+    _inflight: Dict[UUID, Tuple[str, asyncio.Task]] = {}
+    _prefetch_slots: Optional[asyncio.Semaphore] = None
+
+    @classmethod
+    def _stored(cls, config: Dict[str, Any], fingerprint: str) -> Optional[str]:
+        # Rows stored before fingerprints existed are trusted (edits cleared stale ones)
+        if config.get("recommendation") and config.get("recommendation_inputs") in (fingerprint, None):
+            return config["recommendation"]
+        return None
+
+    @classmethod
+    async def get(cls, conversation_id: UUID, config: Dict[str, Any]) -> Optional[str]:
+        """Recommendation for the configuration: stored, from a running prefetch, or generated now"""
+        fingerprint = inputs_fingerprint(config)
+        stored = cls._stored(config, fingerprint)
+        if stored:
+            metrics.record_recommendation("stored")
+            return stored
+
+        inflight = cls._inflight.get(conversation_id)
+        if inflight and inflight[0] == fingerprint:
+            metrics.record_recommendation("inflight")
+            # shield: a cancelled request must not cancel the shared generation
+            return await asyncio.shield(inflight[1])
+
+        metrics.record_recommendation("generated")
+        return await cls._generate(conversation_id, config, fingerprint)
+
+    @classmethod
+    def maybe_prefetch(cls, conversation_id: UUID, config: Dict[str, Any]):
+        """
+        Start generating the recommendation in the background once all its
+        inputs are answered. No-op if one is stored or running for the same
+        answers, or while the LLM circuit is open.
+        """
+        if not PREFETCH_ENABLED or llm_breaker.is_open:
+            return
+        if not phase_manager.inputs_ready(RECOMMENDATION_INPUTS, config):
+            return
+        fingerprint = inputs_fingerprint(config)
+        if cls._stored(config, fingerprint):
+            return
+        inflight = cls._inflight.get(conversation_id)
+        if inflight and inflight[0] == fingerprint:
+            return
+
+        task = asyncio.create_task(cls._prefetch(conversation_id, dict(config), fingerprint))
+        cls._inflight[conversation_id] = (fingerprint, task)
+        task.add_done_callback(lambda _: cls._forget(conversation_id, task))
+        logger.info("Recommendation prefetch started")
+
+    @classmethod
+    def _forget(cls, conversation_id: UUID, task: asyncio.Task):
+        inflight = cls._inflight.get(conversation_id)
+        if inflight and inflight[1] is task:
+            del cls._inflight[conversation_id]
+
+    @classmethod
+    async def _prefetch(cls, conversation_id: UUID, config: Dict[str, Any], fingerprint: str) -> Optional[str]:
+        if cls._prefetch_slots is None:
+            cls._prefetch_slots = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        async with cls._prefetch_slots:
+            with metrics.stage("recommendation_prefetch"):
+                return await cls._generate(conversation_id, config, fingerprint)
+
+    @classmethod
+    async def _generate(cls, conversation_id: UUID, config: Dict[str, Any], fingerprint: str) -> Optional[str]:
+        """Generate and store the recommendation; None on failure (reports go out without it)"""
+        try:
+            recommendation = await rag_service.generate_recommendation(config)
+        except Exception as e:
+            logger.error("Error generating recommendation: %s", e)
+            return None
+        await db.save_configuration_data(conversation_id, {
+            "recommendation": recommendation,
+            "recommendation_inputs": fingerprint,
+        })
+        return recommendation
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return {"prefetch_inflight": len(cls._inflight)}
+
+
+# Global instance
+recommendation_service = RecommendationService
@@ -0,0 +1,181 @@
+"""
+In-process write-through cache of conversation state.
+
+Holds the `conversations` row and the merged `configurations` row per
+conversation id, with LRU eviction and a TTL. Writes made by this process
+refresh the cache directly; writes made by other workers arrive as Postgres
+notifications (see migrations/0005_conversation_state_notify.sql)
+and evict the entry.
+"""
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+from uuid import UUID
+
+# Identifies this process in notifications so it can skip its own writes.
+# Sent as the connection's application_name, which the trigger echoes back.
+INSTANCE_ID = f"spapperi-{uuid.uuid4().hex[:12]}"
+
+NOTIFY_CHANNEL = "conversation_state"
+
+# Marks a slot that has not been loaded (None means "known to be absent")
+MISSING = object()
+
+
+class _Entry:
+    __slots__ = ("conversation", "configuration", "version", "expires_at")
+
+    def __init__(self, version: int, expires_at: float):
+        self.conversation: Any = MISSING
+        self.configuration: Any = MISSING
+        self.version = version
+        self.expires_at = expires_at
+
+
+class ConversationStateCache:
+    """LRU + TTL cache of conversation state, keyed by conversation id"""
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 300.0, enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries: "OrderedDict[UUID, _Entry]" = OrderedDict()
+        # Bumped on every invalidation; a load that started under an older
+        # version must not populate the cache (it may have read stale rows)
+        self._versions: Dict[UUID, int] = {}
+        self.stats_counters = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "remote_invalidations": 0,
+            "stale_loads_discarded": 0,
+        }
+
+    # === READS ===
+
+    def version(self, conversation_id: UUID) -> int:
+        """Current version stamp; capture it before reading from the database"""
+        return self._versions.get(conversation_id, 0)
+
+    def _live_entry(self, conversation_id: UUID) -> Optional[_Entry]:
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            del self._entries[conversation_id]
+            self.stats_counters["expirations"] += 1
+            return None
+        self._entries.move_to_end(conversation_id)
+        return entry
+
+    def _get(self, conversation_id: UUID, slot: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        if not self.enabled:
+            return False, None
+        entry = self._live_entry(conversation_id)
+        value = getattr(entry, slot) if entry else MISSING
+        if value is MISSING:
+            self.stats_counters["misses"] += 1
+            return False, None
+        self.stats_counters["hits"] += 1
+        # Shallow copy so callers can't mutate the cached row
+        return True, dict(value) if value is not None else None
+
+    def get_conversation(self, conversation_id: UUID) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Returns (hit, conversation row)"""
+        return self._get(conversation_id, "conversation")
+
+    def get_configuration(self, conversation_id: UUID) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Returns (hit, configuration row)"""
+        return self._get(conversation_id, "configuration")
+
+    # === WRITES ===
+
+    def _put(self, conversation_id: UUID, slot: str, value: Optional[Dict[str, Any]], version: Optional[int]):
+        if not self.enabled:
+            return
+        current = self.version(conversation_id)
+        if version is None:
+            # Write-through: newer than anything a concurrent load may have read
+            current += 1
+            self._versions[conversation_id] = current
+        elif version != current:
+            # Invalidated or overwritten while the row was being loaded
+            self.stats_counters["stale_loads_discarded"] += 1
+            return
+
+        entry = self._live_entry(conversation_id)
+        if entry is None:
+            entry = _Entry(current, time.monotonic() + self.ttl)
+            self._entries[conversation_id] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats_counters["evictions"] += 1
+        entry.version = current
+        setattr(entry, slot, dict(value) if value is not None else None)
+
+    def put_conversation(self, conversation_id: UUID, row: Optional[Dict[str, Any]], version: Optional[int] = None):
+        """Store a conversation row; pass the version captured before a read"""
+        self._put(conversation_id, "conversation", row, version)
+
+    def put_configuration(self, conversation_id: UUID, row: Optional[Dict[str, Any]], version: Optional[int] = None):
+        """Store a configuration row; pass the version captured before a read"""
+        self._put(conversation_id, "configuration", row, version)
+
+    def update_conversation(self, conversation_id: UUID, **fields):
+        """Patch fields of a cached conversation row, if it is cached"""
+        self._versions[conversation_id] = self.version(conversation_id) + 1
+        entry = self._entries.get(conversation_id)
+        if entry is not None and isinstance(entry.conversation, dict):
+            entry.version = self._versions[conversation_id]
+            entry.conversation.update(fields)
+
+    def invalidate(self, conversation_id: UUID, remote: bool = False):
+        """Drop a conversation's state and bump its version"""
+        self._versions[conversation_id] = self.version(conversation_id) + 1
+        if self._entries.pop(conversation_id, None) is not None and remote:
+            self.stats_counters["remote_invalidations"] += 1
+        # Version stamps only matter while a load may be in flight; keep the map bounded
+        if len(self._versions) > self.max_entries * 4:
+            self._versions = {k: v for k, v in self._versions.items() if k in self._entries}
+
+    def clear(self):
+        """Drop everything (e.g. when the notification channel was lost)"""
+        for conversation_id in list(self._entries):
+            self.invalidate(conversation_id)
+
+    # === INVALIDATION ===
+
+    def handle_notification(self, connection, pid, channel, payload: str):
+        """asyncpg listener callback: payload is '<conversation_id>:<origin instance>'"""
+        conversation_id, _, origin = payload.partition(":")
+        if origin == INSTANCE_ID:
+            # Our own write, already applied write-through
+            return
+        try:
+            self.invalidate(UUID(conversation_id), remote=True)
+        except ValueError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate, staleness counters and size"""
+        lookups = self.stats_counters["hits"] + self.stats_counters["misses"]
+        return {
+            "enabled": self.enabled,
+            "instance_id": INSTANCE_ID,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hit_rate": round(self.stats_counters["hits"] / lookups, 4) if lookups else 0.0,
+            **self.stats_counters,
+        }
+
+
+# Global instance
+state_cache = ConversationStateCache(
+    max_entries=int(os.getenv("STATE_CACHE_SIZE", 1000)),
+    ttl=float(os.getenv("STATE_CACHE_TTL", 300)),
+    enabled=os.getenv("STATE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+)
@@ -0,0 +1,89 @@
+"""
+Per-conversation turn serialization.
+
+Two requests for the same conversation (double-clicked send, proxy retry)
+must not run their chat turns in parallel: both would validate with the LLM,
+both would write configuration data and the phase could advance twice.
+"""
+import os
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Tuple
+from app.services.db import db
+
+
+class TurnLockTimeout(Exception):
+    """Another turn for the same conversation is still running"""
+
+
+class TurnLockManager:
+    """
+    Keyed in-process locks, optionally backed by a Postgres advisory lock
+    so that turns are also serialized across workers. In advisory mode each
+    running turn keeps one pooled connection, so size the pool accordingly.
+    """
+
+    def __init__(self, timeout: float = 30.0, advisory: bool = False):
+        self.timeout = timeout
+        self.advisory = advisory
+        # key -> (lock, number of holders/waiters); dropped when unused
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    def _ref(self, key: str) -> asyncio.Lock:
+        lock, refs = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, refs + 1)
+        return lock
+
+    def _unref(self, key: str):
+        lock, refs = self._locks[key]
+        if refs <= 1:
+            del self._locks[key]
+        else:
+            self._locks[key] = (lock, refs - 1)
+
+    @asynccontextmanager
+    async def hold(self, key: str, timeout: float = None):
+        """Run the body while holding the turn lock for `key`"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        lock = self._ref(key)
+        try:
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout=timeout)
+            except asyncio.TimeoutError:
+                raise TurnLockTimeout(key)
+            try:
+                if self.advisory:
+                    async with self._advisory(key, deadline):
+                        yield
+                else:
+                    yield
+            finally:
+                lock.release()
+        finally:
+            self._unref(key)
+
+    @asynccontextmanager
+    async def _advisory(self, key: str, deadline: float):
+        """Session-level advisory lock, polled until the deadline"""
+        async with db.acquire() as conn:
+            while not await conn.fetchval(
+                "SELECT pg_try_advisory_lock(hashtextextended($1, 0))", key
+            ):
+                if time.monotonic() >= deadline:
+                    raise TurnLockTimeout(key)
+                await asyncio.sleep(0.05)
+            try:
+                yield
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock(hashtextextended($1, 0))", key)
+
+
+# Global instance
+turn_locks = TurnLockManager(
+    timeout=float(os.getenv("TURN_LOCK_TIMEOUT", 30)),
+    advisory=os.getenv("TURN_LOCK_ADVISORY", "false").lower() in ("1", "true", "yes")
+)
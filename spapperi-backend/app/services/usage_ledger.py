@@ -0,0 +1,129 @@
+"""
+LLM usage ledger: one row per OpenAI call in `llm_usage`.
+
+Recording never touches the database on the request path: rows are buffered
+in memory and flushed in batches (COPY) by a background task, every few
+seconds or as soon as a batch is full. The aggregate views in migration 0009
+(llm_phase_loops, llm_conversation_cost) are built on this table.
+"""
+import os
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional
+from uuid import UUID
+from app.services.db import db
+from app.utils import metrics
+from app.utils.context import current_conversation_id, current_phase
+from app.utils.tracing import current_trace_id
+
+logger = logging.getLogger(__name__)
+
+
+class UsageLedger:
+    """Buffers usage rows and writes them in batches"""
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_USAGE_LEDGER", "true").lower() in ("1", "true", "yes")
+        self.batch_size = int(os.getenv("LLM_USAGE_BATCH_SIZE", 100))
+        self.flush_interval = float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", 5))
+        # Bounded: if the database is down, the oldest rows are dropped (and counted)
+        self._buffer: deque = deque(maxlen=int(os.getenv("LLM_USAGE_BUFFER_MAX", 10000)))
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+
+    def start(self):
+        if not self.enabled:
+            logger.info("LLM usage ledger disabled")
+            return
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher, writing what is still buffered"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+    def record(
+        self,
+        purpose: str,
+        model: str,
+        usage,
+        latency_s: float,
+        outcome: str = "ok"
+    ):
+        """Buffer one call; conversation, phase and trace come from the current context"""
+        if not self.enabled:
+            return
+        tokens = metrics.usage_attributes(usage)
+        conversation_id = current_conversation_id.get()
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append((
+            UUID(conversation_id) if conversation_id else None,
+            current_phase.get(),
+            purpose,
+            model,
+            tokens["prompt_tokens"],
+            tokens["cached_tokens"],
+            tokens["completion_tokens"],
+            int(latency_s * 1000),
+            outcome,
+            current_trace_id(),
+            datetime.now(timezone.utc),
+        ))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Write buffered rows in batches. Returns the number written."""
+        written = 0
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                await db.insert_llm_usage(batch)
+            except Exception as e:
+                # Put the batch back (oldest first) and retry on the next flush.
+                # Rows recorded meanwhile may have filled the buffer: only what
+                # fits goes back, and the oldest of the batch are dropped
+                self.failed_flushes += 1
+                room = self._buffer.maxlen - len(self._buffer)
+                if room < len(batch):
+                    self.dropped += len(batch) - room
+                    batch = batch[len(batch) - room:]
+                self._buffer.extendleft(reversed(batch))
+                logger.warning("Usage ledger flush failed: %s", e, extra={"buffered": len(self._buffer)})
+                break
+            written += len(batch)
+        self.written += written
+        return written
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+# Global instance
+usage_ledger = UsageLedger()
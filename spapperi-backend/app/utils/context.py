@@ -0,0 +1,17 @@
+"""
+Per-request context shared by logging, metrics and tracing.
+Context variables follow the request across awaits and spawned tasks.
+"""
+from contextvars import ContextVar
+from typing import Optional
+
+current_conversation_id: ContextVar[Optional[str]] = ContextVar("current_conversation_id", default=None)
+current_phase: ContextVar[Optional[str]] = ContextVar("current_phase", default=None)
+
+
+def set_turn_context(conversation_id: Optional[str] = None, phase: Optional[str] = None):
+    """Bind the conversation and phase being processed to the current context"""
+    if conversation_id is not None:
+        current_conversation_id.set(str(conversation_id))
+    if phase is not None:
+        current_phase.set(phase)
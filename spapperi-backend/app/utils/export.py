@@ -1,17 +1,25 @@
 """
 Export utility for generating TXT reports from conversations.
+Reports are streamed by default; writing them to disk is an opt-in archive.
 """
 import os
-from typing import Dict, Any, List
+import uuid
+import zlib
+from typing import Dict, Any, List, AsyncIterator
 from uuid import UUID
 from datetime import datetime
 from app.services.db import db
 
 
 class ExportService:
-    """Generate and save conversation reports"""
+    """Generate conversation reports, streamed or archived to disk"""
     
     EXPORT_DIR = "/app/exports"
+    FILE_CHUNK_SIZE = 64 * 1024
+    
+    # Writing a copy of every TXT report to EXPORT_DIR is opt-in archival only;
+    # downloads are streamed straight from the database.
+    ARCHIVE_ENABLED = os.getenv("EXPORT_ARCHIVE_TXT", "false").lower() in ("1", "true", "yes")
     
     @classmethod
     def ensure_export_dir(cls):
@@ -19,61 +27,42 @@ class ExportService:
         os.makedirs(cls.EXPORT_DIR, exist_ok=True)
     
     @classmethod
-    async def generate_txt_report(cls, conversation_id: UUID) -> str:
+    async def stream_txt_report(cls, conversation_id: UUID) -> AsyncIterator[str]:
         """
-        Generate comprehensive TXT report for conversation.
+        Generate the TXT report as a stream of text chunks.
         
-        Returns:
-            File path of generated report
+        Messages are read in bounded pages, so memory usage stays constant no
+        matter how long the conversation is, and no pool connection is held
+        while a slow client downloads.
         """
-        cls.ensure_export_dir()
-        
-        # Fetch conversation data
         conversation = await db.get_conversation(conversation_id)
-        messages = await db.get_conversation_messages(conversation_id)
-        config = await db.get_configuration_data(conversation_id)
-        
         if not conversation:
             raise ValueError(f"Conversation {conversation_id} not found")
         
-        # Build report content
-        lines = []
+        config = await db.get_configuration_data(conversation_id)
         
         # Header
-        lines.append("=" * 80)
-        lines.append("REPORT CONFIGURAZIONE TRAPIANTATRICE SPAPPERI")
-        lines.append("=" * 80)
-        lines.append("")
-        lines.append(f"Data generazione: {datetime.now().strftime('%d/%m/%Y %H:%M')}")
-        lines.append(f"Conversation ID: {conversation_id}")
-        lines.append(f"Status: {conversation.get('status', 'unknown')}")
-        lines.append("")
-        lines.append("=" * 80)
-        lines.append("")
-        
-        # Conversation History
-        lines.append("STORICO CONVERSAZIONE")
-        lines.append("-" * 80)
-        lines.append("")
-        
-        for msg in messages:
-            role = msg['role'].upper()
-            timestamp = msg['created_at'].strftime('%H:%M:%S')
-            content = msg['content']
-            
-            if role == "USER":
-                lines.append(f"[{timestamp}] UTENTE:")
-                lines.append(f"  {content}")
-            elif role == "ASSISTANT":
-                lines.append(f"[{timestamp}] ASSISTENTE:")
-                lines.append(f"  {content}")
-            
-            # Add image indicator if present
-            if msg.get('image_url'):
-                lines.append(f"  [Immagine allegata: {msg['image_url']}]")
-            
-            lines.append("")
+        yield cls._join([
+            "=" * 80,
+            "REPORT CONFIGURAZIONE TRAPIANTATRICE SPAPPERI",
+            "=" * 80,
+            "",
+            f"Data generazione: {datetime.now().strftime('%d/%m/%Y %H:%M')}",
+            f"Conversation ID: {conversation_id}",
+            f"Status: {conversation.get('status', 'unknown')}",
+            "",
+            "=" * 80,
+            "",
+            # Conversation History
+            "STORICO CONVERSAZIONE",
+            "-" * 80,
+            "",
+        ])
+        
+        async for msg in db.iter_conversation_messages(conversation_id):
+            yield cls._join(cls._format_message(msg))
         
+        lines = []
         lines.append("")
         lines.append("=" * 80)
         lines.append("")
@@ -106,17 +95,84 @@ class ExportService:
         # Footer
         lines.append("Grazie per aver utilizzato il configuratore Spapperi.")
         lines.append("Sarai ricontattato al più presto dal nostro team commerciale.")
-        lines.append("")
         
-        # Write to file
+        yield cls._join(lines)
+    
+    @classmethod
+    async def generate_txt_report(cls, conversation_id: UUID) -> str:
+        """
+        Archive the TXT report to EXPORT_DIR (opt-in, see ARCHIVE_ENABLED).
+        
+        Returns:
+            File path of generated report
+        """
+        cls.ensure_export_dir()
+        
         filename = f"{conversation_id}.txt"
         filepath = os.path.join(cls.EXPORT_DIR, filename)
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
+        # Write chunk by chunk so archiving also runs in constant memory, to a
+        # temporary file swapped in at the end: a download streaming the
+        # previous archive keeps reading a complete file
+        tmp_path = f"{filepath}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                async for chunk in cls.stream_txt_report(conversation_id):
+                    f.write(chunk)
+            os.replace(tmp_path, filepath)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
         
         return filepath
     
+    @classmethod
+    async def stream_file(cls, filepath: str) -> AsyncIterator[str]:
+        """Stream an archived report back in chunks"""
+        with open(filepath, 'r', encoding='utf-8') as f:
+            while True:
+                chunk = f.read(cls.FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    
+    @staticmethod
+    async def gzip_stream(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+        """Compress a stream of text chunks into a gzip byte stream"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        async for chunk in chunks:
+            data = compressor.compress(chunk.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+    
+    @staticmethod
+    def _join(lines: List[str]) -> str:
+        """Join report lines into a newline-terminated chunk"""
+        return '\n'.join(lines) + '\n'
+    
+    @classmethod
+    def _format_message(cls, msg: Dict[str, Any]) -> List[str]:
+        """Format a single conversation message into report lines"""
+        lines = []
+        role = msg['role'].upper()
+        timestamp = msg['created_at'].strftime('%H:%M:%S')
+        content = msg['content']
+        
+        if role == "USER":
+            lines.append(f"[{timestamp}] UTENTE:")
+            lines.append(f"  {content}")
+        elif role == "ASSISTANT":
+            lines.append(f"[{timestamp}] ASSISTENTE:")
+            lines.append(f"  {content}")
+        
+        # Add image indicator if present
+        if msg.get('image_url'):
+            lines.append(f"  [Immagine allegata: {msg['image_url']}]")
+        
+        lines.append("")
+        return lines
+    
     @classmethod
     def _format_configuration(cls, config: Dict[str, Any]) -> List[str]:
         """Format configuration data into readable lines"""
@@ -0,0 +1,87 @@
+"""
+Leveled, structured logging.
+
+Records are handed to a queue on the request path and formatted/written by a
+background listener thread, so slow stdout never blocks the event loop.
+Use `logging.getLogger(__name__)` and pass structured fields via `extra=`.
+"""
+import os
+import sys
+import json
+import queue
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from app.utils.context import current_conversation_id, current_phase
+from app.utils.tracing import current_trace_id
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_STANDARD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime"}
+
+_listener = None
+
+
+class ContextFilter(logging.Filter):
+    """Attach the conversation/phase/trace of the current turn to each record"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "conversation_id"):
+            record.conversation_id = current_conversation_id.get()
+        if not hasattr(record, "phase"):
+            record.phase = current_phase.get()
+        if not hasattr(record, "trace_id"):
+            record.trace_id = current_trace_id()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and value is not None and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+def setup_logging():
+    """Configure root logging once: queue on the caller side, writer thread behind it"""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if os.getenv("LOG_FORMAT", "json").lower() == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s [%(conversation_id)s %(phase)s] %(message)s"
+        ))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
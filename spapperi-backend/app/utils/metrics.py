@@ -0,0 +1,238 @@
+"""
+Prometheus instrumentation for the chat turn and its stages.
+
+Stages (db, validator, rag_*, pdf, smtp, ...) are timed into one histogram
+labelled by stage and by the conversation phase of the current turn.
+Exposed in text format on /metrics.
+"""
+import time
+import inspect
+import functools
+from contextlib import contextmanager
+from typing import Optional
+from prometheus_client import Counter, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+from app.utils.context import current_phase
+
+registry = CollectorRegistry()
+
+# Latency buckets from sub-millisecond DB calls up to multi-second LLM calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_LATENCY = Histogram(
+    "spapperi_stage_duration_seconds",
+    "Latency of each stage of a chat turn",
+    ["stage", "phase"],
+    buckets=LATENCY_BUCKETS,
+    registry=registry
+)
+TURN_LATENCY = Histogram(
+    "spapperi_turn_duration_seconds",
+    "End-to-end latency of a chat turn",
+    ["phase", "outcome"],
+    buckets=LATENCY_BUCKETS,
+    registry=registry
+)
+POOL_WAIT = Histogram(
+    "spapperi_db_pool_wait_seconds",
+    "Time spent waiting for a pooled database connection",
+    buckets=LATENCY_BUCKETS,
+    registry=registry
+)
+OPENAI_TOKENS = Counter(
+    "spapperi_openai_tokens_total",
+    "OpenAI tokens consumed",
+    ["purpose", "model", "kind"],
+    registry=registry
+)
+OPENAI_CALLS = Counter(
+    "spapperi_openai_calls_total",
+    "OpenAI API calls",
+    ["purpose", "model", "outcome"],
+    registry=registry
+)
+OPENAI_CALL_TOKENS = Histogram(
+    "spapperi_openai_call_tokens",
+    "Tokens per OpenAI call (prompt, cached part of the prompt, completion)",
+    ["purpose", "kind"],
+    buckets=(50, 100, 250, 500, 1000, 1500, 2000, 4000, 8000),
+    registry=registry
+)
+PROMPT_TRIMMING = Counter(
+    "spapperi_validator_prompt_trimmed_total",
+    "Validator prompt content fitted to the token budget",
+    ["phase", "action"],
+    registry=registry
+)
+ADMISSION_REJECTIONS = Counter(
+    "spapperi_admission_rejected_total",
+    "Requests rejected by admission control (fast 429)",
+    ["endpoint", "reason"],
+    registry=registry
+)
+DEGRADED_VALIDATIONS = Counter(
+    "spapperi_degraded_validations_total",
+    "Answers handled without the LLM (circuit open or call failed)",
+    ["phase", "outcome"],
+    registry=registry
+)
+RECOMMENDATIONS = Counter(
+    "spapperi_recommendations_total",
+    "Recommendations served at completion/export, by where they came from",
+    ["source"],
+    registry=registry
+)
+RECOMMENDATION_CACHE_LOOKUPS = Counter(
+    "spapperi_recommendation_cache_lookups_total",
+    "Semantic recommendation cache lookups by decision",
+    ["decision"],
+    registry=registry
+)
+RECOMMENDATION_CACHE_SIMILARITY = Histogram(
+    "spapperi_recommendation_cache_similarity",
+    "Cosine similarity of the nearest cached recommendation",
+    ["decision"],
+    buckets=(0.5, 0.7, 0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.98, 0.99, 1.0),
+    registry=registry
+)
+STAGE_ERRORS = Counter(
+    "spapperi_stage_errors_total",
+    "Exceptions raised inside an instrumented stage",
+    ["stage"],
+    registry=registry
+)
+
+
+def _phase_label() -> str:
+    return current_phase.get() or "none"
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one stage of the current turn"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        STAGE_LATENCY.labels(name, _phase_label()).observe(time.perf_counter() - start)
+
+
+def timed(name: str):
+    """Decorator form of `stage`, for sync and async functions"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_turn(phase: str, outcome: str, seconds: float):
+    """Record the end-to-end duration of a chat turn"""
+    TURN_LATENCY.labels(phase or "none", outcome).observe(seconds)
+
+
+def observe_pool_wait(seconds: float):
+    POOL_WAIT.observe(seconds)
+
+
+def usage_attributes(usage) -> dict:
+    """Token counts of an OpenAI usage object (None-safe); cached_tokens is the prompt-cache hit"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", None) or 0,
+    }
+
+
+def record_openai_usage(purpose: str, model: str, usage, outcome: str = "ok"):
+    """Count one OpenAI call and its token usage (usage may be None)"""
+    OPENAI_CALLS.labels(purpose, model, outcome).inc()
+    if usage is None:
+        return
+    tokens = usage_attributes(usage)
+    OPENAI_TOKENS.labels(purpose, model, "prompt").inc(tokens["prompt_tokens"])
+    OPENAI_CALL_TOKENS.labels(purpose, "prompt").observe(tokens["prompt_tokens"])
+    if tokens["cached_tokens"]:
+        OPENAI_TOKENS.labels(purpose, model, "cached_prompt").inc(tokens["cached_tokens"])
+    OPENAI_CALL_TOKENS.labels(purpose, "cached_prompt").observe(tokens["cached_tokens"])
+    if tokens["completion_tokens"]:
+        OPENAI_TOKENS.labels(purpose, model, "completion").inc(tokens["completion_tokens"])
+        OPENAI_CALL_TOKENS.labels(purpose, "completion").observe(tokens["completion_tokens"])
+
+
+def record_prompt_trimming(phase: str, reduced: int, omitted: int, answer_truncated: bool):
+    """Count history messages summarised/cut or left out, and cut answers"""
+    if reduced:
+        PROMPT_TRIMMING.labels(phase, "history_reduced").inc(reduced)
+    if omitted:
+        PROMPT_TRIMMING.labels(phase, "history_omitted").inc(omitted)
+    if answer_truncated:
+        PROMPT_TRIMMING.labels(phase, "answer_truncated").inc()
+
+
+def record_degraded_validation(phase: str, outcome: str):
+    """outcome: "local_complete", "local_incomplete" or "deferred" (free text queued for the LLM)"""
+    DEGRADED_VALIDATIONS.labels(phase, outcome).inc()
+
+
+def record_recommendation(source: str):
+    """source: stored (prefetched or earlier), inflight (joined a running prefetch) or generated"""
+    RECOMMENDATIONS.labels(source).inc()
+
+
+def record_recommendation_cache_lookup(decision: str, similarity: Optional[float]):
+    RECOMMENDATION_CACHE_LOOKUPS.labels(decision).inc()
+    if similarity is not None:
+        RECOMMENDATION_CACHE_SIMILARITY.labels(decision).observe(similarity)
+
+
+def record_admission_rejection(endpoint: str, reason: str):
+    ADMISSION_REJECTIONS.labels(endpoint, reason).inc()
+
+
+class _StatsCollector:
+    """Exposes dict-returning stats callables (pool, cache) as gauges at scrape time"""
+
+    def __init__(self):
+        self._sources = {}
+
+    def register(self, prefix: str, source):
+        self._sources[prefix] = source
+
+    def collect(self):
+        for prefix, source in self._sources.items():
+            try:
+                stats = source() or {}
+            except Exception:
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                yield GaugeMetricFamily(f"spapperi_{prefix}_{key}", f"{prefix} {key}", value=value)
+
+
+stats_collector = _StatsCollector()
+registry.register(stats_collector)
+
+
+def register_stats(prefix: str, source):
+    """Publish a stats callable (returning a flat dict of numbers) under spapperi_<prefix>_*"""
+    stats_collector.register(prefix, source)
+
+
+def render() -> bytes:
+    """Current metrics in Prometheus text format"""
+    return generate_latest(registry)
@@ -0,0 +1,194 @@
+"""
+OpenTelemetry tracing for the chat turn.
+
+Each HTTP request gets a server span (continuing an incoming W3C `traceparent`,
+e.g. from the Next.js proxy); database, validator, RAG, PDF and SMTP calls
+are child spans via the `traced` decorator.
+
+Exporter is chosen with TRACING_EXPORTER:
+    none (default) | console | file (JSON lines at TRACING_FILE) | memory | otlp
+The memory exporter keeps finished spans in-process so the span structure
+can be asserted offline (see `finished_spans`).
+"""
+import os
+import json
+import inspect
+import functools
+from typing import Optional, Sequence, List
+from opentelemetry import trace, propagate
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider, ReadableSpan
+from opentelemetry.sdk.trace.export import (
+    SpanExporter,
+    SpanExportResult,
+    SimpleSpanProcessor,
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from app.utils.context import current_conversation_id, current_phase
+
+tracer = trace.get_tracer("spapperi")
+
+# Set when TRACING_EXPORTER=memory
+memory_exporter: Optional[InMemorySpanExporter] = None
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """Appends one JSON object per finished span to a file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for span in spans:
+                    f.write(json.dumps(span_to_dict(span), default=str) + "\n")
+            return SpanExportResult.SUCCESS
+        except OSError:
+            return SpanExportResult.FAILURE
+
+    def shutdown(self):
+        pass
+
+
+def span_to_dict(span: ReadableSpan) -> dict:
+    """Compact, exporter-independent view of a finished span"""
+    ctx = span.get_span_context()
+    return {
+        "name": span.name,
+        "trace_id": format(ctx.trace_id, "032x"),
+        "span_id": format(ctx.span_id, "016x"),
+        "parent_id": format(span.parent.span_id, "016x") if span.parent else None,
+        "kind": span.kind.name,
+        "start": span.start_time,
+        "duration_ms": (span.end_time - span.start_time) / 1e6 if span.end_time else None,
+        "status": span.status.status_code.name,
+        "attributes": dict(span.attributes or {}),
+    }
+
+
+def setup_tracing():
+    """Install the tracer provider and exporter selected by TRACING_EXPORTER"""
+    global memory_exporter
+
+    exporter_name = os.getenv("TRACING_EXPORTER", "none").lower()
+    provider = TracerProvider(resource=Resource.create({"service.name": "spapperi-backend"}))
+
+    if exporter_name == "console":
+        provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+    elif exporter_name == "file":
+        path = os.getenv("TRACING_FILE", "/app/exports/traces.jsonl")
+        provider.add_span_processor(BatchSpanProcessor(JsonLinesSpanExporter(path)))
+    elif exporter_name == "memory":
+        memory_exporter = InMemorySpanExporter()
+        # Synchronous export so spans are visible as soon as they end
+        provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+    elif exporter_name == "otlp":
+        # Optional dependency: opentelemetry-exporter-otlp
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+
+    trace.set_tracer_provider(provider)
+
+
+def shutdown_tracing():
+    """Flush pending spans"""
+    provider = trace.get_tracer_provider()
+    if isinstance(provider, TracerProvider):
+        provider.shutdown()
+
+
+def finished_spans() -> List[dict]:
+    """Spans collected by the memory exporter, as dicts"""
+    if memory_exporter is None:
+        return []
+    return [span_to_dict(span) for span in memory_exporter.get_finished_spans()]
+
+
+def current_trace_id() -> Optional[str]:
+    """Hex trace id of the active span, if any"""
+    ctx = trace.get_current_span().get_span_context()
+    return format(ctx.trace_id, "032x") if ctx.is_valid else None
+
+
+def annotate_current_span(**attributes):
+    """Set attributes (None values skipped) on the active span"""
+    span = trace.get_current_span()
+    for key, value in attributes.items():
+        if value is not None:
+            span.set_attribute(f"spapperi.{key}", value)
+
+
+def _turn_attributes() -> dict:
+    attributes = {}
+    if current_conversation_id.get():
+        attributes["spapperi.conversation_id"] = current_conversation_id.get()
+    if current_phase.get():
+        attributes["spapperi.phase"] = current_phase.get()
+    return attributes
+
+
+def _record_error(span, error: BaseException):
+    span.record_exception(error)
+    span.set_status(Status(StatusCode.ERROR, str(error)))
+
+
+def traced(name: str):
+    """Run the decorated function (sync, async or async generator) in a child span"""
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def asyncgen_wrapper(*args, **kwargs):
+                # Not made current: the context would have to survive across yields
+                # into the consumer (e.g. a StreamingResponse), which may stop early
+                span = tracer.start_span(name, attributes=_turn_attributes(), record_exception=False)
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                except Exception as e:
+                    _record_error(span, e)
+                    raise
+                finally:
+                    span.end()
+            return asyncgen_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.start_as_current_span(name, attributes=_turn_attributes(), record_exception=False) as span:
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception as e:
+                        _record_error(span, e)
+                        raise
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(name, attributes=_turn_attributes(), record_exception=False) as span:
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    _record_error(span, e)
+                    raise
+        return wrapper
+    return decorator
+
+
+def start_server_span(name: str, headers):
+    """Server span for an incoming request, continuing the caller's trace context"""
+    return tracer.start_as_current_span(
+        name,
+        context=propagate.extract(headers),
+        kind=SpanKind.SERVER,
+        record_exception=False
+    )
+
+
+def inject_headers(headers: dict) -> dict:
+    """Write the active trace context (traceparent/tracestate) into `headers`"""
+    propagate.inject(headers)
+    return headers
@@ -0,0 +1,7 @@
+import os
+
+# Modules that build an OpenAI client on import need a key; tests never call the API
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+# test_env.py is a manual SMTP check that sends a real email: run it by hand
+collect_ignore = ["test_env.py"]
@@ -1,20 +1,49 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, PlainTextResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 import os
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List
 from uuid import UUID
 
-from app.models.conversation import ChatRequest, ChatResponse
+from app.models.conversation import ChatRequest, ChatResponse, PhaseEditRequest, ResumeResponse
+from app.models.configuration import ConfigurationSubmission, ConfigurationBatch, ConfigurationResult
 from app.services.db import db
-from app.services.phase_manager import phase_manager
+from app.services.phase_manager import phase_manager, CHECKPOINT_MESSAGES
 from app.services.db import db
-from app.services.rag_service import rag_service
 from app.services.pdf_service import generate_report
 from app.utils.export import export_service
 from app.services.openai_validator import ai_validator
+from app.services.prompt_builder import load_encoding
 from app.services.pdf_service import generate_report, generate_commercial_proposal
+from app.services.outbox_worker import outbox_worker
+from app.services.enrichment_worker import enrichment_worker
+from app.services.circuit_breaker import llm_breaker
+from app.services.usage_ledger import usage_ledger
+from app.services.recommendation_service import recommendation_service
+from app.services.config_validator import config_validator
+from app.services.state_cache import state_cache
+from app.services.turn_lock import turn_locks, TurnLockTimeout
+from app.services.admission import admission, AdmissionRejected
+from app.utils import metrics
+from app.utils.context import set_turn_context, current_phase as current_phase_var
+from app.utils.log import setup_logging, shutdown_logging
+from app.utils import tracing
+from jinja2 import Environment, FileSystemLoader
+
+email_template_env = Environment(loader=FileSystemLoader("/app/app/templates"))
+
+setup_logging()
+tracing.setup_tracing()
+logger = logging.getLogger("spapperi")
+
+# Bulk configuration submissions
+CONFIG_BATCH_MAX = int(os.getenv("CONFIG_BATCH_MAX", 100))
+CONFIG_BATCH_CONCURRENCY = int(os.getenv("CONFIG_BATCH_CONCURRENCY", 4))
 
 
 @asynccontextmanager
@@ -23,16 +52,32 @@ async def lifespan(app: FastAPI):
     # Startup
     await db.initialize()
     ai_validator.initialize()
+    # Reads (or downloads) the BPE file: keep it off the event loop
+    await asyncio.to_thread(load_encoding)
     export_service.ensure_export_dir()
-    print("✓ Database connection pool initialized")
-    print("✓ OpenAI client initialized")
-    print("✓ Export directory ready")
+    outbox_worker.start()
+    enrichment_worker.start()
+    usage_ledger.start()
+    metrics.register_stats("db_pool", db.pool_stats)
+    metrics.register_stats("state_cache", state_cache.stats)
+    metrics.register_stats("admission", admission.stats)
+    metrics.register_stats("llm_breaker", llm_breaker.stats)
+    metrics.register_stats("usage_ledger", usage_ledger.stats)
+    metrics.register_stats("recommendation", recommendation_service.stats)
+    logger.info("Database connection pool initialized")
+    logger.info("OpenAI client initialized")
+    logger.info("Export directory ready")
     
     yield
     
     # Shutdown
+    await outbox_worker.stop()
+    await enrichment_worker.stop()
+    await usage_ledger.stop()
     await db.close()
-    print("✓ Database connection pool closed")
+    logger.info("Database connection pool closed")
+    tracing.shutdown_tracing()
+    shutdown_logging()
 
 
 app = FastAPI(
@@ -50,19 +95,151 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["traceparent", "X-Trace-Id"],
 )
 
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Server span per request, continuing the trace started by the frontend proxy"""
+    with tracing.start_server_span(f"{request.method} {request.url.path}", request.headers) as span:
+        span.set_attribute("http.method", request.method)
+        response = await call_next(request)
+        # Name by route template so ids in the path don't explode span cardinality
+        route = request.scope.get("route")
+        if route is not None:
+            span.update_name(f"{request.method} {route.path}")
+            span.set_attribute("http.route", route.path)
+        span.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.set_status(tracing.Status(tracing.StatusCode.ERROR))
+        tracing.inject_headers(response.headers)
+        response.headers["X-Trace-Id"] = tracing.current_trace_id() or ""
+        return response
+
+
+def _admission_key(http_request: Request) -> str:
+    peer = http_request.client.host if http_request.client else None
+    return admission.client_key(peer, http_request.headers.get("x-forwarded-for"))
+
+
+def _too_many_requests(e: AdmissionRejected) -> HTTPException:
+    """Fast 429 for a request refused by admission control"""
+    return HTTPException(
+        status_code=429,
+        detail="Too many requests, please retry shortly",
+        headers={"Retry-After": e.retry_after_header}
+    )
+
+
 @app.get("/")
 def root():
     """Health check endpoint"""
     return {"status": "Backend OK", "version": "2.0.0"}
 
 
+@app.get("/api/health/db")
+async def db_health():
+    """Connection pool statistics (size, idle, acquire wait)"""
+    return db.pool_stats()
+
+
+@app.get("/api/health/cache")
+async def cache_health():
+    """Conversation state cache hit rate and staleness counters"""
+    return state_cache.stats()
+
+
+@app.get("/api/health/llm")
+async def llm_health():
+    """LLM circuit breaker state (while open, answers are validated locally)"""
+    return llm_breaker.stats()
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint: per-stage/per-phase latency, tokens, pool and cache"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request, idempotency_key: Optional[str] = Header(None)):
     """
     Main conversational endpoint.
+    Turns are serialized per conversation; a request carrying an idempotency key
+    that was already processed gets the stored response back.
+    Admission control applies a per-client rate limit and a global cap on
+    turns in flight (LLM calls); refused requests get a 429 with Retry-After.
+    """
+    key = request.idempotency_key or idempotency_key
+    
+    try:
+        admission.check_client(_admission_key(http_request), "chat")
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+    
+    if key:
+        stored = await db.get_idempotent_response(key, request.conversation_id)
+        if stored:
+            return ChatResponse(**stored)
+    
+    # Brand-new conversations have no id yet: serialize their retries on the key
+    lock_key = request.conversation_id or key
+    if not lock_key:
+        return await _admitted_chat_turn(request)
+    
+    try:
+        async with turn_locks.hold(lock_key):
+            if key:
+                # The duplicate we were waiting behind may have just stored it
+                stored = await db.get_idempotent_response(key, request.conversation_id)
+                if stored:
+                    return ChatResponse(**stored)
+            
+            response = await _admitted_chat_turn(request)
+            
+            if key:
+                await db.save_idempotent_response(
+                    key, request.conversation_id, UUID(response.conversation_id), response.model_dump()
+                )
+            return response
+    except TurnLockTimeout:
+        raise HTTPException(
+            status_code=409,
+            detail="Another message for this conversation is still being processed",
+            headers={"Retry-After": "1"}
+        )
+
+
+async def _admitted_chat_turn(request: ChatRequest) -> ChatResponse:
+    """Run a chat turn inside a global LLM slot (taken after the turn lock, so waiters don't hold one)"""
+    try:
+        async with admission.llm_slot("chat"):
+            return await _run_chat_turn(request)
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+
+
+async def _run_chat_turn(request: ChatRequest) -> ChatResponse:
+    """Process one user message, recording turn latency and outcome"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        response = await _process_chat_turn(request)
+        if response.is_complete:
+            outcome = "complete"
+        elif response.current_phase != current_phase_var.get():
+            outcome = "advanced"
+        else:
+            outcome = "stayed"
+        return response
+    finally:
+        metrics.observe_turn(current_phase_var.get(), outcome, time.perf_counter() - start)
+
+
+async def _process_chat_turn(request: ChatRequest) -> ChatResponse:
+    """
+    Process one user message.
     Handles user messages, validates responses, updates conversation state.
     """
     try:
@@ -73,7 +250,7 @@ async def chat(request: ChatRequest):
                 conversation = await db.get_conversation(conv_id)
                 if not conversation:
                     # Conversation doesn't exist - create new one instead of error
-                    print(f"Conversation {conv_id} not found, creating new...")
+                    logger.info("Conversation not found, creating new", extra={"requested_id": str(conv_id)})
                     conv_id = await db.create_conversation()
                     conversation = await db.get_conversation(conv_id)
             except ValueError:
@@ -84,12 +261,15 @@ async def chat(request: ChatRequest):
             conversation = await db.get_conversation(conv_id)
         
         current_phase = conversation['current_phase']
+        set_turn_context(conv_id, current_phase)
+        tracing.annotate_current_span(conversation_id=str(conv_id), phase=current_phase)
         
         # Save user message
         await db.save_message(
             conversation_id=conv_id,
             role="user",
-            content=request.message
+            content=request.message,
+            phase=current_phase
         )
         
         # Special case: Initial greeting
@@ -102,7 +282,13 @@ async def chat(request: ChatRequest):
                 conversation_id=conv_id,
                 role="assistant",
                 content=welcome,
-                image_url=image_url
+                image_url=image_url,
+                phase=current_phase,
+                starts_phase=True,
+                checkpoint=phase_manager.build_checkpoint(conversation, current_phase, None, [
+                    {"role": "user", "content": request.message, "phase": current_phase},
+                    {"role": "assistant", "content": welcome, "image_url": image_url, "phase": current_phase},
+                ])
             )
             
             return ChatResponse(
@@ -120,26 +306,25 @@ async def chat(request: ChatRequest):
         result = await phase_manager.process_user_response(
             conversation_id=conv_id,
             current_phase=current_phase,
-            user_message=request.message
+            user_message=request.message,
+            resume_phase=conversation.get('resume_phase')
         )
         
         is_valid = result["is_valid"]
         next_phase = result["next_phase"]
         clarification = result.get("clarification_needed")
         
-        # Log validation result for debugging
-        print(f"Validation result for phase {current_phase}: valid={is_valid}, clarification={clarification}")
+        logger.info("Validation result", extra={"valid": is_valid, "next_phase": next_phase})
         
         if not is_valid:
             # Invalid/incomplete response - ask for clarification
             response_text = clarification or "Mi dispiace, non ho capito bene. Puoi essere più specifico?"
             
-            print(f"Requesting clarification: {response_text}")
-            
             await db.save_message(
                 conversation_id=conv_id,
                 role="assistant",
-                content=response_text
+                content=response_text,
+                phase=current_phase
             )
             
             return ChatResponse(
@@ -149,90 +334,30 @@ async def chat(request: ChatRequest):
                 is_complete=False
             )
         
-        # Valid response - move to next phase
-        await db.update_conversation_phase(conv_id, next_phase)
+        # Valid response - move to next phase (keeping the resume point while editing)
+        await db.update_conversation_phase(conv_id, next_phase, result.get("resume_phase"))
         
         # Check if conversation is complete
         if next_phase == "complete":
             # Generate export file
             await db.mark_conversation_complete(conv_id)
             
-            # Generate TXT report (legacy/backup)
-            await export_service.generate_txt_report(conv_id)
-            
-            # Generate PDF report
-            # Generate PDF report
             config_data = await db.get_configuration_data(conv_id)
-            
-            # Generate RAG recommendation
-            print("Generating product recommendation...")
-            try:
-                recommendation = await rag_service.generate_recommendation(config_data)
-                print("Recommendation generated successfully")
-            except Exception as e:
-                print(f"Error generating recommendation: {e}")
-                recommendation = None
-            
-            pdf_path = generate_report(config_data, f"spapperi_config_{conv_id}", recommendation)
+            await _run_completion_pipeline(conv_id, config_data)
             
             response_text = "Grazie! I dati sono stati registrati. Puoi scaricare il riepilogo in PDF qui sotto. 📄\n\nTi è stato inviato anche via mail. A presto! 🎉"
             
             await db.save_message(
                 conversation_id=conv_id,
                 role="assistant",
-                content=response_text
+                content=response_text,
+                phase=next_phase,
+                starts_phase=True,
+                checkpoint=phase_manager.build_checkpoint(conversation, next_phase, config_data, [
+                    {"role": "user", "content": request.message, "phase": current_phase},
+                    {"role": "assistant", "content": response_text, "phase": next_phase},
+                ])
             )
-
-            # Add email sending logic when conversation is complete and contact email is provided
-            if config_data.get("contact_email") and config_data["contact_email"] != "No":
-                try:
-                    # 3. Generate Commercial Proposal
-                    commercial_pdf = generate_commercial_proposal(config_data)
-
-                    if commercial_pdf:
-                        # 4. Send Email
-                        print("DEBUG: [1] STARTING EMAIL WORKFLOW")
-                        try:
-                            from app.services.email_service import email_service
-                            from jinja2 import Environment, FileSystemLoader
-                            print("DEBUG: [2] Imports successful")
-                            
-                            # Prepare email template
-                            email_subject = f"Preventivo Spapperi - Configurazione {config_data.get('id').hex[:8]}"
-                            print(f"DEBUG: [3] Subject defined: {email_subject}")
-                            
-                            template_env = Environment(loader=FileSystemLoader("/app/app/templates"))
-                            email_template = template_env.get_template("email_template.html")
-                            print("DEBUG: [4] Template loaded")
-                            
-                            email_body = email_template.render(
-                                config=config_data,
-                                crop_type=config_data.get('crop_type', 'N/D')
-                            )
-                            print("DEBUG: [5] Body rendered")
-                            
-                            print(f"DEBUG: [6] Sending to {config_data.get('contact_email')}")
-                            result = await email_service.send_email_with_attachments(
-                                to_email=config_data["contact_email"],
-                                subject=email_subject,
-                                body=email_body,
-                                attachment_paths=[commercial_pdf, pdf_path] 
-                            )
-                            print(f"DEBUG: [7] Email send result: {result}")
-                        except Exception as inner_err:
-                            print(f"DEBUG: CRITICAL ERROR INSIDE BLOCK: {repr(inner_err)}")
-                            import traceback
-                            traceback.print_exc()
-                            raise inner_err
-
-                    else:
-                        print("DEBUG: Commercial PDF was None")
-                        pass
-                except Exception as email_err:
-                    print(f"Error executing email workflow WRAPPER: {repr(email_err)}")
-                    import traceback
-                    traceback.print_exc()
-                    print(f"Error executing email workflow: {email_err}")
             
             return ChatResponse(
                 response=response_text,
@@ -243,17 +368,27 @@ async def chat(request: ChatRequest):
             )
         
         # Small delay to ensure DB writes complete before fetching for conditional logic
-        import asyncio
         await asyncio.sleep(0.1)
         
         # Get next question (will fetch fresh data from DB for conditional logic)
-        next_question, image_url, ui_type, options = await phase_manager.get_next_question(conv_id, next_phase)
+        config_data = await db.get_configuration_data(conv_id)
+        next_question, image_url, ui_type, options = phase_manager.render_question(next_phase, config_data or {})
+        
+        # The recommendation's inputs may all be known now: generate it while
+        # the user answers the closing questions
+        recommendation_service.maybe_prefetch(conv_id, config_data or {})
         
         await db.save_message(
             conversation_id=conv_id,
             role="assistant",
             content=next_question,
-            image_url=image_url
+            image_url=image_url,
+            phase=next_phase,
+            starts_phase=True,
+            checkpoint=phase_manager.build_checkpoint(conversation, next_phase, config_data, [
+                {"role": "user", "content": request.message, "phase": current_phase},
+                {"role": "assistant", "content": next_question, "image_url": image_url, "phase": next_phase},
+            ], resume_phase=result.get("resume_phase"))
         )
         
         return ChatResponse(
@@ -267,10 +402,121 @@ async def chat(request: ChatRequest):
         )
     
     except Exception as e:
-        print(f"Error in chat endpoint: {e}")
+        logger.exception("Error in chat endpoint: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _run_completion_pipeline(conv_id: UUID, config_data: Dict[str, Any]) -> Optional[str]:
+    """
+    Everything that happens once a configuration is complete: optional TXT
+    archive, RAG recommendation, PDF report and the queued quote email.
+    Returns the PDF report path.
+    """
+    # Archive TXT report (legacy/backup, opt-in)
+    if export_service.ARCHIVE_ENABLED:
+        await export_service.generate_txt_report(conv_id)
+    
+    # RAG recommendation: usually prefetched before the closing questions
+    recommendation = await _get_recommendation(conv_id, config_data)
+    
+    # PDF rendering is CPU-bound: keep it off the event loop
+    pdf_path = await asyncio.to_thread(
+        generate_report, config_data, f"spapperi_config_{conv_id}", recommendation
+    )
+    
+    # Queue the quote email; the outbox worker delivers it off the request path
+    if config_data.get("contact_email") and config_data["contact_email"] != "No":
+        try:
+            # Generate Commercial Proposal
+            commercial_pdf = await asyncio.to_thread(generate_commercial_proposal, config_data)
+            
+            if commercial_pdf:
+                email_subject = f"Preventivo Spapperi - Configurazione {config_data.get('id').hex[:8]}"
+                email_template = email_template_env.get_template("email_template.html")
+                email_body = email_template.render(
+                    config=config_data,
+                    crop_type=config_data.get('crop_type', 'N/D')
+                )
+                
+                await outbox_worker.enqueue(
+                    to_email=config_data["contact_email"],
+                    subject=email_subject,
+                    body=email_body,
+                    attachment_paths=[commercial_pdf, pdf_path],
+                    conversation_id=conv_id
+                )
+            else:
+                logger.warning("Commercial PDF was not generated, email not queued")
+        except Exception as email_err:
+            logger.exception("Error queueing email: %s", email_err)
+    
+    return pdf_path
+
+
+async def _get_recommendation(conv_id: UUID, config_data: Dict[str, Any]) -> Optional[str]:
+    """Stored (or prefetched) recommendation for the configuration, generating it if missing or stale"""
+    return await recommendation_service.get(conv_id, config_data)
+
+
+async def _submit_configuration(submission: ConfigurationSubmission, run_completion: bool) -> ConfigurationResult:
+    """Validate locally, store in one transaction and optionally run the completion pipeline"""
+    data, errors = config_validator.validate(submission)
+    if errors:
+        return ConfigurationResult(status="invalid", errors=errors)
+    
+    config_data = await db.create_completed_configuration(data)
+    conv_id = config_data["conversation_id"]
+    set_turn_context(conv_id, "complete")
+    
+    if not run_completion:
+        return ConfigurationResult(status="saved", conversation_id=str(conv_id))
+    
+    await _run_completion_pipeline(conv_id, config_data)
+    return ConfigurationResult(
+        status="completed",
+        conversation_id=str(conv_id),
+        export_file=f"/api/export/{conv_id}/pdf"
+    )
+
+
+@app.post("/api/configurations", response_model=ConfigurationResult)
+async def submit_configuration(submission: ConfigurationSubmission):
+    """
+    Submit a complete configuration without the conversational loop.
+    Values are checked against the phase rules locally; no LLM is involved.
+    """
+    result = await _submit_configuration(submission, submission.run_completion)
+    if result.status == "invalid":
+        raise HTTPException(status_code=422, detail={"errors": result.errors})
+    return result
+
+
+@app.post("/api/configurations/batch", response_model=List[ConfigurationResult])
+async def submit_configuration_batch(batch: ConfigurationBatch):
+    """
+    Submit many configurations at once. Items are processed with bounded
+    concurrency and succeed or fail individually.
+    """
+    if len(batch.configurations) > CONFIG_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {CONFIG_BATCH_MAX} configurations per batch")
+    
+    slots = asyncio.Semaphore(CONFIG_BATCH_CONCURRENCY)
+    
+    async def run(index: int, submission: ConfigurationSubmission) -> ConfigurationResult:
+        async with slots:
+            try:
+                result = await _submit_configuration(
+                    submission, batch.run_completion or submission.run_completion
+                )
+            except Exception as e:
+                logger.exception("Batch configuration %d failed: %s", index, e)
+                result = ConfigurationResult(status="error", errors=[{"field": "", "message": str(e)}])
+            result.index = index
+            return result
+    
+    return await asyncio.gather(*(run(i, s) for i, s in enumerate(batch.configurations)))
+
+
 @app.get("/api/images/{path:path}")
 async def serve_image(path: str):
     """
@@ -286,44 +532,86 @@ async def serve_image(path: str):
 
 
 @app.get("/api/export/{conversation_id}")
-async def export_report(conversation_id: str):
+async def export_report(http_request: Request, conversation_id: str, gzip: bool = False, archive: bool = False):
     """
-    Generate and download TXT report for a conversation.
+    Stream TXT report for a conversation.
+    
+    Query params:
+        gzip: compress the stream (served as .txt.gz)
+        archive: also persist a copy to the exports directory
     """
     try:
         conv_id = UUID(conversation_id)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid conversation ID")
     
+    try:
+        admission.check_client(_admission_key(http_request), "export_txt")
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+    
     # Check if conversation exists
     conversation = await db.get_conversation(conv_id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    # Generate report
-    try:
-        file_path = await export_service.generate_txt_report(conv_id)
-        
-        return FileResponse(
-            file_path,
-            media_type="text/plain",
-            filename=f"configurazione_spapperi_{conversation_id}.txt"
+    if archive or export_service.ARCHIVE_ENABLED:
+        # Send the archived copy itself, so the download and the archive match
+        try:
+            archive_path = await export_service.generate_txt_report(conv_id)
+        except Exception as e:
+            logger.error("Error archiving report: %s", e)
+            raise HTTPException(status_code=500, detail="Failed to generate report")
+        chunks = export_service.stream_file(archive_path)
+    else:
+        chunks = export_service.stream_txt_report(conv_id)
+    
+    filename = f"configurazione_spapperi_{conversation_id}.txt"
+    
+    if gzip:
+        return StreamingResponse(
+            export_service.gzip_stream(chunks),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.gz"'}
         )
-    except Exception as e:
-        print(f"Error generating report: {e}")
-        raise HTTPException(status_code=500, detail="Failed to generate report")
+    
+    return StreamingResponse(
+        chunks,
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 
 @app.get("/api/export/{conversation_id}/pdf")
-async def export_pdf_report(conversation_id: str):
+async def export_pdf_report(conversation_id: str, http_request: Request):
     """
     Download PDF report for a conversation.
+    Rate limited per client; generation (recommendation LLM call + PDF
+    rendering) takes a global LLM slot.
     """
     try:
         conv_id = UUID(conversation_id)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid conversation ID")
     
+    try:
+        admission.check_client(_admission_key(http_request), "export_pdf")
+        async with admission.llm_slot("export_pdf"):
+            pdf_path = await _generate_pdf_report(conv_id)
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+    
+    if pdf_path and os.path.exists(pdf_path):
+        return FileResponse(
+            pdf_path,
+            media_type="application/pdf",
+            filename=f"configurazione_spapperi_{conversation_id}.pdf"
+        )
+    else:
+        raise HTTPException(status_code=500, detail="Failed to generate PDF report")
+
+
+async def _generate_pdf_report(conv_id: UUID) -> Optional[str]:
     # PDF functionality relies on file existing in exports directory
     # It should have been generated at completion.
     # If not, we could regenerate it, but let's try to find it.
@@ -333,28 +621,108 @@ async def export_pdf_report(conversation_id: str):
     if not config_data:
         raise HTTPException(status_code=404, detail="Configuration not found")
 
-    # Re-generate to ensure latest data and file existence
-    # Re-generate to ensure latest data and file existence
+    # Re-generate to ensure latest data and file existence; the recommendation
+    # is stored with the configuration, so it is only generated if missing
+    recommendation = await _get_recommendation(conv_id, config_data)
+
+    # Rendering is CPU-bound: keep it off the event loop, as at completion
+    return await asyncio.to_thread(
+        generate_report, config_data, f"spapperi_config_{conv_id}", recommendation
+    )
+
+
+@app.post("/api/conversation/{conversation_id}/edit", response_model=ChatResponse)
+async def edit_phase(conversation_id: str, request: PhaseEditRequest):
+    """
+    Go back to an answered phase to change it.
+    The next chat message replaces that answer; only the phases depending on
+    it are asked again, then the conversation resumes where it was left.
+    """
+    try:
+        conv_id = UUID(conversation_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid conversation ID")
     
-    # Try to regenerate recommendation too if possible, or just generate without it if it's too slow for a download link?
-    # Ideally should persist recommendation in DB, but for now let's regenerate it on fly or just pass None if we want speed.
-    # Given it's a "Download PDF" button, user expects it. The chat flow already generated it and saved to file system. 
-    # But here we are re-generating. Let's regenerate recommendation to be consistent.
     try:
-        recommendation = await rag_service.generate_recommendation(config_data)
-    except Exception:
-        recommendation = None
+        async with turn_locks.hold(conversation_id):
+            conversation = await db.get_conversation(conv_id)
+            if not conversation:
+                raise HTTPException(status_code=404, detail="Conversation not found")
+            if not phase_manager.is_answered(request.phase, conversation):
+                raise HTTPException(status_code=409, detail="Phase has not been answered yet")
+            
+            set_turn_context(conv_id, request.phase)
+            question, image_url, ui_type, options = await phase_manager.reopen_phase(conv_id, conversation, request.phase)
+            reopened = await db.get_conversation(conv_id)
+            await db.save_message(
+                conversation_id=conv_id,
+                role="assistant",
+                content=question,
+                image_url=image_url,
+                phase=request.phase,
+                starts_phase=True,
+                checkpoint=phase_manager.build_checkpoint(
+                    reopened, request.phase, await db.get_configuration_data(conv_id),
+                    [{"role": "assistant", "content": question, "image_url": image_url, "phase": request.phase}],
+                    resume_phase=reopened.get("resume_phase")
+                )
+            )
+    except TurnLockTimeout:
+        raise HTTPException(
+            status_code=409,
+            detail="Another message for this conversation is still being processed",
+            headers={"Retry-After": "1"}
+        )
+    
+    return ChatResponse(
+        response=question,
+        conversation_id=str(conv_id),
+        current_phase=request.phase,
+        image_url=image_url,
+        is_complete=False,
+        ui_type=ui_type,
+        options=options
+    )
+
 
-    pdf_path = generate_report(config_data, f"spapperi_config_{conv_id}", recommendation)
+@app.get("/api/conversation/{conversation_id}/resume", response_model=ResumeResponse)
+async def resume_conversation(conversation_id: str):
+    """
+    Client state for a returning user (question, UI, recent messages).
+    Served from the checkpoint on the conversation row; conversations
+    without one are rebuilt from the configuration and messages.
+    """
+    try:
+        conv_id = UUID(conversation_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid conversation ID")
     
-    if pdf_path and os.path.exists(pdf_path):
-        return FileResponse(
-            pdf_path,
-            media_type="application/pdf",
-            filename=f"configurazione_spapperi_{conversation_id}.pdf"
-        )
-    else:
-        raise HTTPException(status_code=500, detail="Failed to generate PDF report")
+    conversation = await db.get_conversation(conv_id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    view = phase_manager.resume_view(conversation)
+    if view is None:
+        phase = conversation["current_phase"]
+        messages = await db.get_conversation_messages(conv_id)
+        view = {
+            "current_phase": phase,
+            "resume_phase": conversation.get("resume_phase"),
+            "messages": [
+                {key: message.get(key) for key in ("role", "content", "image_url", "phase")}
+                for message in messages[-CHECKPOINT_MESSAGES:]
+            ],
+            "is_complete": phase == "complete",
+        }
+        if phase in phase_manager.GRAPH:
+            question, image_url, ui_type, options = await phase_manager.get_next_question(conv_id, phase)
+            view.update(question=question, image_url=image_url, ui_type=ui_type, options=options)
+    
+    return ResumeResponse(
+        conversation_id=str(conv_id),
+        export_file=f"/api/export/{conv_id}/pdf" if view["is_complete"] else None,
+        **view
+    )
 
 
 @app.get("/api/conversation/{conversation_id}/history")
@@ -0,0 +1,8 @@
+-- One configuration row per conversation (target of the upsert in save_configuration_data).
+-- Collapse duplicates left by the old check-then-insert path, keeping the newest row.
+DELETE FROM configurations a
+USING configurations b
+WHERE a.conversation_id = b.conversation_id
+  AND (a.created_at, a.id) < (b.created_at, b.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_configurations_conversation ON configurations(conversation_id);
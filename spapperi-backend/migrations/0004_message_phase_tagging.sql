@@ -0,0 +1,6 @@
+-- Phase tagging: each message belongs to the phase it was asked/answered in, and the
+-- conversation points at the assistant message that opened its current phase
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS phase TEXT;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS phase_started_message_id UUID;
+
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_phase ON messages(conversation_id, phase, created_at);
@@ -0,0 +1,23 @@
+-- Broadcast conversation state changes so every worker can invalidate its
+-- in-process state cache. Payload: '<conversation_id>:<writer application_name>'.
+CREATE OR REPLACE FUNCTION notify_conversation_state() RETURNS trigger AS $$
+DECLARE
+    conv_id UUID;
+BEGIN
+    IF TG_TABLE_NAME = 'conversations' THEN
+        conv_id := NEW.id;
+    ELSE
+        conv_id := NEW.conversation_id;
+    END IF;
+    PERFORM pg_notify('conversation_state', conv_id::text || ':' || current_setting('application_name'));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER conversations_notify_state
+    AFTER UPDATE ON conversations
+    FOR EACH ROW EXECUTE FUNCTION notify_conversation_state();
+
+CREATE OR REPLACE TRIGGER configurations_notify_state
+    AFTER INSERT OR UPDATE ON configurations
+    FOR EACH ROW EXECUTE FUNCTION notify_conversation_state();
@@ -0,0 +1,15 @@
+-- Stored chat responses per client idempotency key: a replayed request gets the
+-- same ChatResponse back instead of running (and paying for) the turn again.
+-- Keys are scoped to the conversation the request was sent to ('' for a request
+-- that starts a new conversation), so a key can never replay another
+-- conversation's response; rows older than IDEMPOTENCY_TTL_HOURS are purged.
+CREATE TABLE IF NOT EXISTS chat_idempotency (
+    scope TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    conversation_id UUID REFERENCES conversations(id) ON DELETE CASCADE,
+    response JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (scope, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_idempotency_created_at ON chat_idempotency(created_at);
@@ -0,0 +1,5 @@
+-- Back-navigation: while a user edits an earlier answer the conversation
+-- remembers the phase to return to, and the recommendation is stored with
+-- the configuration so unaffected edits (and PDF downloads) can reuse it
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS resume_phase TEXT;
+ALTER TABLE configurations ADD COLUMN IF NOT EXISTS recommendation TEXT;
@@ -0,0 +1,17 @@
+-- Free-text answers accepted while the LLM was unavailable (circuit open):
+-- stored as written and queued here for the LLM to extract once it is back
+CREATE TABLE IF NOT EXISTS enrichment_queue (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    conversation_id UUID REFERENCES conversations(id) ON DELETE CASCADE,
+    phase TEXT NOT NULL,
+    user_message TEXT NOT NULL,
+    provisional JSONB NOT NULL, -- Columns as saved from the raw answer
+    status TEXT DEFAULT 'pending', -- pending | running | done | dead
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    done_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_enrichment_queue_due ON enrichment_queue(next_attempt_at) WHERE status IN ('pending', 'running');
@@ -0,0 +1,76 @@
+-- One row per LLM call, written in batches by the usage ledger. No foreign
+-- key on conversation_id: a ledger batch must never be rejected as a whole
+CREATE TABLE IF NOT EXISTS llm_usage (
+    id BIGSERIAL PRIMARY KEY,
+    conversation_id UUID,
+    phase TEXT,
+    purpose TEXT NOT NULL, -- validation | embedding | recommendation
+    model TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms INTEGER NOT NULL,
+    outcome TEXT NOT NULL, -- ok | complete | incomplete (validation) | error
+    trace_id TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_usage_conversation ON llm_usage(conversation_id);
+CREATE INDEX IF NOT EXISTS idx_llm_usage_created_at ON llm_usage(created_at);
+
+-- USD per million tokens; edit when the provider's pricing changes
+CREATE TABLE IF NOT EXISTS llm_prices (
+    model TEXT PRIMARY KEY,
+    prompt_per_million NUMERIC NOT NULL,
+    cached_prompt_per_million NUMERIC NOT NULL,
+    completion_per_million NUMERIC NOT NULL
+);
+
+INSERT INTO llm_prices (model, prompt_per_million, cached_prompt_per_million, completion_per_million) VALUES
+    ('gpt-4o', 2.50, 1.25, 10.00),
+    ('text-embedding-3-small', 0.02, 0.02, 0)
+ON CONFLICT (model) DO NOTHING;
+
+-- Cost of each call (cached prompt tokens billed at the cached rate)
+CREATE OR REPLACE VIEW llm_usage_cost AS
+SELECT
+    u.*,
+    (
+        (u.prompt_tokens - u.cached_prompt_tokens) * COALESCE(p.prompt_per_million, 0)
+        + u.cached_prompt_tokens * COALESCE(p.cached_prompt_per_million, 0)
+        + u.completion_tokens * COALESCE(p.completion_per_million, 0)
+    ) / 1000000.0 AS cost_usd
+FROM llm_usage u
+LEFT JOIN llm_prices p ON p.model = u.model;
+
+-- Clarification loops per phase: validation calls that did not complete the phase
+CREATE OR REPLACE VIEW llm_phase_loops AS
+SELECT
+    phase,
+    COUNT(DISTINCT conversation_id) AS conversations,
+    COUNT(*) AS validation_calls,
+    COUNT(*) FILTER (WHERE outcome = 'incomplete') AS clarification_loops,
+    ROUND(COUNT(*)::numeric / NULLIF(COUNT(DISTINCT conversation_id), 0), 2) AS calls_per_conversation,
+    ROUND(AVG(prompt_tokens + completion_tokens)) AS avg_tokens,
+    ROUND(AVG(latency_ms)) AS avg_latency_ms,
+    PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY latency_ms) AS p95_latency_ms,
+    SUM(cost_usd) AS cost_usd
+FROM llm_usage_cost
+WHERE purpose = 'validation'
+GROUP BY phase;
+
+-- What a configuration cost, per conversation (status tells completed ones apart)
+CREATE OR REPLACE VIEW llm_conversation_cost AS
+SELECT
+    c.id AS conversation_id,
+    c.status,
+    COUNT(u.id) AS llm_calls,
+    COUNT(u.id) FILTER (WHERE u.purpose = 'validation' AND u.outcome = 'incomplete') AS clarification_loops,
+    COALESCE(SUM(u.prompt_tokens), 0) AS prompt_tokens,
+    COALESCE(SUM(u.cached_prompt_tokens), 0) AS cached_prompt_tokens,
+    COALESCE(SUM(u.completion_tokens), 0) AS completion_tokens,
+    COALESCE(SUM(u.latency_ms), 0) AS llm_latency_ms,
+    COALESCE(SUM(u.cost_usd), 0) AS cost_usd
+FROM conversations c
+JOIN llm_usage_cost u ON u.conversation_id = c.id
+GROUP BY c.id, c.status;
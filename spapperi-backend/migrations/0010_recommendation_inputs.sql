@@ -0,0 +1,4 @@
+-- Fingerprint of the answers a stored recommendation was generated from: a
+-- recommendation prefetched before the end of the conversation is only used
+-- if those answers are still the same
+ALTER TABLE configurations ADD COLUMN IF NOT EXISTS recommendation_inputs TEXT;
@@ -0,0 +1,51 @@
+-- Semantic cache of generated recommendations: a new configuration whose RAG
+-- query embeds close to a cached one (same root type, row type, raised bed,
+-- mulch and accessory set) reuses or adapts the cached text instead of a
+-- fresh retrieval + gpt-4o generation
+CREATE TABLE IF NOT EXISTS recommendation_cache (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    query TEXT NOT NULL,
+    config_key TEXT NOT NULL, -- Categorical answers and sorted accessories (RecommendationCache.config_key)
+    embedding vector(1536) NOT NULL,
+    recommendation TEXT NOT NULL,
+    source_conversation_id UUID,
+    hits INTEGER DEFAULT 0,
+    last_hit_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Lookups scan the entries of one key exactly: a vector index post-filtered
+-- on the key can miss matching entries when other keys crowd its candidates
+CREATE INDEX IF NOT EXISTS idx_recommendation_cache_config_key ON recommendation_cache(config_key);
+
+-- Audit trail: every lookup with the similarity found and the thresholds in force
+CREATE TABLE IF NOT EXISTS recommendation_cache_lookups (
+    id BIGSERIAL PRIMARY KEY,
+    conversation_id UUID,
+    cache_id UUID, -- Nearest entry with the same key, if any
+    similarity REAL,
+    decision TEXT NOT NULL, -- reuse | adapt | miss
+    reuse_threshold REAL NOT NULL,
+    adapt_threshold REAL NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_recommendation_cache_lookups_created_at ON recommendation_cache_lookups(created_at);
+
+-- Hit rate per day and how close the misses came (to tune the thresholds)
+CREATE OR REPLACE VIEW recommendation_cache_hit_rate AS
+SELECT
+    date_trunc('day', created_at) AS day,
+    COUNT(*) AS lookups,
+    COUNT(*) FILTER (WHERE decision = 'reuse') AS reused,
+    COUNT(*) FILTER (WHERE decision = 'adapt') AS adapted,
+    COUNT(*) FILTER (WHERE decision = 'miss') AS misses,
+    ROUND(COUNT(*) FILTER (WHERE decision <> 'miss')::numeric / NULLIF(COUNT(*), 0), 3) AS hit_rate,
+    PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY similarity) FILTER (WHERE decision = 'miss') AS median_miss_similarity,
+    MAX(similarity) FILTER (WHERE decision = 'miss') AS best_miss_similarity
+FROM recommendation_cache_lookups
+GROUP BY 1;
+
+INSERT INTO llm_prices (model, prompt_per_million, cached_prompt_per_million, completion_per_million) VALUES
+    ('gpt-4o-mini', 0.15, 0.075, 0.60)
+ON CONFLICT (model) DO NOTHING;
@@ -50,7 +50,8 @@ async def main():
     print("Generating embeddings...")
     embeddings_model = OpenAIEmbeddings(
         model="text-embedding-3-small",
-        api_key=OPENAI_API_KEY
+        api_key=OPENAI_API_KEY,
+        base_url=os.getenv("OPENAI_BASE_URL") or None
     )
     
     # Batch processing for embeddings/insertion to avoid potential limits/timeouts
@@ -0,0 +1,382 @@
+"""
+Load generator driving complete configurator conversations through /api/chat.
+
+Meant to run against a local backend + Postgres with the LLM stubbed:
+    python scripts/openai_stub.py
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=stub uvicorn main:app
+    python scripts/loadtest.py --stages 1,5,10,25 --stage-duration 60 --corpus mixed
+
+Each virtual user starts a conversation, answers whatever phase the backend
+asks with a scripted answer and repeats until the conversation completes.
+Corpora:
+    valid    every answer is accepted at the first attempt
+    invalid  every phase is first answered with a rejected answer, then a valid one
+    mixed    like invalid, but only for a share of phases (--invalid-rate)
+
+Per stage, the report holds per-phase p50/p95/p99 latency and error counts,
+completion-turn duration, throughput and DB pool saturation (sampled from
+/api/health/db). Reports are JSON; pass --compare to diff against an older one.
+"""
+import os
+import sys
+import json
+import time
+import math
+import uuid
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# Valid answers per phase; each virtual user picks one variant per phase.
+# The two branches of phase_2_2 depend on the row type chosen in phase_2_1.
+VALID_ANSWERS = {
+    "phase_1_1": ["pomodori", "insalata", "fragole", "peperoni", "cavolfiori"],
+    "phase_1_2": ["Zolla Cubica", "Zolla Conica", "Radice Nuda", "Zolla Piramidale"],
+    "phase_1_3": ["A=3, B=3, C=4, D=5", "A=4 B=4 C=5 D=6", "3, 3, 4, 5"],
+    "phase_2_1": ["File binate", "File singole"],
+    "phase_2_2_twin": ["4 bine, IF 120, IP 30, IB 25", "2 bine, IF 140, IP 35, IB 30"],
+    "phase_2_2_single": ["3 file, IF 75, IP 30", "2 file, IF 90, IP 25"],
+    "phase_3_1": ["Campo aperto", "Serra"],
+    "phase_3_2": ["No", "Sì, AT 20, LT 80, IT 120, ST 40"],
+    "phase_3_3": ["No", "Sì, LP 120"],
+    "phase_3_4": ["Argilloso", "Sabbioso"],
+    "phase_4_1": ["150", "180 cm", "140"],
+    "phase_4_2": ["80", "100 HP", "65"],
+    "phase_5_1": ["Nessuno", "Spandiconcime", "Spandiconcime, Ripiani supplementari"],
+    "phase_5_2": ["Nessuno", "Tracciatori fila idraulici"],
+    "phase_5_3": ["Nessuno", "Microgranulatore, Rullo in gomma"],
+    "phase_6_1": ["No", "Consegna entro marzo"],
+    "phase_6_2": ["Sì", "No"],
+    "phase_6_3": ["IT01234567890 loadtest@example.com"],
+}
+
+INVALID_ANSWERS = {
+    "phase_1_1": ["boh"],
+    "phase_1_2": ["non lo so"],
+    "phase_1_3": ["circa 3 cm", "A=3, B=3"],
+    "phase_2_1": ["dipende"],
+    "phase_2_2_twin": ["120 cm"],
+    "phase_2_2_single": ["120 cm"],
+    "phase_3_1": ["boh"],
+    "phase_3_2": ["sì"],
+    "phase_3_3": ["sì"],
+    "phase_3_4": ["normale"],
+    "phase_4_1": ["larghe"],
+    "phase_4_2": ["abbastanza"],
+    "phase_5_1": ["?"],
+    "phase_5_2": ["?"],
+    "phase_5_3": ["?"],
+    "phase_6_1": ["?"],
+    "phase_6_2": ["forse"],
+    "phase_6_3": ["non voglio"],
+}
+
+MAX_TURNS = 80
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(latencies),
+        "mean_ms": round(sum(latencies) / len(latencies), 1) if latencies else None,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies) if latencies else None,
+    }
+
+
+class StageStats:
+    """Measurements collected while one concurrency level is running"""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.rejections: Dict[str, int] = defaultdict(int)
+        self.completion: List[float] = []
+        self.conversation_durations: List[float] = []
+        self.conversations_completed = 0
+        self.conversations_failed = 0
+        self.pool_samples: List[Dict[str, Any]] = []
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    def pool_report(self) -> Dict[str, Any]:
+        samples = self.pool_samples
+        if not samples:
+            return {}
+        in_use = [s["size"] - s["idle"] for s in samples]
+        saturated = [s for s in samples if s["size"] >= s["max_size"] and s["idle"] == 0]
+        return {
+            "samples": len(samples),
+            "max_size": samples[-1]["max_size"],
+            "in_use_peak": max(in_use),
+            "in_use_mean": round(sum(in_use) / len(in_use), 2),
+            "saturated_ratio": round(len(saturated) / len(samples), 3),
+            "acquire_wait_avg_ms": samples[-1].get("acquire_wait_avg_ms"),
+            "acquire_wait_max_ms": samples[-1].get("acquire_wait_max_ms"),
+        }
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        turns = sum(len(v) for v in self.latencies.values())
+        errors = sum(self.errors.values())
+        return {
+            "concurrency": self.concurrency,
+            "duration_s": round(elapsed, 1),
+            "turns": turns,
+            "turns_per_s": round(turns / elapsed, 2) if elapsed else None,
+            "errors": errors,
+            "error_rate": round(errors / (turns + errors), 4) if turns + errors else 0.0,
+            "conversations_completed": self.conversations_completed,
+            "conversations_failed": self.conversations_failed,
+            "conversation_duration": summarize(self.conversation_durations),
+            "completion_turn": summarize(self.completion),
+            "phases": {
+                phase: {
+                    **summarize(self.latencies[phase]),
+                    "errors": self.errors.get(phase, 0),
+                    "rejections": self.rejections.get(phase, 0),
+                }
+                for phase in sorted(set(self.latencies) | set(self.errors))
+            },
+            "db_pool": self.pool_report(),
+        }
+
+
+class VirtualUser:
+    """Runs conversations back to back until told to stop"""
+
+    def __init__(self, client: httpx.AsyncClient, corpus: str, invalid_rate: float, rng: random.Random):
+        self.client = client
+        self.corpus = corpus
+        self.invalid_rate = invalid_rate
+        self.rng = rng
+
+    def _answer(self, phase: str, attempt: int, row_type: str) -> str:
+        key = phase
+        if phase == "phase_2_2":
+            key = "phase_2_2_single" if "singol" in row_type.lower() else "phase_2_2_twin"
+
+        wants_invalid = attempt == 0 and (
+            self.corpus == "invalid"
+            or (self.corpus == "mixed" and self.rng.random() < self.invalid_rate)
+        )
+        if wants_invalid and INVALID_ANSWERS.get(key):
+            return self.rng.choice(INVALID_ANSWERS[key])
+        # Retries of an invalid answer fall back to the valid corpus
+        return self.rng.choice(VALID_ANSWERS.get(key) or ["ok"])
+
+    async def _send(self, stats: StageStats, label: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        start = time.perf_counter()
+        try:
+            response = await self.client.post("/api/chat", json=payload)
+        except httpx.HTTPError:
+            stats.errors[label] += 1
+            return None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            stats.errors[label] += 1
+            return None
+        stats.latencies[label].append(round(elapsed_ms, 2))
+        return response.json()
+
+    async def conversation(self, stats: StageStats):
+        started = time.perf_counter()
+        reply = await self._send(stats, "greeting", {"message": "Ciao", "idempotency_key": str(uuid.uuid4())})
+        if reply is None:
+            stats.conversations_failed += 1
+            return
+
+        conversation_id = reply["conversation_id"]
+        phase = reply["current_phase"]
+        attempts: Dict[str, int] = defaultdict(int)
+        row_type = ""
+
+        for _ in range(MAX_TURNS):
+            answer = self._answer(phase, attempts[phase], row_type)
+            if phase == "phase_2_1":
+                row_type = answer
+
+            turn_start = time.perf_counter()
+            reply = await self._send(stats, phase, {
+                "message": answer,
+                "conversation_id": conversation_id,
+                "idempotency_key": str(uuid.uuid4()),
+            })
+            if reply is None:
+                stats.conversations_failed += 1
+                return
+
+            if reply.get("is_complete"):
+                stats.completion.append(round((time.perf_counter() - turn_start) * 1000, 2))
+                stats.conversation_durations.append(round((time.perf_counter() - started) * 1000, 2))
+                stats.conversations_completed += 1
+                return
+
+            if reply["current_phase"] == phase:
+                stats.rejections[phase] += 1
+            attempts[phase] += 1
+            phase = reply["current_phase"]
+
+        # Stuck on a phase: count it as a failed conversation
+        stats.conversations_failed += 1
+
+    async def run(self, stats: StageStats, deadline: float):
+        while time.monotonic() < deadline:
+            await self.conversation(stats)
+
+
+async def sample_pool(client: httpx.AsyncClient, stats: StageStats, stop: asyncio.Event, interval: float):
+    while not stop.is_set():
+        try:
+            response = await client.get("/api/health/db")
+            if response.status_code == 200:
+                stats.pool_samples.append(response.json())
+        except httpx.HTTPError:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_stage(args, concurrency: int, rng: random.Random) -> Dict[str, Any]:
+    stats = StageStats(concurrency)
+    limits = httpx.Limits(max_connections=concurrency + 2, max_keepalive_connections=concurrency + 2)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_pool(client, stats, stop, args.pool_interval))
+
+        deadline = time.monotonic() + args.stage_duration
+        users = [
+            VirtualUser(client, args.corpus, args.invalid_rate, random.Random(rng.random()))
+            for _ in range(concurrency)
+        ]
+        await asyncio.gather(*(user.run(stats, deadline) for user in users))
+
+        stats.finished = time.monotonic()
+        stop.set()
+        await sampler
+    return stats.report()
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_stage(stage: Dict[str, Any]):
+    print(
+        f"\n== concurrency {stage['concurrency']}: {stage['turns']} turns, "
+        f"{stage['turns_per_s']} turns/s, error rate {stage['error_rate']:.2%}, "
+        f"{stage['conversations_completed']} completed / {stage['conversations_failed']} failed"
+    )
+    print(f"{'phase':<12} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>5} {'rej':>5}")
+    for phase, s in stage["phases"].items():
+        print(
+            f"{phase:<12} {s['count']:>6} {s['p50_ms'] or 0:>8.0f} {s['p95_ms'] or 0:>8.0f} "
+            f"{s['p99_ms'] or 0:>8.0f} {s['errors']:>5} {s['rejections']:>5}"
+        )
+    completion = stage["completion_turn"]
+    if completion["count"]:
+        print(f"{'completion':<12} {completion['count']:>6} {completion['p50_ms']:>8.0f} "
+              f"{completion['p95_ms']:>8.0f} {completion['p99_ms']:>8.0f}")
+    pool = stage["db_pool"]
+    if pool:
+        print(f"db pool: peak {pool['in_use_peak']}/{pool['max_size']} in use, "
+              f"saturated {pool['saturated_ratio']:.0%} of samples, "
+              f"acquire wait max {pool['acquire_wait_max_ms']} ms")
+
+
+def compare(report: Dict[str, Any], baseline_path: str):
+    """Print p95 deltas per phase against an earlier report, stage by stage"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    old_stages = {s["concurrency"]: s for s in baseline.get("stages", [])}
+    print(f"\n== compared with {baseline_path} ({baseline.get('meta', {}).get('label')})")
+    for stage in report["stages"]:
+        old = old_stages.get(stage["concurrency"])
+        if not old:
+            continue
+        print(f"concurrency {stage['concurrency']}: error rate {old['error_rate']:.2%} -> {stage['error_rate']:.2%}")
+        for phase, s in stage["phases"].items():
+            before = old["phases"].get(phase, {}).get("p95_ms")
+            after = s["p95_ms"]
+            if before and after:
+                print(f"  {phase:<12} p95 {before:>8.0f} -> {after:>8.0f} ms ({(after - before) / before:+.1%})")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Drive full configurator conversations against /api/chat")
+    parser.add_argument("--url", default=os.getenv("LOADTEST_URL", "http://localhost:8000"))
+    parser.add_argument("--corpus", choices=["valid", "invalid", "mixed"], default="valid")
+    parser.add_argument("--invalid-rate", type=float, default=0.3, help="share of phases answered wrongly first (mixed)")
+    parser.add_argument("--stages", default="1,5,10", help="comma-separated concurrency levels, ramped in order")
+    parser.add_argument("--stage-duration", type=float, default=60, help="seconds per stage")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--pool-interval", type=float, default=0.5, help="seconds between pool samples")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default=None, help="release/build label stored in the report")
+    parser.add_argument("--out", default=None, help="report path (default: loadtest-<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="earlier report to diff against")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stages = [int(s) for s in args.stages.split(",") if s.strip()]
+    started_at = datetime.now(timezone.utc)
+
+    results = []
+    for concurrency in stages:
+        print(f"Running {concurrency} concurrent conversations for {args.stage_duration:.0f}s...")
+        stage = await run_stage(args, concurrency, rng)
+        print_stage(stage)
+        results.append(stage)
+
+    report = {
+        "meta": {
+            "label": args.label or _git_revision(),
+            "started_at": started_at.isoformat(),
+            "url": args.url,
+            "corpus": args.corpus,
+            "invalid_rate": args.invalid_rate if args.corpus == "mixed" else None,
+            "stage_duration_s": args.stage_duration,
+            "seed": args.seed,
+        },
+        "stages": results,
+    }
+
+    out = args.out or f"loadtest-{started_at.strftime('%Y%m%dT%H%M%SZ')}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {out}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+    # Non-zero exit when any request failed, for CI
+    return 1 if any(stage["errors"] for stage in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,39 @@
+"""
+Run or inspect schema migrations outside the app boot.
+
+Usage:
+    python scripts/migrate.py            # apply pending migrations
+    python scripts/migrate.py status     # list applied / pending / modified
+"""
+import asyncio
+import os
+import sys
+
+import asyncpg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.migrations import migration_runner
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+if not DATABASE_URL:
+    print("Error: DATABASE_URL not set")
+    sys.exit(1)
+
+
+async def main(command: str):
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        if command == "status":
+            for m in await migration_runner.status(conn):
+                print(f"{m['version']:04d}_{m['name']:<45} {m['status']}")
+        else:
+            applied = await migration_runner.migrate(conn)
+            print(f"Applied {len(applied)} migrations" if applied else "Schema is up to date")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "up"))
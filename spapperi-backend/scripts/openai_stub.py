@@ -0,0 +1,453 @@
+"""
+Local OpenAI-compatible stand-in for load tests, benchmarks and CI.
+
+Serves /v1/chat/completions (JSON mode and streaming) and /v1/embeddings
+without network access or cost. Run it, then start the backend with:
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=stub
+
+Validator calls are answered deterministically per phase: the stub reads the
+**FASE** and the user's answer from the prompt and extracts the same fields
+the real model is asked for, rejecting answers that are missing values or
+implausible. Embeddings are hashed bag-of-words vectors, so similar texts get
+similar vectors and retrieval behaves sensibly.
+
+Tuning (environment, or POST /stub/config at runtime with the same keys lowercased):
+    OPENAI_STUB_LATENCY_MS      median latency per endpoint, e.g. "chat=800,embeddings=60"
+    OPENAI_STUB_LATENCY_SIGMA   lognormal spread (0 = fixed latency)
+    OPENAI_STUB_ERROR_RATE      share of requests failing (0..1)
+    OPENAI_STUB_ERROR_CODES     status codes to fail with, e.g. "429,500,503"
+"""
+import os
+import re
+import json
+import time
+import math
+import random
+import asyncio
+import hashlib
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+HOST = os.getenv("OPENAI_STUB_HOST", "127.0.0.1")
+PORT = int(os.getenv("OPENAI_STUB_PORT", 8100))
+
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def _parse_latency(spec: str) -> Dict[str, float]:
+    latency = {"chat": 800.0, "embeddings": 60.0}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        endpoint, _, value = part.partition("=")
+        latency[endpoint.strip()] = float(value)
+    return latency
+
+
+config = {
+    "latency_ms": _parse_latency(os.getenv("OPENAI_STUB_LATENCY_MS", "")),
+    "latency_sigma": float(os.getenv("OPENAI_STUB_LATENCY_SIGMA", 0.4)),
+    "error_rate": float(os.getenv("OPENAI_STUB_ERROR_RATE", 0)),
+    "error_codes": [int(c) for c in os.getenv("OPENAI_STUB_ERROR_CODES", "429,500,503").split(",")],
+}
+stats = Counter()
+
+app = FastAPI(title="OpenAI stub")
+
+
+# === FAULTS & LATENCY ===
+
+async def _simulate(endpoint: str) -> Optional[JSONResponse]:
+    """Sleep for a sampled latency; return an error response if one is injected"""
+    stats[f"{endpoint}_requests"] += 1
+    median = config["latency_ms"].get(endpoint, 0.0)
+    if median > 0:
+        sigma = config["latency_sigma"]
+        delay = median * math.exp(random.gauss(0, sigma)) if sigma else median
+        await asyncio.sleep(delay / 1000)
+
+    if config["error_rate"] and random.random() < config["error_rate"]:
+        status = random.choice(config["error_codes"])
+        stats[f"{endpoint}_errors_{status}"] += 1
+        headers = {"retry-after": "1"} if status == 429 else None
+        return JSONResponse(
+            {"error": {"message": "Injected failure", "type": "stub_error", "code": status}},
+            status_code=status,
+            headers=headers
+        )
+    return None
+
+
+def _count_tokens(text: str) -> int:
+    # Roughly four characters per token, close enough for usage accounting
+    return max(1, len(text) // 4)
+
+
+# === VALIDATOR ANSWERS ===
+
+NUMBER = re.compile(r"-?\d+(?:[.,]\d+)?")
+EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+VAT = re.compile(r"\b(?:IT)?\s?(\d{11})\b", re.IGNORECASE)
+UNKNOWN = ("non lo so", "boh", "non so", "?")
+
+
+def _numbers(text: str) -> List[float]:
+    values = []
+    for raw in NUMBER.findall(text):
+        value = float(raw.replace(",", "."))
+        values.append(int(value) if value.is_integer() else value)
+    return values
+
+
+def _labelled(text: str, labels: List[str]) -> Dict[str, float]:
+    """Values given as 'A=3', 'IF 120', 'LP: 90'..."""
+    found = {}
+    for label in labels:
+        match = re.search(rf"\b{label}\b\s*[=:]?\s*(\d+(?:[.,]\d+)?)", text, re.IGNORECASE)
+        if match:
+            value = float(match.group(1).replace(",", "."))
+            found[label] = int(value) if value.is_integer() else value
+    return found
+
+
+def _measures(text: str, labels: List[str]) -> Dict[str, float]:
+    """Labelled values, falling back to positional numbers when no labels are used"""
+    found = _labelled(text, labels)
+    if not found:
+        found = dict(zip(labels, _numbers(text)))
+    return found
+
+
+def _is_no(text: str) -> bool:
+    return bool(re.match(r"^\s*(no|nessun[oa]?|niente)\b", text, re.IGNORECASE))
+
+
+def _is_yes(text: str) -> bool:
+    return bool(re.match(r"^\s*(s[iì]|yes|certo|ok)\b", text, re.IGNORECASE))
+
+
+def _choice(text: str, options: Dict[str, str]) -> Optional[str]:
+    lowered = text.lower()
+    for keyword, option in options.items():
+        if keyword in lowered:
+            return option
+    return None
+
+
+def _missing(message: str) -> Tuple[bool, None, str]:
+    return False, None, message
+
+
+def validate_answer(phase: str, answer: str, expected_format: str) -> Tuple[bool, Optional[dict], Optional[str]]:
+    """Deterministic stand-in for the validator model"""
+    text = answer.strip()
+    if not text or text.lower() in UNKNOWN:
+        return _missing("Non ho capito la risposta. Puoi essere più preciso?")
+
+    if phase == "phase_1_1":
+        # The crop is the leading words; answers given ahead may follow
+        crop = re.split(r"[,;]|\s(?:a|con|su|in)\s", text)[0].strip()
+        if len(crop) < 3 or _numbers(crop):
+            return _missing("Indica il nome della coltura da trapiantare.")
+        return True, {"crop_type": crop}, None
+
+    if phase == "phase_1_2":
+        root = _choice(text, {"nud": "Radice Nuda", "cubic": "Zolla Cubica", "conic": "Zolla Conica", "piramid": "Zolla Piramidale"})
+        if not root:
+            return _missing("Devi scegliere tra le 4 opzioni")
+        return True, {"root_type": root}, None
+
+    if phase == "phase_1_3":
+        dims = _measures(text, ["A", "B", "C", "D"])
+        missing = [k for k in "ABCD" if k not in dims]
+        if missing:
+            return _missing(f"Mancano i valori {', '.join(missing)}")
+        if any(not 0 < v <= 50 for v in dims.values()):
+            return _missing("Le dimensioni della zolla devono essere comprese tra 0 e 50 cm.")
+        return True, dims, None
+
+    if phase == "phase_2_1":
+        row_type = _choice(text, {"singol": "File singole", "binat": "File binate"})
+        if not row_type:
+            return _missing("Scegli tra file singole o file binate.")
+        return True, {"row_type": row_type}, None
+
+    if phase == "phase_2_2":
+        twin = expected_format.startswith("4")
+        labels = ["number_of_rows", "IF", "IP", "IB"] if twin else ["number_of_rows", "IF", "IP"]
+        values = _labelled(text, labels[1:])
+        numbers = _numbers(text)
+        if not values:
+            values = dict(zip(labels, numbers))
+        elif numbers:
+            values.setdefault("number_of_rows", numbers[0])
+        missing = [k for k in labels if k not in values]
+        if missing:
+            return _missing(f"Servono anche: {', '.join(missing)}")
+        if not 1 <= values["number_of_rows"] <= 12 or not 20 <= values["IF"] <= 300:
+            return _missing("Numero file o interfila non plausibili.")
+        return True, values, None
+
+    if phase == "phase_3_1":
+        environment = _choice(text, {"serra": "Serra", "aperto": "Campo aperto", "campo": "Campo aperto"})
+        if not environment:
+            return _missing("Campo aperto o serra?")
+        return True, {"environment": environment}, None
+
+    if phase == "phase_3_2":
+        if _is_no(text):
+            return True, {"is_raised_bed": False}, None
+        bed = _measures(text, ["AT", "LT", "IT", "ST"])
+        if len(bed) < 4:
+            return _missing("Servono AT, LT, IT e ST in cm.")
+        return True, {"is_raised_bed": True, **bed}, None
+
+    if phase == "phase_3_3":
+        if _is_no(text):
+            return True, {"is_mulch": False}, None
+        mulch = _measures(text, ["LP"])
+        if not mulch:
+            return _missing("Indica la larghezza del telo (LP) in cm.")
+        return True, {"is_mulch": True, **mulch}, None
+
+    if phase == "phase_3_4":
+        soil = _choice(text, {"argill": "Argilloso", "sabbi": "Sabbioso"})
+        if not soil:
+            return _missing("Argilloso o sabbioso?")
+        return True, {"soil_type": soil}, None
+
+    if phase == "phase_4_1":
+        numbers = _numbers(text)
+        if not numbers or not 50 <= numbers[0] <= 400:
+            return _missing("Indica la misura interna delle ruote in cm (50-400).")
+        return True, {"wheel_distance": numbers[0]}, None
+
+    if phase == "phase_4_2":
+        numbers = _numbers(text)
+        if not numbers or not 10 <= numbers[0] <= 500:
+            return _missing("Indica la potenza del trattore in HP (10-500).")
+        return True, {"tractor_hp": numbers[0]}, None
+
+    if phase in ("phase_5_1", "phase_5_2", "phase_5_3"):
+        if _is_no(text):
+            return True, {"accessories": []}, None
+        items = [item.strip() for item in re.split(r",|\be\b", text) if item.strip()]
+        return True, {"accessories": items}, None
+
+    if phase == "phase_6_1":
+        if _is_no(text):
+            return True, {"notes": None}, None
+        return True, {"notes": text}, None
+
+    if phase == "phase_6_2":
+        if _is_yes(text):
+            return True, {"interested_in_commercial_info_or_quote": "Sì"}, None
+        if _is_no(text):
+            return True, {"interested_in_commercial_info_or_quote": "No"}, None
+        return _missing("Rispondi Sì o No.")
+
+    if phase == "phase_6_3":
+        email = EMAIL.search(text)
+        vat = VAT.search(text)
+        if not email or not vat:
+            return _missing("Servono sia la Partita IVA (11 cifre) sia l'email.")
+        return True, {"email": email.group(0), "vat_number": vat.group(1)}, None
+
+    return True, {"raw": text}, None
+
+
+# Later phases the stub fills from an answer given ahead (multi-slot extraction).
+# Only unambiguous ones: choices recognised by keyword and fully labelled root dimensions.
+LOOKAHEAD_PHASES = ("phase_1_2", "phase_1_3", "phase_2_1", "phase_3_1", "phase_3_4")
+
+
+def additional_data(phases: List[str], answer: str) -> Dict[str, dict]:
+    """Data for later phases found in the answer, keyed by phase"""
+    found = {}
+    for phase in phases:
+        if phase not in LOOKAHEAD_PHASES:
+            continue
+        if phase == "phase_1_3" and len(_labelled(answer, ["A", "B", "C", "D"])) < 4:
+            continue
+        is_complete, extracted, _ = validate_answer(phase, answer, "")
+        if is_complete:
+            found[phase] = extracted
+    return found
+
+
+def _prompt_field(prompt: str, label: str) -> str:
+    match = re.search(rf"\*\*{re.escape(label)}\*\*:\s*\n?(.*?)(?:\n\*\*|\n\n|$)", prompt, re.DOTALL)
+    return match.group(1).strip() if match else ""
+
+
+def validator_reply(prompt: str) -> Dict[str, Any]:
+    phase = _prompt_field(prompt, "FASE")
+    expected_format = _prompt_field(prompt, "FORMATO RICHIESTO")
+    answer = _prompt_field(prompt, "RISPOSTA CORRENTE DELL'UTENTE").strip('"')
+
+    # Earlier answers of the same phase count too, like for the real validator
+    history = re.findall(r'^\d+\. "(.*)"$', prompt, re.MULTILINE)
+    if history and phase in ("phase_1_3", "phase_2_2", "phase_3_2"):
+        answer = " ".join(history + [answer])
+
+    is_complete, extracted, clarification = validate_answer(phase, answer, expected_format)
+    reply = {
+        "is_complete": is_complete,
+        "extracted_data": extracted,
+        "clarification_needed": clarification,
+    }
+    lookahead = re.findall(r"^- (phase_\d+_\d+): ", prompt, re.MULTILINE)
+    if lookahead:
+        reply["additional_data"] = additional_data(lookahead, answer)
+    return reply
+
+
+def recommendation_reply(prompt: str) -> str:
+    accessories = re.search(r"TOKEN ACCESSORI SELEZIONATI:\s*\n\s*(.*)", prompt)
+    accessories_text = accessories.group(1).strip() if accessories else "Nessun accessorio selezionato"
+    return (
+        "## Consiglio dell'Esperto\n\n"
+        "1. **Modello Identificato**: TC12AM, adatto alla coltura e al sesto indicati.\n"
+        f"2. **Configurazione Componenti**: {accessories_text}.\n"
+        "3. **Conclusione**: Configurazione coerente con le esigenze di trapianto.\n"
+    )
+
+
+# === ENDPOINTS ===
+
+def _completion_text(body: Dict[str, Any]) -> str:
+    messages = body.get("messages", [])
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+    if json_mode:
+        if "**FASE**" in prompt:
+            return json.dumps(validator_reply(prompt), ensure_ascii=False)
+        return json.dumps({}, ensure_ascii=False)
+    return recommendation_reply(prompt)
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    failure = await _simulate("chat")
+    if failure:
+        return failure
+
+    content = _completion_text(body)
+    prompt_text = "".join(str(m.get("content", "")) for m in body.get("messages", []))
+    completion_id = "chatcmpl-" + hashlib.sha1(prompt_text.encode("utf-8")).hexdigest()[:24]
+    created = int(time.time())
+    model = body.get("model", "gpt-4o")
+    usage = {
+        "prompt_tokens": _count_tokens(prompt_text),
+        "completion_tokens": _count_tokens(content),
+        "total_tokens": _count_tokens(prompt_text) + _count_tokens(content),
+    }
+
+    if body.get("stream"):
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+        async def events():
+            base = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model}
+            first = {"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}
+            yield f"data: {json.dumps({**base, 'choices': [first]})}\n\n"
+            for piece in re.findall(r"\S+\s*", content):
+                delta = {"index": 0, "delta": {"content": piece}, "finish_reason": None}
+                yield f"data: {json.dumps({**base, 'choices': [delta]}, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(0.005)
+            last = {"index": 0, "delta": {}, "finish_reason": "stop"}
+            yield f"data: {json.dumps({**base, 'choices': [last]})}\n\n"
+            if include_usage:
+                yield f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": usage,
+    }
+
+
+def embed(text: str, dimensions: int) -> List[float]:
+    """Hashed bag-of-words vector, L2-normalized"""
+    vector = [0.0] * dimensions
+    for token in re.findall(r"\w+", text.lower()):
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    failure = await _simulate("embeddings")
+    if failure:
+        return failure
+
+    model = body.get("model", "text-embedding-3-small")
+    dimensions = body.get("dimensions") or EMBEDDING_DIMENSIONS.get(model, 1536)
+    inputs = body.get("input", "")
+    if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+        inputs = [inputs]
+
+    data = []
+    prompt_tokens = 0
+    for index, item in enumerate(inputs):
+        # Clients like langchain send pre-tokenized input (lists of token ids)
+        text = " ".join(str(t) for t in item) if isinstance(item, list) else item
+        prompt_tokens += len(item) if isinstance(item, list) else _count_tokens(item)
+        data.append({"object": "embedding", "index": index, "embedding": embed(text, dimensions)})
+
+    return {
+        "object": "list",
+        "data": data,
+        "model": model,
+        "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+    }
+
+
+@app.get("/v1/models")
+async def models():
+    names = ["gpt-4o", *EMBEDDING_DIMENSIONS]
+    return {"object": "list", "data": [{"id": name, "object": "model", "owned_by": "stub"} for name in names]}
+
+
+@app.get("/stub/stats")
+async def stub_stats():
+    return {"config": config, "counters": dict(stats)}
+
+
+@app.post("/stub/config")
+async def stub_config(request: Request):
+    """Change latency/error injection while a test is running"""
+    update = await request.json()
+    if "latency_ms" in update:
+        config["latency_ms"].update({k: float(v) for k, v in update["latency_ms"].items()})
+    for key in ("latency_sigma", "error_rate"):
+        if key in update:
+            config[key] = float(update[key])
+    if "error_codes" in update:
+        config["error_codes"] = [int(c) for c in update["error_codes"]]
+    return config
+
+
+if __name__ == "__main__":
+    print(f"OpenAI stub listening on http://{HOST}:{PORT}/v1")
+    uvicorn.run(app, host=HOST, port=PORT, log_level="warning")
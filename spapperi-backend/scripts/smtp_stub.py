@@ -0,0 +1,61 @@
+"""
+Local SMTP stand-in for exercising the email outbox without a real server.
+
+Needs aiosmtpd from requirements-dev.txt. Run it, then start the backend with:
+    EMAIL_HOST=localhost EMAIL_PORT=1025 EMAIL_FROM=noreply@spapperi.local
+
+Ports other than 465/587 use plain SMTP, and no login is attempted when
+EMAIL_USER/EMAIL_PASSWORD are unset. Set SMTP_STUB_FAIL_RATE (0..1) to make the
+stub reject a share of messages and watch retries and dead-lettering.
+"""
+import asyncio
+import os
+import random
+from email import message_from_bytes
+
+from aiosmtpd.controller import Controller
+
+HOST = os.getenv("SMTP_STUB_HOST", "127.0.0.1")
+PORT = int(os.getenv("SMTP_STUB_PORT", 1025))
+FAIL_RATE = float(os.getenv("SMTP_STUB_FAIL_RATE", 0))
+
+
+class PrintingHandler:
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        if FAIL_RATE and random.random() < FAIL_RATE:
+            print(f"✗ Rejected message to {envelope.rcpt_tos} (injected failure)")
+            return "451 Requested action aborted: injected failure"
+
+        self.received += 1
+        message = message_from_bytes(envelope.content)
+        attachments = [
+            part.get_filename()
+            for part in message.walk()
+            if part.get_content_disposition() == "attachment"
+        ]
+        print(
+            f"✓ #{self.received} from={envelope.mail_from} to={envelope.rcpt_tos} "
+            f"subject={message['Subject']!r} attachments={attachments} "
+            f"size={len(envelope.content)} bytes"
+        )
+        return "250 Message accepted for delivery"
+
+
+async def main():
+    controller = Controller(PrintingHandler(), hostname=HOST, port=PORT)
+    controller.start()
+    print(f"SMTP stub listening on {HOST}:{PORT}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
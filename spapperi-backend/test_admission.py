@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+
+from app.services.admission import AdmissionController, AdmissionRejected, ClientRateLimiter, LLMGate
+
+
+def make_controller(trusted="172.16.0.0/12", rate=1.0, burst=2, **gate):
+    return AdmissionController(
+        limiter=ClientRateLimiter(rate=rate, burst=burst),
+        gate=LLMGate(**gate),
+        trusted_proxies=trusted,
+    )
+
+
+# === client_key ===
+
+def test_client_key_untrusted_peer_ignores_forwarded_for():
+    controller = make_controller()
+    assert controller.client_key("203.0.113.7", "198.51.100.1") == "203.0.113.7"
+
+
+def test_client_key_trusted_peer_uses_forwarded_client():
+    controller = make_controller()
+    assert controller.client_key("172.18.0.3", "198.51.100.1") == "198.51.100.1"
+
+
+def test_client_key_ignores_hops_prepended_by_the_client():
+    # The browser sent its own X-Forwarded-For; the hop appended in front of
+    # the proxy is the real client and must win over the spoofed ones
+    controller = make_controller(trusted="172.16.0.0/12,10.0.0.5")
+    spoofed = "1.2.3.4, 5.6.7.8, 198.51.100.1, 10.0.0.5"
+    assert controller.client_key("172.18.0.3", spoofed) == "198.51.100.1"
+    other_spoof = "9.9.9.9, 198.51.100.1, 10.0.0.5"
+    assert controller.client_key("172.18.0.3", other_spoof) == "198.51.100.1"
+
+
+def test_client_key_spoofing_does_not_get_a_fresh_bucket():
+    controller = make_controller(burst=2)
+    peer = "172.18.0.3"
+    for spoof in ("1.1.1.1", "2.2.2.2"):
+        controller.check_client(controller.client_key(peer, f"{spoof}, 198.51.100.1"), "chat")
+    with pytest.raises(AdmissionRejected):
+        controller.check_client(controller.client_key(peer, "3.3.3.3, 198.51.100.1"), "chat")
+
+
+def test_client_key_spoofed_header_is_ignored_in_the_compose_setup():
+    # docker-compose.yml trusts only the frontend container; the compose
+    # gateway (requests to the published backend port) is not a proxy
+    controller = make_controller(trusted="172.28.0.10")
+    frontend, gateway = "172.28.0.10", "172.28.0.1"
+
+    direct = controller.client_key(gateway, "9.9.9.9")
+    assert direct == controller.client_key(gateway, "8.8.8.8") == gateway
+    assert controller.client_key(gateway, None) == gateway
+
+    # Through the frontend the edge proxy's address is the last hop
+    assert controller.client_key(frontend, "198.51.100.1") == "198.51.100.1"
+    assert controller.client_key(frontend, "9.9.9.9, 198.51.100.1") == "198.51.100.1"
+    assert controller.client_key(frontend, "8.8.8.8, 198.51.100.1") == "198.51.100.1"
+
+
+def test_client_key_only_proxies_in_chain():
+    controller = make_controller(trusted="172.16.0.0/12,10.0.0.0/8")
+    assert controller.client_key("172.18.0.3", "10.0.0.9, 10.0.0.5") == "10.0.0.9"
+
+
+def test_client_key_without_header_or_peer():
+    controller = make_controller()
+    assert controller.client_key("172.18.0.3", None) == "172.18.0.3"
+    assert controller.client_key("172.18.0.3", " , ") == "172.18.0.3"
+    assert controller.client_key(None, "198.51.100.1") == "unknown"
+
+
+# === token bucket ===
+
+def test_rate_limiter_allows_burst_then_rejects(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("app.services.admission.time.monotonic", lambda: now[0])
+    limiter = ClientRateLimiter(rate=1.0, burst=3)
+    for _ in range(3):
+        limiter.check("a")
+    with pytest.raises(AdmissionRejected) as excinfo:
+        limiter.check("a")
+    assert excinfo.value.reason == "rate_limited"
+    assert excinfo.value.retry_after_header == "1"
+    # Other clients have their own bucket
+    limiter.check("b")
+
+
+def test_rate_limiter_refills_over_time(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("app.services.admission.time.monotonic", lambda: now[0])
+    limiter = ClientRateLimiter(rate=2.0, burst=1)
+    limiter.check("a")
+    with pytest.raises(AdmissionRejected):
+        limiter.check("a")
+    now[0] += 0.5
+    limiter.check("a")
+
+
+def test_rate_limiter_prunes_full_buckets(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("app.services.admission.time.monotonic", lambda: now[0])
+    limiter = ClientRateLimiter(rate=1.0, burst=2, max_clients=2)
+    limiter.check("a")
+    limiter.check("b")
+    now[0] += 10
+    limiter.check("c")
+    assert limiter.clients == 1
+
+
+def test_rate_limiter_disabled_with_zero_rate():
+    limiter = ClientRateLimiter(rate=0, burst=0)
+    for _ in range(100):
+        limiter.check("a")
+
+
+# === LLM gate ===
+
+@pytest.mark.asyncio
+async def test_gate_rejects_when_queue_is_full():
+    controller = make_controller(max_in_flight=1, max_queue=0)
+    async with controller.llm_slot("chat"):
+        with pytest.raises(AdmissionRejected) as excinfo:
+            async with controller.llm_slot("chat"):
+                pass
+    assert excinfo.value.reason == "queue_full"
+    assert controller.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_gate_times_out_queued_request():
+    controller = make_controller(max_in_flight=1, max_queue=1, queue_timeout=0.01)
+    async with controller.llm_slot("chat"):
+        with pytest.raises(AdmissionRejected) as excinfo:
+            async with controller.llm_slot("chat"):
+                pass
+    assert excinfo.value.reason == "queue_timeout"
+    assert controller.stats()["queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_gate_queued_request_gets_released_slot():
+    controller = make_controller(max_in_flight=1, max_queue=1, queue_timeout=1.0)
+    order = []
+
+    async def turn(name, hold):
+        async with controller.llm_slot("chat"):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    await asyncio.gather(turn("first", 0.02), turn("second", 0))
+    assert order == ["first", "second"]
+    assert controller.stats()["in_flight"] == 0
@@ -0,0 +1,98 @@
+import pytest
+
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.services.circuit_breaker.time.monotonic", lambda: now[0])
+    return now
+
+
+async def succeed(breaker):
+    async with breaker.call():
+        pass
+
+
+async def fail(breaker):
+    with pytest.raises(RuntimeError):
+        async with breaker.call():
+            raise RuntimeError("provider error")
+
+
+@pytest.mark.asyncio
+async def test_stays_closed_below_min_calls(clock):
+    breaker = CircuitBreaker("test", min_calls=3, failure_rate=0.5)
+    await fail(breaker)
+    await fail(breaker)
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_opens_on_failure_rate_and_refuses_calls(clock):
+    breaker = CircuitBreaker("test", min_calls=4, failure_rate=0.5)
+    await succeed(breaker)
+    await succeed(breaker)
+    await fail(breaker)
+    assert breaker.state == CLOSED
+    await fail(breaker)
+    assert breaker.state == OPEN
+    assert breaker.is_open
+    with pytest.raises(CircuitOpen):
+        async with breaker.call():
+            pytest.fail("body must not run while open")
+    assert breaker.rejected == 1
+    assert breaker.times_opened == 1
+
+
+def test_opens_on_slow_calls(clock):
+    breaker = CircuitBreaker("test", min_calls=2, slow_call_seconds=5, slow_call_rate=1.0)
+    breaker._record(False, 6.0, probe=False)
+    breaker._record(False, 7.0, probe=False)
+    assert breaker.state == OPEN
+
+
+@pytest.mark.asyncio
+async def test_half_open_probe_success_closes(clock):
+    breaker = CircuitBreaker("test", min_calls=1, failure_rate=0.5, open_seconds=30)
+    await fail(breaker)
+    clock[0] += 30
+    assert breaker.state == HALF_OPEN
+    assert not breaker.is_open
+    await succeed(breaker)
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker("test", min_calls=1, failure_rate=0.5, open_seconds=30)
+    await fail(breaker)
+    clock[0] += 30
+    await fail(breaker)
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 2
+
+
+@pytest.mark.asyncio
+async def test_only_one_probe_at_a_time(clock):
+    breaker = CircuitBreaker("test", min_calls=1, failure_rate=0.5, open_seconds=30)
+    await fail(breaker)
+    clock[0] += 30
+    async with breaker.call():
+        assert breaker.is_open
+        with pytest.raises(CircuitOpen):
+            async with breaker.call():
+                pass
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_calls_started_before_opening_are_ignored(clock):
+    breaker = CircuitBreaker("test", min_calls=1, failure_rate=0.5, open_seconds=30)
+    async with breaker.call():
+        # Another call trips the circuit while this one is in flight
+        await fail(breaker)
+    # The late success neither closes the circuit nor enters the new window
+    assert breaker.state == OPEN
+    assert breaker.stats()["window_calls"] == 0
@@ -0,0 +1,104 @@
+import os
+import uuid
+
+import pytest
+import pytest_asyncio
+
+from app.services.db import db
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+needs_db = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to a scratch database")
+
+
+@pytest_asyncio.fixture
+async def pool(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    await db.initialize()
+    yield db.pool
+    await db.close()
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_warmed_connections_are_idle_outside_a_transaction(pool):
+    # Regression: the warmup left each connection inside an implicit
+    # transaction, so NOW() stayed frozen at pool start on that connection
+    connections = [await pool.acquire() for _ in range(pool.get_min_size())]
+    try:
+        started = await connections[0].fetchval("SELECT clock_timestamp()")
+        for conn in connections:
+            assert not conn.is_in_transaction()
+            assert await conn.fetchval("SELECT NOW() >= $1", started)
+    finally:
+        for conn in connections:
+            await pool.release(conn)
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_codecs_return_plain_python_values(pool):
+    async with db.acquire() as conn:
+        assert await conn.fetchval("SELECT $1::jsonb", {"A": 4}) == {"A": 4}
+        assert await conn.fetchval("SELECT '[1,2]'::json") == [1, 2]
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_idempotency_keys_are_scoped_to_the_conversation(pool):
+    key = str(uuid.uuid4())
+    first = await db.create_conversation()
+    other = await db.create_conversation()
+    await db.save_idempotent_response(key, str(first), first, {"conversation_id": str(first)})
+    
+    assert await db.get_idempotent_response(key, str(first)) == {"conversation_id": str(first)}
+    # The same key sent to another (or a new) conversation must not replay it
+    assert await db.get_idempotent_response(key, str(other)) is None
+    assert await db.get_idempotent_response(key, None) is None
+    
+    await db.save_idempotent_response(key, str(other), other, {"conversation_id": str(other)})
+    assert await db.get_idempotent_response(key, str(other)) == {"conversation_id": str(other)}
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_expired_idempotency_keys_are_ignored_and_purged(pool):
+    old, new = str(uuid.uuid4()), str(uuid.uuid4())
+    conv_id = await db.create_conversation()
+    await db.save_idempotent_response(old, None, conv_id, {"n": 1})
+    async with db.acquire() as conn:
+        await conn.execute(
+            "UPDATE chat_idempotency SET created_at = NOW() - interval '25 hours' WHERE idempotency_key = $1",
+            old
+        )
+    assert await db.get_idempotent_response(old, None) is None
+    
+    await db.save_idempotent_response(new, None, conv_id, {"n": 2})
+    async with db.acquire() as conn:
+        keys = await conn.fetch("SELECT idempotency_key FROM chat_idempotency WHERE conversation_id = $1", conv_id)
+    assert [r["idempotency_key"] for r in keys] == [new]
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_message_stream_pages_without_holding_a_connection(pool):
+    conv_id = await db.create_conversation()
+    async with db.acquire() as conn:
+        # Same timestamp for all rows: pages must still neither skip nor repeat
+        await conn.execute(
+            """
+            INSERT INTO messages (conversation_id, role, content, created_at)
+            SELECT $1, 'user', 'msg-' || n, '2026-01-01T00:00:00Z'
+            FROM generate_series(1, 5) AS n
+            """,
+            conv_id
+        )
+    
+    seen = []
+    async for msg in db.iter_conversation_messages(conv_id, page_size=2):
+        # The consumer runs between fetches: every connection is back in the pool
+        assert pool.get_idle_size() == pool.get_size()
+        seen.append(msg)
+    
+    assert sorted(msg["content"] for msg in seen) == [f"msg-{n}" for n in range(1, 6)]
+    assert len({msg["id"] for msg in seen}) == 5
+    assert [msg["id"] for msg in seen] == sorted(msg["id"] for msg in seen)
@@ -0,0 +1,57 @@
+"""Archived TXT exports are built once and streamed back from disk"""
+import os
+from uuid import uuid4
+
+import pytest
+
+from app.utils.export import ExportService
+
+
+@pytest.fixture
+def export_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(ExportService, "EXPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(ExportService, "FILE_CHUNK_SIZE", 4)
+    return tmp_path
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    calls = []
+
+    async def fake_stream(conversation_id):
+        calls.append(conversation_id)
+        for chunk in ("header\n", "body\n", "footer\n"):
+            yield chunk
+
+    monkeypatch.setattr(ExportService, "stream_txt_report", classmethod(lambda cls, cid: fake_stream(cid)))
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_archived_export_is_built_once(export_dir, builds):
+    conv_id = uuid4()
+
+    path = await ExportService.generate_txt_report(conv_id)
+    streamed = "".join([chunk async for chunk in ExportService.stream_file(path)])
+
+    assert builds == [conv_id]
+    assert streamed == "header\nbody\nfooter\n"
+    assert os.listdir(export_dir) == [f"{conv_id}.txt"]
+
+
+@pytest.mark.asyncio
+async def test_failed_archive_leaves_previous_copy(export_dir, monkeypatch):
+    conv_id = uuid4()
+    (export_dir / f"{conv_id}.txt").write_text("previous", encoding="utf-8")
+
+    async def broken_stream(conversation_id):
+        yield "partial"
+        raise RuntimeError("db gone")
+
+    monkeypatch.setattr(ExportService, "stream_txt_report", classmethod(lambda cls, cid: broken_stream(cid)))
+
+    with pytest.raises(RuntimeError):
+        await ExportService.generate_txt_report(conv_id)
+
+    assert os.listdir(export_dir) == [f"{conv_id}.txt"]
+    assert (export_dir / f"{conv_id}.txt").read_text(encoding="utf-8") == "previous"
@@ -0,0 +1,101 @@
+import pytest
+
+from app.services.local_validator import LocalValidator
+from app.services.phase_manager import NO_ACCESSORY, phase_manager
+
+GRAPH = phase_manager.GRAPH
+
+
+def validate(phase_id, message, config=None):
+    return LocalValidator.validate(GRAPH[phase_id], message, config or {}, empty_option=NO_ACCESSORY)
+
+
+def test_free_text_phases_are_not_handled():
+    assert validate("phase_1_1", "pomodori") is None
+    assert validate("phase_6_1", "consegna entro marzo") is None
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("Zolla Cubica", "Zolla Cubica"),
+    ("cubica", "Zolla Cubica"),
+    ("zolla conica per favore", "Zolla Conica"),
+])
+def test_radio_option_matching(message, expected):
+    result = validate("phase_1_2", message)
+    assert result["is_complete"] is True
+    assert result["extracted_data"] == {"root_type": expected}
+
+
+def test_ambiguous_radio_answer_is_rejected():
+    # "zolla" is part of three options
+    result = validate("phase_1_2", "zolla")
+    assert result["is_complete"] is False
+    assert "Radice Nuda" in result["clarification_needed"]
+
+
+def test_checkbox_json_and_comma_lists():
+    result = validate("phase_5_1", '["Spandiconcime", "Ripiani supplementari"]')
+    assert result["extracted_data"] == {"accessories": ["Spandiconcime", "Ripiani supplementari"]}
+    result = validate("phase_5_1", "spandiconcime, ripiani supplementari")
+    assert result["extracted_data"] == {"accessories": ["Spandiconcime", "Ripiani supplementari"]}
+
+
+def test_checkbox_empty_option_means_none_selected():
+    result = validate("phase_5_2", '["Nessuno"]')
+    assert result["is_complete"] is True
+    assert result["extracted_data"] == {"accessories": []}
+
+
+def test_checkbox_unknown_item_is_rejected():
+    result = validate("phase_5_3", "Microgranulatore, aratro")
+    assert result["is_complete"] is False
+    assert "aratro" in result["clarification_needed"]
+
+
+@pytest.mark.parametrize("message", ["A=3, B=3, C=4, D=5", "a: 3 b: 3 c: 4 d: 5", "3, 3, 4, 5"])
+def test_root_dimensions(message):
+    result = validate("phase_1_3", message)
+    assert result["is_complete"] is True
+    assert result["extracted_data"] == {"A": 3, "B": 3, "C": 4, "D": 5}
+
+
+def test_partial_dimensions_ask_for_the_rest():
+    result = validate("phase_1_3", "A=3, B=3")
+    assert result["is_complete"] is False
+
+
+def test_labels_out_of_order_and_decimals():
+    result = validate("phase_2_2", "IP 30, IF 120,5, 4 bine, IB 25", {"row_type": "File binate"})
+    assert result["is_complete"] is True
+    assert result["extracted_data"] == {"IP": 30, "IF": 120.5, "number_of_rows": 4, "IB": 25}
+
+
+def test_single_rows_do_not_need_interbina():
+    result = validate("phase_2_2", "3 file, IF 75, IP 30", {"row_type": "File singole"})
+    assert result["is_complete"] is True
+    assert "IB" not in result["extracted_data"]
+
+
+def test_yes_no_with_measures():
+    result = validate("phase_3_2", "No")
+    assert result["extracted_data"] == {"is_raised_bed": False}
+    assert result["is_complete"] is True
+    result = validate("phase_3_2", "Sì, AT 20, LT 80, IT 120, ST 40")
+    assert result["extracted_data"] == {"is_raised_bed": True, "AT": 20, "LT": 80, "IT": 120, "ST": 40}
+    assert validate("phase_3_2", "sì")["is_complete"] is False
+
+
+def test_measure_without_yes_means_yes():
+    result = validate("phase_3_3", "LP 120")
+    assert result["extracted_data"] == {"is_mulch": True, "LP": 120}
+
+
+def test_single_number_phases():
+    assert validate("phase_4_1", "180 cm")["extracted_data"] == {"wheel_distance": 180}
+    assert validate("phase_4_2", "larghe")["is_complete"] is False
+
+
+def test_contacts():
+    result = validate("phase_6_3", "IT01234567890 mario.rossi@example.com")
+    assert result["extracted_data"] == {"vat_number": "01234567890", "email": "mario.rossi@example.com"}
+    assert validate("phase_6_3", "mario.rossi@example.com")["is_complete"] is False
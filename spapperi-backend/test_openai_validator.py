@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import openai_validator
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.openai_validator import OpenAIValidator
+
+
+class FakeCompletions:
+    def __init__(self, content=None, error=None):
+        self.content = content
+        self.error = error
+
+    async def create(self, **kwargs):
+        if self.error:
+            raise self.error
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker("test", min_calls=1, failure_rate=0.5)
+    monkeypatch.setattr(openai_validator, "llm_breaker", breaker)
+    return breaker
+
+
+def use_client(monkeypatch, **reply):
+    client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(**reply)))
+    monkeypatch.setattr(OpenAIValidator, "client", client)
+
+
+async def validate():
+    return await OpenAIValidator.validate_response("phase_4_2", "80", "tractor_hp (numero)")
+
+
+@pytest.mark.asyncio
+async def test_valid_reply_is_returned(monkeypatch, breaker):
+    use_client(monkeypatch, content='{"is_complete": true, "extracted_data": {"tractor_hp": 80}}')
+    result = await validate()
+    assert result["is_complete"] is True
+    assert result["extracted_data"] == {"tractor_hp": 80}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("content", ["not json {", None, "[1, 2]", '{"extracted_data": null}'])
+async def test_malformed_reply_asks_to_rephrase(monkeypatch, breaker, content):
+    # Regression: a reply that arrived but can't be used is not an outage
+    use_client(monkeypatch, content=content)
+    result = await validate()
+    assert result == OpenAIValidator.unclear()
+    assert "unavailable" not in result
+    assert breaker.stats()["window_failure_rate"] == 0.0
+    assert not breaker.is_open
+
+
+@pytest.mark.asyncio
+async def test_transport_error_is_unavailable(monkeypatch, breaker):
+    use_client(monkeypatch, error=ConnectionError("reset"))
+    result = await validate()
+    assert result["unavailable"] is True
+    assert breaker.is_open
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_is_unavailable_without_calling(monkeypatch, breaker):
+    use_client(monkeypatch, error=AssertionError("must not be called"))
+    breaker._open("test")
+    result = await validate()
+    assert result["unavailable"] is True
+    assert breaker.rejected == 1
@@ -0,0 +1,221 @@
+"""Outbox delivery against an in-process aiosmtpd server (see scripts/smtp_stub.py)"""
+import os
+import socket
+import asyncio
+
+import pytest
+import pytest_asyncio
+from aiosmtpd.controller import Controller
+
+from app.services import outbox_worker as outbox_worker_module
+from app.services.db import db
+from app.services.email_service import EmailService
+from app.services.outbox_worker import OutboxWorker
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+needs_db = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to a scratch database")
+
+
+class RecordingHandler:
+    """Accepts messages, or rejects the next `failures` with a transient error"""
+
+    def __init__(self):
+        self.received = []
+        self.failures = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.failures:
+            self.failures -= 1
+            return "451 Requested action aborted: try again later"
+        self.received.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    handler = RecordingHandler()
+    port = free_port()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+
+    monkeypatch.setenv("EMAIL_HOST", "127.0.0.1")
+    monkeypatch.setenv("EMAIL_PORT", str(port))
+    monkeypatch.setenv("EMAIL_FROM", "noreply@spapperi.local")
+    monkeypatch.delenv("EMAIL_USER", raising=False)
+    monkeypatch.delenv("EMAIL_PASSWORD", raising=False)
+    monkeypatch.setattr(outbox_worker_module, "email_service", EmailService())
+    yield handler
+    controller.stop()
+
+
+@pytest_asyncio.fixture
+async def outbox_db(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    await db.initialize()
+    async with db.acquire() as conn:
+        await conn.execute("TRUNCATE outbox")
+    yield
+    async with db.acquire() as conn:
+        await conn.execute("TRUNCATE outbox")
+    await outbox_worker_module.email_service.close()
+    await db.close()
+
+
+def make_worker(**settings) -> OutboxWorker:
+    worker = OutboxWorker()
+    worker.backoff_base = 30
+    worker.max_attempts = 3
+    for name, value in settings.items():
+        setattr(worker, name, value)
+    return worker
+
+
+async def enqueue(worker, subject="Report") -> str:
+    return await worker.enqueue("cliente@example.com", subject, "<p>Report</p>", [])
+
+
+async def outbox_row(outbox_id):
+    async with db.acquire() as conn:
+        return await conn.fetchrow(
+            """
+            SELECT status, attempts, last_error, sent_at,
+                   EXTRACT(EPOCH FROM next_attempt_at - NOW()) AS retry_in
+            FROM outbox WHERE id = $1
+            """,
+            outbox_id
+        )
+
+
+async def make_due(outbox_id):
+    async with db.acquire() as conn:
+        await conn.execute("UPDATE outbox SET next_attempt_at = NOW() WHERE id = $1", outbox_id)
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_delivers_and_marks_sent(smtp, outbox_db):
+    worker = make_worker()
+    outbox_id = await enqueue(worker, subject="Configurazione Spapperi")
+
+    assert await worker.drain_once() == 1
+
+    assert [envelope.rcpt_tos for envelope in smtp.received] == [["cliente@example.com"]]
+    assert b"Subject: Configurazione Spapperi" in smtp.received[0].content
+    row = await outbox_row(outbox_id)
+    assert row["status"] == "sent"
+    assert row["attempts"] == 1
+    assert row["sent_at"] is not None
+    assert await worker.drain_once() == 0
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_transient_failure_is_retried_with_backoff(smtp, outbox_db):
+    worker = make_worker()
+    outbox_id = await enqueue(worker)
+    smtp.failures = 1
+
+    await worker.drain_once()
+
+    row = await outbox_row(outbox_id)
+    assert row["status"] == "pending"
+    assert "451" in row["last_error"]
+    assert 25 < float(row["retry_in"]) <= 30
+    # Not due before the backoff has passed
+    assert await worker.drain_once() == 0
+
+    await make_due(outbox_id)
+    await worker.drain_once()
+
+    row = await outbox_row(outbox_id)
+    assert row["status"] == "sent"
+    assert row["attempts"] == 2
+    assert len(smtp.received) == 1
+
+
+def test_backoff_grows_exponentially_up_to_the_cap():
+    worker = make_worker(backoff_base=30, backoff_max=100)
+    assert [worker.backoff(attempts) for attempts in (1, 2, 3, 4)] == [30, 60, 100, 100]
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_dead_letters_after_max_attempts(smtp, outbox_db):
+    worker = make_worker(max_attempts=2)
+    outbox_id = await enqueue(worker)
+    smtp.failures = 10
+
+    await worker.drain_once()
+    assert (await outbox_row(outbox_id))["status"] == "pending"
+    await make_due(outbox_id)
+    await worker.drain_once()
+
+    row = await outbox_row(outbox_id)
+    assert row["status"] == "dead"
+    assert row["attempts"] == 2
+    await make_due(outbox_id)
+    assert await worker.drain_once() == 0
+    assert smtp.received == []
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_claims_skip_locked_and_leased_rows(outbox_db):
+    worker = make_worker()
+    ids = [await enqueue(worker, subject=f"Report {i}") for i in range(4)]
+
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            # Another worker is claiming two rows right now
+            locked = await conn.fetch(
+                "SELECT id FROM outbox WHERE id = ANY($1::uuid[]) FOR UPDATE", ids[:2]
+            )
+            assert len(locked) == 2
+            claimed = await asyncio.wait_for(db.claim_outbox_batch(10, 300), timeout=5)
+
+    assert sorted(row["id"] for row in claimed) == sorted(ids[2:])
+    # The lease keeps the claimed rows away from other workers
+    again = await db.claim_outbox_batch(10, 300)
+    assert sorted(row["id"] for row in again) == sorted(ids[:2])
+    assert await db.claim_outbox_batch(10, 300) == []
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_concurrent_claims_never_share_a_row(outbox_db):
+    worker = make_worker()
+    ids = [await enqueue(worker, subject=f"Report {i}") for i in range(6)]
+
+    batches = await asyncio.gather(*(db.claim_outbox_batch(2, 300) for _ in range(4)))
+
+    claimed = [row["id"] for batch in batches for row in batch]
+    assert sorted(claimed) == sorted(ids)
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_stop_does_not_hang_on_a_stuck_send(smtp, outbox_db, monkeypatch):
+    service = outbox_worker_module.email_service
+    sending = asyncio.Event()
+
+    async def stuck_send(message):
+        sending.set()
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(service, "send_message", stuck_send)
+    worker = make_worker(stop_timeout=0.2, poll_interval=0.05)
+    await enqueue(worker)
+    worker.start()
+    await asyncio.wait_for(sending.wait(), timeout=5)
+    task = worker._task
+
+    await asyncio.wait_for(worker.stop(), timeout=2)
+
+    assert task.cancelled()
+    assert worker._task is None
@@ -0,0 +1,84 @@
+import copy
+
+import pytest
+
+from app.services.db import db
+from app.services.phase_graph import COMPLETE, PhaseGraphError, compile_phase_graph
+from app.services.phase_manager import PhaseManager
+
+
+def phase(**overrides):
+    spec = {
+        "question": "Quante piante?",
+        "expected_format": "Un numero",
+        "field": "plants",
+        "columns": {"plants": {"from": ["plants"]}},
+        "next_phase": COMPLETE,
+    }
+    spec.update(overrides)
+    return spec
+
+
+def test_shipped_phases_compile():
+    graph = compile_phase_graph(
+        PhaseManager.PHASES, start=PhaseManager.START_PHASE, allowed_columns=db.CONFIGURATION_COLUMNS
+    )
+    assert len(graph) == len(PhaseManager.PHASES)
+    assert graph.position(PhaseManager.START_PHASE) == 0
+    assert graph.position(COMPLETE) == len(graph)
+
+
+def test_minimal_graph():
+    graph = compile_phase_graph({"a": phase(next_phase="b"), "b": phase()}, start="a")
+    assert [p.id for p in graph.following("a")] == ["b"]
+    assert graph["a"].map_columns({"plants": 12}, {}) == {"plants": 12}
+    assert graph["a"].is_free_text
+
+
+def test_variants_are_precomputed():
+    graph = compile_phase_graph({
+        "a": phase(
+            question={"small": "Poche?", "large": "Tante?"},
+            variant={"column": "size", "cases": {"small": ["piccola"]}, "default": "large"},
+            depends_on=["size"],
+            columns={"size": {"from": ["size"]}, "plants": {"from": ["plants"]}},
+        ),
+    }, start="a")
+    assert graph["a"].question({"size": "Piccola"}) == "Poche?"
+    assert graph["a"].question({}) == "Tante?"
+    assert graph.dependents_of(["size"]) == (graph["a"],)
+
+
+@pytest.mark.parametrize("definitions, start, message", [
+    ({"a": phase()}, "missing", "Start phase"),
+    ({"a": phase(colour="red")}, "a", "unknown keys"),
+    ({"a": {k: v for k, v in phase().items() if k != "field"}}, "a", "missing 'field'"),
+    ({"a": phase(ui_type="slider", options=["x"])}, "a", "unknown ui_type"),
+    ({"a": phase(ui_type="radio")}, "a", "go together"),
+    ({"a": phase(columns={})}, "a", "no columns"),
+    ({"a": phase(columns={"plants": {"from": ["p"], "list": "p"}})}, "a", "exactly one"),
+    ({"a": phase(next_phase="nowhere")}, "a", "unknown phases"),
+    ({"a": phase(transitions=[{"if": {"other": 1}, "then": COMPLETE}])}, "a", "columns the phase sets"),
+    ({"a": phase(), "b": phase()}, "a", "not reachable"),
+    ({"a": phase(next_phase="b"), "b": phase(next_phase="a",
+      transitions=[{"if": {"plants": 1}, "then": "a"}])}, "a", "never reach"),
+    ({"a": phase(local={"plants": "colour"})}, "a", "unknown type"),
+    ({"a": phase(local={"count": "number"})}, "a", "not read by any column"),
+    ({"a": phase(ui_type="radio", options=["x"], local={"plants": "number"})}, "a", "parsed from their options"),
+    ({"a": phase(depends_on=["size"])}, "a", "no phase sets"),
+])
+def test_invalid_definitions_are_rejected(definitions, start, message):
+    with pytest.raises(PhaseGraphError, match=message):
+        compile_phase_graph(definitions, start=start)
+
+
+def test_unknown_configuration_column_is_rejected():
+    with pytest.raises(PhaseGraphError, match="unknown configuration columns"):
+        compile_phase_graph({"a": phase()}, start="a", allowed_columns=["other"])
+
+
+def test_broken_shipped_phase_is_rejected():
+    definitions = copy.deepcopy(PhaseManager.PHASES)
+    definitions[PhaseManager.START_PHASE]["next_phase"] = "phase_does_not_exist"
+    with pytest.raises(PhaseGraphError):
+        compile_phase_graph(definitions, start=PhaseManager.START_PHASE)
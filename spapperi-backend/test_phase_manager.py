@@ -0,0 +1,255 @@
+from uuid import uuid4
+
+import pytest
+
+from app.services import phase_manager as phase_manager_module
+from app.services.phase_graph import compile_phase_graph
+from app.services.phase_manager import PhaseManager
+
+# Answers up to phase_3_1, as stored in the configurations row
+ANSWERED_TO_3_1 = {
+    "crop_type": "pomodori",
+    "root_type": "Zolla Cubica",
+    "root_dimensions": {"A": 4, "B": 4, "C": 5, "D": 3},
+    "row_type": "File singole",
+    "layout_details": {"number_of_rows": 2, "IF": 70, "IP": 30, "IB": None},
+}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """In-memory configuration row and a scripted validator reply"""
+    state = {"config": {}, "validation": None, "lookahead": None}
+
+    async def get_configuration_data(conversation_id):
+        return dict(state["config"])
+
+    async def save_configuration_data(conversation_id, data):
+        state["config"].update(data)
+        return dict(state["config"])
+
+    async def get_phase_user_messages(conversation_id, phase):
+        return []
+
+    async def validate_response(phase, user_message, expected_format, context="", conversation_history=None, lookahead=None):
+        state["lookahead"] = lookahead
+        return state["validation"]
+
+    db = phase_manager_module.db
+    monkeypatch.setattr(db, "get_configuration_data", get_configuration_data)
+    monkeypatch.setattr(db, "save_configuration_data", save_configuration_data)
+    monkeypatch.setattr(db, "get_phase_user_messages", get_phase_user_messages)
+    monkeypatch.setattr(phase_manager_module.ai_validator, "validate_response", validate_response)
+    monkeypatch.setattr(phase_manager_module, "MULTI_SLOT_ENABLED", True)
+    return state
+
+
+def answer(state, extracted, additional=None):
+    state["validation"] = {
+        "is_complete": True,
+        "extracted_data": extracted,
+        "clarification_needed": None,
+        "additional_data": additional,
+    }
+
+
+# === EDITING AN EARLIER ANSWER ===
+
+@pytest.mark.asyncio
+async def test_edit_skips_valid_answers_up_to_the_resume_point(store):
+    store["config"] = dict(ANSWERED_TO_3_1)
+    answer(store, {"crop_type": "peperoni"})
+
+    result = await PhaseManager.process_user_response(uuid4(), "phase_1_1", "peperoni", resume_phase="phase_3_1")
+
+    assert result["next_phase"] == "phase_3_1"
+    assert result["resume_phase"] is None
+
+
+@pytest.mark.asyncio
+async def test_edit_that_invalidates_a_phase_keeps_the_resume_point(store):
+    store["config"] = dict(ANSWERED_TO_3_1)
+    answer(store, {"row_type": "File binate"})
+
+    result = await PhaseManager.process_user_response(uuid4(), "phase_2_1", "binate", resume_phase="phase_3_1")
+
+    # The layout depends on the row type and is asked again before resuming
+    assert result["next_phase"] == "phase_2_2"
+    assert result["resume_phase"] == "phase_3_1"
+    assert store["config"]["layout_details"] is None
+
+
+@pytest.mark.asyncio
+async def test_multi_slot_edit_past_the_resume_point_clears_it(store):
+    store["config"] = dict(ANSWERED_TO_3_1)
+    # Edits the root dimensions and also answers the pending phase_3_1
+    answer(store, {"A": 5, "B": 5, "C": 6, "D": 3}, {"phase_3_1": {"environment": "serra"}})
+
+    result = await PhaseManager.process_user_response(uuid4(), "phase_1_3", "5 5 6 3, in serra", resume_phase="phase_3_1")
+
+    assert store["config"]["environment"] == "Serra"
+    assert result["next_phase"] == "phase_3_2"
+    assert result["resume_phase"] is None
+
+
+BRANCHING = {
+    "choice": {
+        "question": "Corto o lungo?",
+        "expected_format": "Corto o Lungo",
+        "field": "environment",
+        "ui_type": "radio",
+        "options": ["Corto", "Lungo"],
+        "columns": {"environment": {"from": ["environment"]}},
+        "transitions": [{"if": {"environment": "Corto"}, "then": "last"}],
+        "next_phase": "long_1",
+    },
+    "long_1": {
+        "question": "Primo?",
+        "expected_format": "Testo",
+        "field": "crop_type",
+        "columns": {"crop_type": {"from": ["crop_type"]}},
+        "next_phase": "long_2",
+    },
+    "long_2": {
+        "question": "Secondo?",
+        "expected_format": "Testo",
+        "field": "soil_type",
+        "columns": {"soil_type": {"from": ["soil_type"]}},
+        "next_phase": "last",
+    },
+    "last": {
+        "question": "Ultimo?",
+        "expected_format": "Testo",
+        "field": "user_notes",
+        "columns": {"user_notes": {"from": ["notes"]}},
+        "prefill": False,
+        "next_phase": "complete",
+    },
+}
+
+
+@pytest.mark.asyncio
+async def test_edit_that_changes_branch_drops_the_resume_point(store, monkeypatch):
+    monkeypatch.setattr(PhaseManager, "GRAPH", compile_phase_graph(BRANCHING, start="choice"))
+    store["config"] = {"environment": "Lungo", "crop_type": "pomodori"}
+    answer(store, {"environment": "Corto"})
+
+    # The user was at long_2, which the short branch no longer visits
+    result = await PhaseManager.process_user_response(uuid4(), "choice", "corto", resume_phase="long_2")
+
+    assert result["next_phase"] == "last"
+    assert result["resume_phase"] is None
+
+
+@pytest.mark.asyncio
+async def test_edit_back_onto_a_longer_branch_keeps_the_resume_point(store, monkeypatch):
+    monkeypatch.setattr(PhaseManager, "GRAPH", compile_phase_graph(BRANCHING, start="choice"))
+    store["config"] = {"environment": "Corto"}
+    answer(store, {"environment": "Lungo"})
+
+    result = await PhaseManager.process_user_response(uuid4(), "choice", "lungo", resume_phase="last")
+
+    assert result["next_phase"] == "long_1"
+    assert result["resume_phase"] == "last"
+
+
+def test_is_answered_uses_the_resume_point():
+    conversation = {"current_phase": "phase_1_2", "resume_phase": "phase_3_1"}
+    assert PhaseManager.is_answered("phase_2_2", conversation)
+    assert not PhaseManager.is_answered("phase_3_1", conversation)
+    assert not PhaseManager.is_answered("phase_2_2", {"current_phase": "phase_1_2", "resume_phase": None})
+
+
+# === MULTI-SLOT EXTRACTION ===
+
+ANSWERED_TO_2_1 = {key: ANSWERED_TO_3_1[key] for key in ("crop_type", "root_type", "root_dimensions")}
+
+
+def test_lookahead_lists_unanswered_later_phases_up_to_the_closing_ones():
+    formats = PhaseManager._lookahead_formats("phase_4_2", {"accessories_secondary": []})
+
+    assert list(formats) == ["phase_5_1", "phase_5_3"]
+    assert "Opzioni: Nessuno, Spandiconcime" in formats["phase_5_1"]
+    assert formats["phase_5_3"].endswith("(campo 'accessories_element')")
+
+
+@pytest.mark.asyncio
+async def test_one_message_fills_several_phases(store):
+    store["config"] = dict(ANSWERED_TO_2_1)
+    answer(store, {"row_type": "File singole"}, {
+        "phase_2_2": {"number_of_rows": 2, "IF": 70, "IP": 30},
+        "phase_3_1": {"environment": "campo  APERTO"},
+    })
+
+    result = await PhaseManager.process_user_response(uuid4(), "phase_2_1", "singole, 2 file a 70 e 30, campo aperto")
+
+    assert "phase_2_2" in store["lookahead"] and "phase_6_1" not in store["lookahead"]
+    assert store["config"]["layout_details"] == {"number_of_rows": 2, "IF": 70, "IP": 30, "IB": None}
+    assert store["config"]["environment"] == "Campo aperto"
+    assert result["next_phase"] == "phase_3_2"
+
+
+@pytest.mark.asyncio
+async def test_invalid_lookahead_values_are_dropped(store):
+    store["config"] = {**ANSWERED_TO_3_1, "environment": "Serra"}
+    answer(store, {"is_raised_bed": False}, {
+        "phase_3_3": {"is_mulch": False},
+        "phase_3_4": {"soil_type": "Roccioso"},  # not an option
+        "phase_5_1": {"accessories": ["Spandiconcime", "Turbo"]},  # one unknown option
+        "phase_5_2": {"accessories": ["separatore di zolle", "Nessuno"]},
+        "phase_6_1": {"notes": "nessuna"},  # closing phases are never prefilled
+    })
+
+    result = await PhaseManager.process_user_response(uuid4(), "phase_3_2", "no baula, no telo")
+
+    config = store["config"]
+    assert config["is_mulch"] is False
+    assert "soil_type" not in config
+    assert "accessories_primary" not in config
+    assert config["accessories_secondary"] == ["Separatore di zolle"]
+    assert "user_notes" not in config
+    assert result["next_phase"] == "phase_3_4"
+
+
+@pytest.mark.asyncio
+async def test_skipping_stops_at_the_first_unanswered_phase(store):
+    store["config"] = dict(ANSWERED_TO_3_1)
+    answer(store, {"environment": "Serra"}, {
+        "phase_3_3": {"is_mulch": True, "LP": 120},
+        "phase_3_4": {"soil_type": "Sabbioso"},
+    })
+
+    result = await PhaseManager.process_user_response(uuid4(), "phase_3_1", "serra, telo da 120, sabbioso")
+
+    # phase_3_2 (raised bed) was not answered: it is asked before the later ones
+    assert result["next_phase"] == "phase_3_2"
+    assert store["config"]["soil_type"] == "Sabbioso"
+
+
+@pytest.mark.asyncio
+async def test_incomplete_answer_keeps_the_later_phases_it_covered(store):
+    store["config"] = dict(ANSWERED_TO_3_1)
+    store["validation"] = {
+        "is_complete": False,
+        "extracted_data": {},
+        "clarification_needed": "Campo aperto o serra?",
+        "additional_data": {"phase_3_4": {"soil_type": "argilloso"}},
+    }
+
+    result = await PhaseManager.process_user_response(uuid4(), "phase_3_1", "terreno argilloso")
+
+    assert result["is_valid"] is False
+    assert result["next_phase"] == "phase_3_1"
+    assert store["config"]["soil_type"] == "Argilloso"
+
+
+@pytest.mark.asyncio
+async def test_multi_slot_disabled_asks_every_phase(store, monkeypatch):
+    monkeypatch.setattr(phase_manager_module, "MULTI_SLOT_ENABLED", False)
+    store["config"] = {**ANSWERED_TO_3_1, "is_raised_bed": False, "is_mulch": False}
+    answer(store, {"environment": "Serra"})
+
+    result = await PhaseManager.process_user_response(uuid4(), "phase_3_1", "serra")
+
+    assert store["lookahead"] is None
+    assert result["next_phase"] == "phase_3_2"
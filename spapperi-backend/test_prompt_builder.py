@@ -0,0 +1,68 @@
+import pytest
+
+from app.services import prompt_builder as prompt_builder_module
+from app.services.prompt_builder import (
+    PROMPT_CACHE_MIN_TOKENS,
+    SYSTEM_PROMPT,
+    load_encoding,
+    prompt_builder,
+)
+
+
+def test_system_prefix_reaches_prompt_cache_minimum():
+    encoding = load_encoding()
+    if encoding is None:
+        pytest.skip("tiktoken encoding unavailable (BPE file not downloadable)")
+    assert len(encoding.encode(SYSTEM_PROMPT)) >= PROMPT_CACHE_MIN_TOKENS
+    assert prompt_builder_module.SYSTEM_PROMPT_TOKENS == len(encoding.encode(SYSTEM_PROMPT))
+
+
+def test_encoding_is_never_loaded_on_the_request_path(monkeypatch):
+    def load(model):
+        raise AssertionError("tiktoken loaded while building a prompt")
+
+    monkeypatch.setattr(prompt_builder_module, "_ENCODING", None)
+    monkeypatch.setattr(prompt_builder_module.tiktoken, "encoding_for_model", load)
+    prompt = prompt_builder.build("phase_1_1", "pomodori", "Nome della coltura")
+    assert prompt.prompt_tokens > prompt_builder_module.SYSTEM_PROMPT_TOKENS
+
+
+def test_system_prefix_length_floor():
+    # Offline guard: Italian prose stays well under 4.5 characters per token
+    assert len(SYSTEM_PROMPT) / 4.5 >= PROMPT_CACHE_MIN_TOKENS
+
+
+def test_system_message_is_identical_across_calls():
+    first = prompt_builder.build("phase_1_1", "pomodori", "Nome della coltura", context="Cosa trapianti?")
+    second = prompt_builder.build(
+        "phase_3_2", "Sì, AT 20", "AT, LT, IT, ST in cm", context="Su baula?",
+        conversation_history=[{"role": "user", "content": "sì"}],
+        lookahead={"phase_3_3": "LP in cm"},
+    )
+    assert first.messages[0] == second.messages[0] == {"role": "system", "content": SYSTEM_PROMPT}
+    # Per-turn data only goes in the user message
+    assert "Sì, AT 20" in second.messages[1]["content"]
+    assert "phase_3_3" in second.messages[1]["content"]
+
+
+def test_current_answer_is_not_repeated_from_history():
+    prompt = prompt_builder.build(
+        "phase_1_3", "C 4 e D 5", "A, B, C, D in cm",
+        conversation_history=[
+            {"role": "user", "content": "A=3, B=3"},
+            {"role": "assistant", "content": "Mancano C e D"},
+            {"role": "user", "content": "C 4 e D 5"},
+        ],
+    )
+    assert prompt.history_included == 1
+    assert prompt.messages[1]["content"].count("C 4 e D 5") == 1
+
+
+def test_history_over_budget_is_reduced():
+    long_message = "ciao " * 300 + "A=3 B=3"
+    prompt = prompt_builder.build(
+        "phase_4_1", "150", "wheel_distance in cm",
+        conversation_history=[{"role": "user", "content": long_message}],
+    )
+    assert prompt.history_reduced == 1
+    assert "[riassunto]" in prompt.messages[1]["content"]
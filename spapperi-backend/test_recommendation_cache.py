@@ -0,0 +1,212 @@
+import os
+import math
+import random
+from contextlib import asynccontextmanager
+
+import pytest
+import pytest_asyncio
+
+from app.services.db import db
+from app.services.recommendation_cache import ADAPT, MISS, REUSE, RecommendationCache
+
+ANSWERS = {"root_type": "Zolla Cubica", "row_type": "File singole", "is_raised_bed": True, "is_mulch": False}
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+needs_db = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to a scratch database with pgvector")
+
+DIMENSIONS = 1536
+
+
+def key(accessories, **answers):
+    return RecommendationCache.config_key({**ANSWERS, **answers}, accessories)
+
+
+def make_cache(reuse=0.98, adapt=0.93):
+    cache = RecommendationCache()
+    cache.enabled = True
+    cache.reuse_threshold = reuse
+    cache.adapt_threshold = adapt
+    return cache
+
+
+# === thresholds ===
+
+@pytest.mark.parametrize("similarity, decision", [
+    (None, MISS),
+    (0.5, MISS),
+    (0.9299, MISS),
+    (0.93, ADAPT),
+    (0.97, ADAPT),
+    (0.98, REUSE),
+    (1.0, REUSE),
+])
+def test_decision_thresholds(similarity, decision):
+    assert make_cache()._decide(similarity) == decision
+
+
+def test_adapt_disabled_when_thresholds_meet():
+    cache = make_cache(reuse=0.95, adapt=0.95)
+    assert cache._decide(0.96) == REUSE
+    assert cache._decide(0.94) == MISS
+
+
+def test_accessory_key_is_canonical():
+    key = RecommendationCache.accessory_key
+    assert key(["Rullo in gomma", "Microgranulatore", "Nessuno", " Microgranulatore "]) == "Microgranulatore|Rullo in gomma"
+    assert key(["Nessuno"]) == key([]) == ""
+
+
+def test_config_key_is_canonical():
+    assert key(["Microgranulatore", "Nessuno"]) == RecommendationCache.config_key(
+        {"root_type": " zolla  cubica", "row_type": "FILE SINGOLE", "is_raised_bed": True, "is_mulch": False},
+        ["Microgranulatore"]
+    )
+
+
+@pytest.mark.parametrize("answers", [
+    {"root_type": "Radice Nuda"},
+    {"row_type": "File binate"},
+    {"is_raised_bed": False},
+    {"is_mulch": True},
+    {"is_mulch": None},
+])
+def test_config_key_separates_categorical_answers(answers):
+    assert key([], **answers) != key([])
+
+
+@pytest.mark.asyncio
+async def test_disabled_cache_misses_without_db():
+    cache = make_cache()
+    cache.enabled = False
+    lookup = await cache.lookup("q", key([]), [0.0] * DIMENSIONS)
+    assert lookup.decision == MISS
+    await cache.store("q", key([]), [0.0] * DIMENSIONS, "text")
+
+
+# === lookup against pgvector ===
+
+def unit(vector):
+    norm = math.sqrt(sum(v * v for v in vector))
+    return [v / norm for v in vector]
+
+
+def near(base, similarity, rng):
+    """Unit vector with the given cosine similarity to the unit vector `base`"""
+    noise = [rng.gauss(0, 1) for _ in base]
+    dot = sum(n * b for n, b in zip(noise, base))
+    orthogonal = unit([n - dot * b for n, b in zip(noise, base)])
+    sine = math.sqrt(1 - similarity ** 2)
+    return [similarity * b + sine * o for b, o in zip(base, orthogonal)]
+
+
+@pytest_asyncio.fixture
+async def cache_db(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    await db.initialize()
+    async with db.acquire() as conn:
+        await conn.execute("TRUNCATE recommendation_cache, recommendation_cache_lookups")
+    yield
+    async with db.acquire() as conn:
+        await conn.execute("TRUNCATE recommendation_cache, recommendation_cache_lookups")
+    await db.close()
+
+
+@pytest.fixture
+def prefer_index_order(monkeypatch):
+    """Pool connections on which the planner avoids sorts, as it does on a large table"""
+    acquire = db.acquire
+
+    @asynccontextmanager
+    async def acquire_without_sort(stage="db"):
+        async with acquire(stage) as conn:
+            await conn.execute("SET enable_sort = off")
+            try:
+                yield conn
+            finally:
+                await conn.execute("RESET enable_sort")
+
+    monkeypatch.setattr(db, "acquire", acquire_without_sort)
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_lookup_hits_with_many_entries_under_other_keys(cache_db, prefer_index_order):
+    # Regression: entries of other keys that are closer to the query filled
+    # the candidate list of a filtered vector-index scan, so the lookup found
+    # nothing
+    rng = random.Random(7)
+    cache = make_cache()
+    query = unit([rng.gauss(0, 1) for _ in range(DIMENSIONS)])
+    for i in range(200):
+        accessories = [["Spandiconcime"], ["Microgranulatore"], ["Rullo in gomma"], []][i % 4]
+        await cache.store(f"other {i}", key(accessories), near(query, 0.99, rng), f"other {i}")
+    await cache.store("target", key(["Separatore di zolle"]), near(query, 0.95, rng), "target text")
+
+    lookup = await cache.lookup("query", key(["Separatore di zolle"]), query)
+    assert lookup.decision == ADAPT
+    assert lookup.recommendation == "target text"
+    assert lookup.similarity == pytest.approx(0.95, abs=0.001)
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_lookup_takes_the_nearest_entry_of_the_same_key(cache_db):
+    rng = random.Random(11)
+    cache = make_cache()
+    query = unit([rng.gauss(0, 1) for _ in range(DIMENSIONS)])
+    await cache.store("far", key(["Microgranulatore"]), near(query, 0.94, rng), "far text")
+    await cache.store("close", key(["Microgranulatore"]), near(query, 0.99, rng), "close text")
+    await cache.store("closest, other key", key(["Spandiconcime"]), query, "other text")
+
+    lookup = await cache.lookup("query", key(["Microgranulatore"]), query)
+    assert lookup.decision == REUSE
+    assert lookup.recommendation == "close text"
+
+    lookup = await cache.lookup("query", key(["Tracciatori fila manuali"]), query)
+    assert lookup.decision == MISS
+    assert lookup.entry_id is None
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_identical_text_for_another_row_type_is_not_reused(cache_db):
+    cache = make_cache()
+    query = unit([1.0] * DIMENSIONS)
+    await cache.store("query", key([], row_type="File binate"), query, "twin rows text")
+
+    lookup = await cache.lookup("query", key([], row_type="File singole"), query)
+    assert lookup.decision == MISS
+    assert lookup.entry_id is None
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_store_keeps_the_most_recently_used_entries(cache_db):
+    rng = random.Random(3)
+    cache = make_cache()
+    cache.max_entries = 3
+    query = unit([rng.gauss(0, 1) for _ in range(DIMENSIONS)])
+    await cache.store("used", key(["Microgranulatore"]), query, "used text")
+    for i in range(2):
+        await cache.store(f"new {i}", key([]), near(query, 0.5, rng), f"new {i}")
+    assert (await cache.lookup("query", key(["Microgranulatore"]), query)).decision == REUSE
+    await cache.store("new 2", key([]), near(query, 0.5, rng), "new 2")
+
+    async with db.acquire() as conn:
+        kept = {row["query"] for row in await conn.fetch("SELECT query FROM recommendation_cache")}
+    assert kept == {"used", "new 1", "new 2"}
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_store_prunes_entries_past_the_maximum_age(cache_db):
+    cache = make_cache()
+    query = unit([1.0] * DIMENSIONS)
+    await cache.store("old", key([]), query, "old text")
+    async with db.acquire() as conn:
+        await conn.execute("UPDATE recommendation_cache SET created_at = NOW() - INTERVAL '100 days'")
+    await cache.store("new", key(["Microgranulatore"]), query, "new text")
+
+    async with db.acquire() as conn:
+        kept = {row["query"] for row in await conn.fetch("SELECT query FROM recommendation_cache")}
+    assert kept == {"new"}
@@ -0,0 +1,108 @@
+from uuid import uuid4
+
+import pytest
+
+from app.services.state_cache import INSTANCE_ID, ConversationStateCache
+
+
+@pytest.fixture
+def now(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.services.state_cache.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_write_through_hit():
+    cache = ConversationStateCache()
+    conv_id = uuid4()
+    cache.put_conversation(conv_id, {"current_phase": "phase_1_1"})
+
+    assert cache.get_conversation(conv_id) == (True, {"current_phase": "phase_1_1"})
+    assert cache.get_configuration(conv_id) == (False, None)
+
+
+def test_cached_rows_are_copies():
+    cache = ConversationStateCache()
+    conv_id = uuid4()
+    cache.put_configuration(conv_id, {"crop": "pomodoro"})
+
+    _, row = cache.get_configuration(conv_id)
+    row["crop"] = "lattuga"
+
+    assert cache.get_configuration(conv_id) == (True, {"crop": "pomodoro"})
+
+
+def test_entries_expire_after_ttl(now):
+    cache = ConversationStateCache(ttl=10)
+    conv_id = uuid4()
+    cache.put_conversation(conv_id, {"current_phase": "phase_1_1"})
+
+    now[0] += 9
+    assert cache.get_conversation(conv_id)[0] is True
+    now[0] += 2
+    assert cache.get_conversation(conv_id) == (False, None)
+    assert cache.stats()["expirations"] == 1
+
+
+def test_lru_eviction():
+    cache = ConversationStateCache(max_entries=2)
+    first, second, third = uuid4(), uuid4(), uuid4()
+    cache.put_conversation(first, {})
+    cache.put_conversation(second, {})
+    cache.get_conversation(first)
+    cache.put_conversation(third, {})
+
+    assert cache.get_conversation(second)[0] is False
+    assert cache.get_conversation(first)[0] is True
+    assert cache.stats()["evictions"] == 1
+
+
+def test_load_started_before_invalidation_is_discarded():
+    cache = ConversationStateCache()
+    conv_id = uuid4()
+    version = cache.version(conv_id)
+    cache.invalidate(conv_id)
+    cache.put_conversation(conv_id, {"current_phase": "stale"}, version=version)
+
+    assert cache.get_conversation(conv_id) == (False, None)
+    assert cache.stats()["stale_loads_discarded"] == 1
+
+
+def test_remote_notification_invalidates():
+    cache = ConversationStateCache()
+    conv_id = uuid4()
+    cache.put_conversation(conv_id, {"current_phase": "phase_1_1"})
+
+    cache.handle_notification(None, 0, "conversation_state", f"{conv_id}:spapperi-other")
+
+    assert cache.get_conversation(conv_id)[0] is False
+    assert cache.stats()["remote_invalidations"] == 1
+
+
+def test_own_and_malformed_notifications_are_ignored():
+    cache = ConversationStateCache()
+    conv_id = uuid4()
+    cache.put_conversation(conv_id, {"current_phase": "phase_1_1"})
+
+    cache.handle_notification(None, 0, "conversation_state", f"{conv_id}:{INSTANCE_ID}")
+    cache.handle_notification(None, 0, "conversation_state", "not-a-uuid:spapperi-other")
+
+    assert cache.get_conversation(conv_id)[0] is True
+
+
+def test_clear_drops_everything():
+    cache = ConversationStateCache()
+    ids = [uuid4(), uuid4()]
+    for conv_id in ids:
+        cache.put_conversation(conv_id, {})
+    cache.clear()
+
+    assert all(cache.get_conversation(conv_id)[0] is False for conv_id in ids)
+
+
+def test_disabled_cache_never_hits():
+    cache = ConversationStateCache(enabled=False)
+    conv_id = uuid4()
+    cache.put_conversation(conv_id, {})
+
+    assert cache.get_conversation(conv_id) == (False, None)
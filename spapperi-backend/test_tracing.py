@@ -0,0 +1,130 @@
+import os
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+import pytest_asyncio
+
+# setup_tracing() runs when main is imported: collect spans in memory
+os.environ["TRACING_EXPORTER"] = "memory"
+
+try:
+    import main
+except OSError as e:
+    # WeasyPrint (PDF export) needs the Pango system libraries
+    pytest.skip(f"main is not importable here: {e}", allow_module_level=True)
+
+from app.services.db import db
+from app.services.openai_validator import ai_validator
+from app.utils import tracing
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+needs_db = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to a scratch database")
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+class FakeCompletions:
+    """chat.completions of an OpenAI client that always asks for clarification"""
+
+    async def create(self, **kwargs):
+        content = json.dumps({"is_complete": False, "extracted_data": None, "clarification_needed": "Quante file?"})
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=200, completion_tokens=20, prompt_tokens_details=None)
+        )
+
+
+@pytest_asyncio.fixture
+async def client(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    monkeypatch.setattr(ai_validator, "client", SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions())))
+    await db.initialize()
+    tracing.memory_exporter.clear()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        yield http
+    await db.close()
+
+
+def server_spans(spans):
+    return [span for span in spans if span["kind"] == "SERVER"]
+
+
+def descends_from(span, ancestor_id, by_id):
+    while span["parent_id"] is not None:
+        if span["parent_id"] == ancestor_id:
+            return True
+        span = by_id.get(span["parent_id"])
+        if span is None:
+            return False
+    return False
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_chat_request_gets_a_root_server_span(client):
+    response = await client.post("/api/chat", json={"message": "Ciao"})
+    assert response.status_code == 200
+
+    spans = tracing.finished_spans()
+    [root] = server_spans(spans)
+    assert root["name"] == "POST /api/chat"
+    assert root["parent_id"] is None
+    assert root["attributes"]["http.route"] == "/api/chat"
+    assert root["attributes"]["http.status_code"] == 200
+    assert root["attributes"]["spapperi.conversation_id"] == response.json()["conversation_id"]
+    assert response.headers["X-Trace-Id"] == root["trace_id"]
+    assert root["trace_id"] in response.headers["traceparent"]
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_db_and_validator_spans_are_children_of_the_server_span(client):
+    first = await client.post("/api/chat", json={"message": "Ciao"})
+    tracing.memory_exporter.clear()
+
+    response = await client.post(
+        "/api/chat",
+        json={"message": "Non so", "conversation_id": first.json()["conversation_id"]}
+    )
+    assert response.status_code == 200
+    assert response.json()["response"] == "Quante file?"
+
+    spans = tracing.finished_spans()
+    [root] = server_spans(spans)
+    by_id = {span["span_id"]: span for span in spans}
+    names = {span["name"] for span in spans}
+    assert {"db.get_conversation", "db.save_message", "openai.validate_response"} <= names
+
+    for span in spans:
+        if span is root:
+            continue
+        assert span["trace_id"] == root["trace_id"], span["name"]
+        assert descends_from(span, root["span_id"], by_id), span["name"]
+
+    validator = next(span for span in spans if span["name"] == "openai.validate_response")
+    assert validator["parent_id"] == root["span_id"]
+    assert validator["attributes"]["spapperi.phase"] == "phase_1_1"
+    assert validator["attributes"]["spapperi.prompt_tokens"] == 200
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_incoming_traceparent_is_continued(client):
+    response = await client.post(
+        "/api/chat",
+        json={"message": "Ciao"},
+        headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"}
+    )
+    assert response.status_code == 200
+
+    spans = tracing.finished_spans()
+    [root] = server_spans(spans)
+    assert root["trace_id"] == TRACE_ID
+    assert root["parent_id"] == PARENT_ID
+    assert all(span["trace_id"] == TRACE_ID for span in spans)
+    assert response.headers["X-Trace-Id"] == TRACE_ID
+    assert response.headers["traceparent"].startswith(f"00-{TRACE_ID}-{root['span_id']}-")
@@ -0,0 +1,85 @@
+import os
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from app.services.db import db
+from app.services.turn_lock import TurnLockManager, TurnLockTimeout
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+needs_db = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to a scratch database")
+
+
+@pytest.mark.asyncio
+async def test_turns_for_one_conversation_run_one_at_a_time():
+    locks = TurnLockManager(timeout=1)
+    running, overlaps = [], []
+
+    async def turn():
+        async with locks.hold("conv"):
+            overlaps.append(len(running))
+            running.append(1)
+            await asyncio.sleep(0.01)
+            running.pop()
+
+    await asyncio.gather(*(turn() for _ in range(5)))
+
+    assert overlaps == [0] * 5
+    assert locks._locks == {}
+
+
+@pytest.mark.asyncio
+async def test_other_conversations_are_not_blocked():
+    locks = TurnLockManager(timeout=0.05)
+    async with locks.hold("a"):
+        async with locks.hold("b"):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_waiting_turn_times_out():
+    locks = TurnLockManager(timeout=0.05)
+    async with locks.hold("conv"):
+        with pytest.raises(TurnLockTimeout):
+            async with locks.hold("conv"):
+                pass
+        # The timed-out waiter no longer references the lock
+        assert locks._locks["conv"][1] == 1
+
+    async with locks.hold("conv"):
+        pass
+    assert locks._locks == {}
+
+
+@pytest.mark.asyncio
+async def test_lock_is_released_when_the_turn_fails():
+    locks = TurnLockManager(timeout=0.05)
+    with pytest.raises(RuntimeError):
+        async with locks.hold("conv"):
+            raise RuntimeError("turn failed")
+
+    async with locks.hold("conv"):
+        pass
+
+
+@pytest_asyncio.fixture
+async def lock_db(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    await db.initialize()
+    yield
+    await db.close()
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_advisory_lock_times_out_across_workers(lock_db):
+    # Two managers stand in for two workers sharing the database
+    first, second = TurnLockManager(timeout=0.2, advisory=True), TurnLockManager(timeout=0.2, advisory=True)
+    async with first.hold("conv"):
+        with pytest.raises(TurnLockTimeout):
+            async with second.hold("conv"):
+                pass
+
+    async with second.hold("conv"):
+        pass
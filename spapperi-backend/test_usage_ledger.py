@@ -0,0 +1,162 @@
+import os
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+
+from app.services.db import db
+from app.services.usage_ledger import UsageLedger
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+needs_db = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to a scratch database")
+
+USAGE = SimpleNamespace(prompt_tokens=120, completion_tokens=30, prompt_tokens_details=SimpleNamespace(cached_tokens=64))
+
+
+class FakeInsert:
+    """Stands in for db.insert_llm_usage; fails the next `failures` calls"""
+
+    def __init__(self):
+        self.batches = []
+        self.failures = 0
+
+    async def __call__(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database is down")
+        self.batches.append(list(rows))
+
+
+@pytest.fixture
+def insert(monkeypatch):
+    fake = FakeInsert()
+    monkeypatch.setattr(db, "insert_llm_usage", fake)
+    return fake
+
+
+def make_ledger(monkeypatch, batch_size=3, buffer_max=10, flush_interval=60):
+    monkeypatch.setenv("LLM_USAGE_LEDGER", "true")
+    monkeypatch.setenv("LLM_USAGE_BATCH_SIZE", str(batch_size))
+    monkeypatch.setenv("LLM_USAGE_BUFFER_MAX", str(buffer_max))
+    monkeypatch.setenv("LLM_USAGE_FLUSH_INTERVAL", str(flush_interval))
+    return UsageLedger()
+
+
+def purposes(batches):
+    return [row[2] for batch in batches for row in batch]
+
+
+@pytest.mark.asyncio
+async def test_flush_writes_in_batches_of_batch_size(monkeypatch, insert):
+    ledger = make_ledger(monkeypatch, batch_size=3)
+    for i in range(7):
+        ledger.record(f"call-{i}", "gpt-4o", USAGE, 0.25)
+
+    assert await ledger.flush() == 7
+    assert [len(batch) for batch in insert.batches] == [3, 3, 1]
+    assert purposes(insert.batches) == [f"call-{i}" for i in range(7)]
+    row = insert.batches[0][0]
+    assert row[4:8] == (120, 64, 30, 250)
+    assert ledger.stats() == {"buffered": 0, "written": 7, "dropped": 0, "failed_flushes": 0}
+
+
+@pytest.mark.asyncio
+async def test_full_batch_wakes_the_flusher(monkeypatch, insert):
+    ledger = make_ledger(monkeypatch, batch_size=2)
+    ledger.start()
+    try:
+        ledger.record("a", "gpt-4o", USAGE, 0.1)
+        ledger.record("b", "gpt-4o", USAGE, 0.1)
+        for _ in range(50):
+            if insert.batches:
+                break
+            await asyncio.sleep(0.01)
+        # Written long before the 60s flush interval
+        assert purposes(insert.batches) == ["a", "b"]
+    finally:
+        await ledger.stop()
+
+
+@pytest.mark.asyncio
+async def test_stop_flushes_what_is_still_buffered(monkeypatch, insert):
+    ledger = make_ledger(monkeypatch, batch_size=100)
+    ledger.start()
+    ledger.record("a", "gpt-4o", USAGE, 0.1)
+    ledger.record("b", "gpt-4o", None, 0.1, outcome="error")
+
+    await asyncio.wait_for(ledger.stop(), timeout=1)
+
+    assert purposes(insert.batches) == ["a", "b"]
+    assert insert.batches[0][1][4:7] == (0, 0, 0)
+    assert insert.batches[0][1][8] == "error"
+    assert ledger.stats()["buffered"] == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_requeues_the_batch_in_order(monkeypatch, insert):
+    ledger = make_ledger(monkeypatch, batch_size=2)
+    for i in range(3):
+        ledger.record(f"call-{i}", "gpt-4o", USAGE, 0.1)
+    insert.failures = 1
+
+    assert await ledger.flush() == 0
+    assert ledger.stats() == {"buffered": 3, "written": 0, "dropped": 0, "failed_flushes": 1}
+
+    assert await ledger.flush() == 3
+    assert purposes(insert.batches) == ["call-0", "call-1", "call-2"]
+
+
+@pytest.mark.asyncio
+async def test_requeue_that_overflows_the_buffer_counts_dropped_rows(monkeypatch):
+    ledger = make_ledger(monkeypatch, batch_size=3, buffer_max=5)
+    for i in range(4):
+        ledger.record(f"old-{i}", "gpt-4o", USAGE, 0.1)
+
+    async def insert_while_recording(rows):
+        # New calls are recorded while the failing write is in flight
+        for i in range(3):
+            ledger.record(f"new-{i}", "gpt-4o", USAGE, 0.1)
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(db, "insert_llm_usage", insert_while_recording)
+    assert await ledger.flush() == 0
+
+    # Only one slot was left: the newest row of the failed batch goes back,
+    # the two oldest are dropped and counted
+    assert [row[2] for row in ledger._buffer] == ["old-2", "old-3", "new-0", "new-1", "new-2"]
+    assert ledger.stats()["dropped"] == 2
+    assert ledger.stats()["buffered"] == 5
+
+
+@pytest.mark.asyncio
+async def test_record_on_a_full_buffer_counts_the_dropped_row(monkeypatch, insert):
+    ledger = make_ledger(monkeypatch, batch_size=100, buffer_max=2)
+    for i in range(3):
+        ledger.record(f"call-{i}", "gpt-4o", USAGE, 0.1)
+
+    assert [row[2] for row in ledger._buffer] == ["call-1", "call-2"]
+    assert ledger.stats()["dropped"] == 1
+
+
+@pytest_asyncio.fixture
+async def pool(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    await db.initialize()
+    yield db.pool
+    await db.close()
+
+
+@needs_db
+@pytest.mark.asyncio
+async def test_rows_land_in_llm_usage(monkeypatch, pool):
+    ledger = make_ledger(monkeypatch, batch_size=2)
+    async with db.acquire() as conn:
+        before = await conn.fetchval("SELECT COUNT(*) FROM llm_usage WHERE purpose = 'ledger-test'")
+    for _ in range(3):
+        ledger.record("ledger-test", "gpt-4o", USAGE, 0.1)
+
+    assert await ledger.flush() == 3
+    async with db.acquire() as conn:
+        after = await conn.fetchval("SELECT COUNT(*) FROM llm_usage WHERE purpose = 'ledger-test'")
+    assert after - before == 3
@@ -1,4 +1,38 @@
 import { NextResponse } from 'next/server';
+import { randomBytes } from 'crypto';
+
+// W3C trace context: continue the browser's trace if it sent one, otherwise
+// start a new one here so the proxy log line and backend spans share an id
+function traceHeaders(request: Request): Record<string, string> {
+    const headers: Record<string, string> = {};
+    const traceparent = request.headers.get('traceparent');
+    if (traceparent) {
+        headers['traceparent'] = traceparent;
+        const tracestate = request.headers.get('tracestate');
+        if (tracestate) {
+            headers['tracestate'] = tracestate;
+        }
+    } else {
+        headers['traceparent'] = `00-${randomBytes(16).toString('hex')}-${randomBytes(8).toString('hex')}-01`;
+    }
+    return headers;
+}
+
+// Client address for the backend's rate limit: the rightmost X-Forwarded-For
+// hop, written by the edge proxy in front of this server (see edge/nginx.conf).
+// Hops to its left come from the browser and are dropped, not passed on
+function clientAddress(request: Request): string {
+    const hops = (request.headers.get('x-forwarded-for') || '')
+        .split(',')
+        .map((hop) => hop.trim())
+        .filter(Boolean);
+    const address = hops[hops.length - 1] || request.headers.get('x-real-ip');
+    if (address) {
+        return address;
+    }
+    console.warn("Chat request without X-Forwarded-For: the backend rate-limits it as 'unknown'");
+    return 'unknown';
+}
 
 export async function POST(request: Request) {
     try {
@@ -11,26 +45,44 @@ export async function POST(request: Request) {
         // 3. Hardcoded Default
         const BACKEND_URL = process.env.BACKEND_INTERNAL_URL || process.env.NEXT_PUBLIC_API_URL || "http://spapperi-backend:8000";
 
-        console.log(`Proxying chat request to: ${BACKEND_URL}/api/chat`);
+        const trace = traceHeaders(request);
+        const traceId = trace['traceparent'].split('-')[1];
+        console.log(`Proxying chat request to: ${BACKEND_URL}/api/chat (trace ${traceId})`);
+
+        const headers: Record<string, string> = {
+            'Content-Type': 'application/json',
+            ...trace,
+        };
+        // Forward the client's idempotency key so retries are replayed, not re-run
+        const idempotencyKey = request.headers.get('Idempotency-Key');
+        if (idempotencyKey) {
+            headers['Idempotency-Key'] = idempotencyKey;
+        }
+        // Always sent, or every user would share the bucket of this proxy's own address
+        headers['X-Forwarded-For'] = clientAddress(request);
 
         const response = await fetch(`${BACKEND_URL}/api/chat`, {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
+            headers,
             body: JSON.stringify(body),
         });
 
         if (!response.ok) {
-            console.error("Backend error:", response.status, response.statusText);
+            console.error("Backend error:", response.status, response.statusText, `(trace ${traceId})`);
+            const errorHeaders: Record<string, string> = { 'X-Trace-Id': traceId };
+            // 429 (admission control) and 409 (turn in progress) tell the client when to retry
+            const retryAfter = response.headers.get('Retry-After');
+            if (retryAfter) {
+                errorHeaders['Retry-After'] = retryAfter;
+            }
             return NextResponse.json(
                 { error: "Backend service unavailable" },
-                { status: response.status }
+                { status: response.status, headers: errorHeaders }
             );
         }
 
         const data = await response.json();
-        return NextResponse.json(data);
+        return NextResponse.json(data, { headers: { 'X-Trace-Id': traceId } });
 
     } catch (error) {
         console.error("Proxy Error:", error);
@@ -23,6 +23,9 @@ export default function ConfiguratorPage() {
     const [isGeneratingReport, setIsGeneratingReport] = useState(false);
     const [selectedCheckboxes, setSelectedCheckboxes] = useState<string[]>([]);
     const messagesEndRef = useRef<HTMLDivElement>(null);
+    // Idempotency key of the message being sent, kept until the backend answers:
+    // a double click or a resend after an error reuses it and gets the stored reply
+    const pendingSendRef = useRef<{ message: string; key: string } | null>(null);
 
     // Load conversation ID from local storage on mount
     useEffect(() => {
@@ -44,6 +47,36 @@ export default function ConfiguratorPage() {
         setHasConsented(true);
         setChatStarted(true);
 
+        // Fast path: the backend checkpoint restores recent messages and the pending question UI
+        try {
+            const res = await fetch(`/api/conversation/${convId}/resume`);
+            if (res.ok) {
+                const data = await res.json();
+                if (data.messages && data.messages.length > 0) {
+                    const formattedMessages = data.messages.map((msg: any) => ({
+                        role: msg.role,
+                        text: msg.content,
+                        image_url: msg.image_url
+                    }));
+
+                    const lastMsg = formattedMessages[formattedMessages.length - 1];
+                    if (lastMsg.role === 'assistant') {
+                        if (data.is_complete) {
+                            lastMsg.export_file = data.export_file;
+                        } else {
+                            lastMsg.ui_type = data.ui_type;
+                            lastMsg.options = data.options;
+                        }
+                    }
+
+                    setMessages(formattedMessages);
+                    return; // Restored from checkpoint
+                }
+            }
+        } catch (e) {
+            console.error('Failed to resume conversation:', e);
+        }
+
         // Try to load conversation history
         try {
             const res = await fetch(`/api/conversation/${convId}/history`);
@@ -87,9 +120,19 @@ export default function ConfiguratorPage() {
         }
     };
 
+    const idempotencyKeyFor = (message: string) => {
+        let pending = pendingSendRef.current;
+        if (!pending || pending.message !== message) {
+            pending = { message, key: crypto.randomUUID() };
+            pendingSendRef.current = pending;
+        }
+        return pending.key;
+    };
+
     const resetChat = () => {
         // Clear localStorage and reset state
         localStorage.removeItem('spapperi_conversation_id');
+        pendingSendRef.current = null;
         setConversationId(null);
         setMessages([]);
         setChatStarted(false);
@@ -110,12 +153,15 @@ export default function ConfiguratorPage() {
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
                     message: "Ciao",
-                    conversation_id: conversationId
+                    conversation_id: conversationId,
+                    // Lets the backend replay the stored answer if this send is retried
+                    idempotency_key: idempotencyKeyFor("Ciao")
                 })
             });
 
             if (!res.ok) throw new Error("API Error");
             const data = await res.json();
+            pendingSendRef.current = null;
 
             setMessages([{
                 role: 'assistant',
@@ -172,13 +218,16 @@ export default function ConfiguratorPage() {
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
                     message: userMsg,
-                    conversation_id: conversationId // Send stored ID or null
+                    conversation_id: conversationId, // Send stored ID or null
+                    // Lets the backend replay the stored answer if this send is retried
+                    idempotency_key: idempotencyKeyFor(userMsg)
                 })
             });
 
             if (!res.ok) throw new Error("API Error");
 
             const data = await res.json();
+            pendingSendRef.current = null;
             setMessages(prev => [...prev, {
                 role: 'assistant',
                 text: data.response,
@@ -222,13 +271,16 @@ export default function ConfiguratorPage() {
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
                     message: selectionJSON,
-                    conversation_id: conversationId
+                    conversation_id: conversationId,
+                    // Lets the backend replay the stored answer if this send is retried
+                    idempotency_key: idempotencyKeyFor(selectionJSON)
                 })
             });
 
             if (!res.ok) throw new Error("API Error");
 
             const data = await res.json();
+            pendingSendRef.current = null;
             setMessages(prev => [...prev, {
                 role: 'assistant',
                 text: data.response,